@@ -0,0 +1,397 @@
+"""
+参数优化用的精简 broker。
+
+BackBroker 为每个订单创建 Order 对象，提交、接受、成交都要发通知给策略，
+优化时这部分占了每根 K 线的大部分时间。我们的策略只用下一根 K 线开盘价成交的
+市价单和按比例收取的手续费，FastBroker 只实现这一种情况：
+
+- 持仓数量和均价保存在按数据源排列的 numpy 数组中，现金和总资产为两个浮点数；
+- 订单只是 [编号, 数据源序号, 数量, 下单价, 下单时间] 的列表，buy/sell 返回订单编号；
+- 下单后的资金检查、成交价格和手续费、开仓资金不足时作废都和 BackBroker 一样，
+  最终资产只有浮点舍入误差，可以用 check_parity 对比；
+- 不发送订单和交易通知，notify_order/notify_trade 不会被调用，TradeAnalyzer 统计
+  不到交易，平仓次数保存在 broker.closed 中（ClosedTrades 分析器），每笔平仓交易的
+  净盈亏（和 Trade.pnlcomm 相同）累计在 broker.pnls 中（RunStats 用来计算 SQN）。
+
+getposition、getvalue、getcash 和策略的 order_target_percent/order_target_value/
+close 都可以照常使用。依赖 notify_order 维护状态的策略（例如 mystudy 中的
+MyStrategy）不能使用。
+
+    cerebro.setbroker(FastBroker())
+"""
+import math
+
+import backtrader as bt
+import numpy as np
+
+from backtest.backtest_stats import Welford
+
+
+def _split(oldsize, size):
+    """
+    和 bt.Position.update 一样，把成交数量分成 (开仓, 平仓) 两部分
+    """
+    newsize = oldsize + size
+    if not newsize:
+        return 0, size
+    if not oldsize:
+        return size, 0
+    if (oldsize > 0) == (size > 0):
+        return size, 0
+    if (newsize > 0) == (oldsize > 0):
+        return 0, size
+    return newsize, -oldsize
+
+
+def _avgprice(oldsize, oldprice, size, price):
+    """
+    和 bt.Position.update 一样计算成交后的持仓均价
+    """
+    newsize = oldsize + size
+    if not newsize:
+        return 0.0
+    if not oldsize:
+        return price
+    if (oldsize > 0) == (size > 0):
+        return (oldprice * oldsize + size * price) / newsize
+    if (newsize > 0) == (oldsize > 0):
+        return oldprice
+    return price
+
+
+class FastBroker(bt.broker.BrokerBase):
+    """
+    只支持市价单的精简 broker，接口和 BackBroker 的常用部分相同
+    """
+    params = (
+        ('cash', 10000.0),
+        ('checksubmit', True),
+    )
+
+    def init(self):
+        super(FastBroker, self).init()
+        self.startingcash = self.cash = self.p.cash
+        self._value = self.cash
+
+        self._datas = []
+        self._index = dict()
+        self.sizes = np.zeros(0)
+        self.prices = np.zeros(0)
+        # 每个数据源当前交易（从开仓到平仓）累计的盈亏和手续费
+        self.tradepnl = np.zeros(0)
+        self.tradecomm = np.zeros(0)
+        # 持仓第一次用到的顺序，和 BackBroker.positions 的顺序一致，总资产按这个顺序累加
+        self._touched = dict()
+
+        self._submitted = []
+        self._pending = []
+        self._ref = 0
+        self.closed = 0
+        self.pnls = Welford()
+        self.margins = 0
+
+    def start(self):
+        super(FastBroker, self).start()
+        cerebro = getattr(self, 'cerebro', None)
+        if cerebro is not None:
+            for data in cerebro.datas:
+                self._slot(data)
+
+    def _slot(self, data):
+        i = self._index.get(data)
+        if i is None:
+            i = self._index[data] = len(self._datas)
+            self._datas.append(data)
+            self.sizes = np.append(self.sizes, 0.0)
+            self.prices = np.append(self.prices, 0.0)
+            self.tradepnl = np.append(self.tradepnl, 0.0)
+            self.tradecomm = np.append(self.tradecomm, 0.0)
+        return i
+
+    def _touch(self, data):
+        i = self._slot(data)
+        self._touched.setdefault(i)
+        return i
+
+    def get_cash(self):
+        return self.cash
+
+    getcash = get_cash
+
+    def set_cash(self, cash):
+        self.startingcash = self.cash = self.p.cash = cash
+        self._value = cash
+
+    setcash = set_cash
+
+    def get_value(self, datas=None, mkt=False, lever=False):
+        if not datas:
+            return self._value
+
+        value = 0.0 if len(datas) == 1 else self.cash
+        for data in datas:
+            i = self._touch(data)
+            value += self.getcommissioninfo(data).getvaluesize(
+                self.sizes[i], data.close[0])
+        return value
+
+    getvalue = get_value
+
+    def getposition(self, data, clone=True):
+        i = self._touch(data)
+        return bt.Position(self.sizes[i], self.prices[i])
+
+    @property
+    def positions(self):
+        return {data: self.getposition(data) for data in self._datas}
+
+    def position_sizes(self, datas):
+        """
+        datas 中各个数据源的持仓数量，datas 和 cerebro.datas 的顺序相同时返回成交时
+        直接更新的数组本身
+        """
+        index = [self._slot(data) for data in datas]
+        if index == list(range(len(self._datas))):
+            return self.sizes
+        return self.sizes[index]
+
+    def get_notification(self):
+        return None
+
+    def buy(self, owner, data, size, price=None, plimit=None, exectype=None,
+            **kwargs):
+        return self._submit(data, size, price, exectype)
+
+    def sell(self, owner, data, size, price=None, plimit=None, exectype=None,
+             **kwargs):
+        return self._submit(data, -size, price, exectype)
+
+    def _submit(self, data, size, price, exectype):
+        if exectype not in (None, bt.Order.Market):
+            raise ValueError('FastBroker 只支持市价单')
+
+        self._ref += 1
+        order = [
+            self._ref,
+            self._slot(data), size, price or data.close[0], data.datetime[0]
+        ]
+        if self.p.checksubmit:
+            self._submitted.append(order)
+        else:
+            self._pending.append(order)
+        return self._ref
+
+    def cancel(self, order):
+        for pending in self._pending:
+            if pending[0] == order:
+                self._pending.remove(pending)
+                return True
+        return False
+
+    def next(self):
+        if self._submitted:
+            self._check_submitted()
+        if self._pending:
+            self._execute_pending()
+        self._update_value()
+
+    def _check_submitted(self):
+        """
+        和 BackBroker.check_submitted 一样，按提交顺序以下单价模拟成交，
+        现金（包括被拒绝的订单）逐个累计，成交后现金为负的订单被拒绝
+        """
+        cash = self.cash
+        sizes = dict()
+        for order in self._submitted:
+            _, i, size, price, _ = order
+            data = self._datas[i]
+            self._touch(data)
+            comminfo = self.getcommissioninfo(data)
+
+            possize = sizes.get(i, self.sizes[i])
+            opened, closed = _split(possize, size)
+            sizes[i] = possize + size
+
+            if closed:
+                closecash = comminfo.getvaluesize(-closed, price)
+                if closecash > 0:
+                    closecash /= comminfo.get_leverage()
+                cash += closecash
+                cash -= comminfo.getcommission(closed, price)
+            if opened:
+                opencash = comminfo.getvaluesize(opened, price)
+                if opencash > 0:
+                    opencash /= comminfo.get_leverage()
+                cash -= opencash
+                cash -= comminfo.getcommission(opened, price)
+
+            if cash >= 0.0:
+                self._pending.append(order)
+            else:
+                self.margins += 1
+        self._submitted = []
+
+    def _execute_pending(self):
+        pending = []
+        for order in self._pending:
+            _, i, size, _, created = order
+            data = self._datas[i]
+            if data.datetime[0] <= created:
+                # 只能在下单之后的 K 线成交
+                pending.append(order)
+                continue
+            self._execute(i, data, size, data.open[0])
+        self._pending = pending
+
+    def _execute(self, i, data, size, price):
+        """
+        和 BackBroker._execute 一样按开盘价成交，开仓部分资金不足时作废
+        """
+        comminfo = self.getcommissioninfo(data)
+        oldsize, oldprice = self.sizes[i], self.prices[i]
+        opened, closed = _split(oldsize, size)
+
+        cash = self.cash
+        if closed:
+            pnl = comminfo.profitandloss(-closed, oldprice, price)
+            closecash = comminfo.getvaluesize(-closed, oldprice)
+            if closecash > 0:
+                closecash /= comminfo.get_leverage()
+            closecomm = comminfo.getcommission(closed, price)
+            cash += closecash + pnl * comminfo.stocklike
+            cash -= closecomm
+            self.cash = cash
+            self.tradepnl[i] += pnl
+            self.tradecomm[i] += closecomm
+
+        if opened:
+            opencash = comminfo.getvaluesize(opened, price)
+            if opencash > 0:
+                opencash /= comminfo.get_leverage()
+            opencomm = comminfo.getcommission(opened, price)
+            cash -= opencash
+            cash -= opencomm
+            if cash < 0.0:
+                opened = 0
+                self.margins += 1
+            else:
+                self.cash = cash
+
+        execsize = closed + opened
+        if execsize:
+            newsize = oldsize + execsize
+            if oldsize and (not newsize or (newsize > 0) != (oldsize > 0)):
+                self.closed += 1
+                self.pnls.add(self.tradepnl[i] - self.tradecomm[i])
+                self.tradepnl[i] = self.tradecomm[i] = 0.0
+            if opened:
+                self.tradecomm[i] += opencomm
+            self.prices[i] = _avgprice(oldsize, oldprice, execsize, price)
+            self.sizes[i] = newsize
+
+    def _update_value(self):
+        """
+        和 BackBroker._get_value 一样累加持仓市值
+        """
+        value = 0.0
+        for i in self._touched:
+            size = self.sizes[i]
+            if not size:
+                continue
+            data = self._datas[i]
+            comminfo = self.getcommissioninfo(data)
+            close = data.close[0]
+            dvalue = comminfo.getvaluesize(size, close)
+            if dvalue > 0:
+                dunrealized = comminfo.profitandloss(size, self.prices[i],
+                                                     close)
+                value += (dvalue - dunrealized) / comminfo.get_leverage()
+                value += dunrealized
+            else:
+                value += dvalue
+        self._value = self.cash + value
+
+
+class ClosedTrades(bt.Analyzer):
+    """
+    FastBroker 不发送交易通知，用 broker 中的平仓次数代替 TradeAnalyzer 的
+    total.closed
+    """
+
+    def create_analysis(self):
+        self.rets = bt.AutoOrderedDict()
+
+    def stop(self):
+        self.rets.total.closed = getattr(self.strategy.broker, 'closed', 0)
+
+
+def run_cerebro(strategy,
+                funds,
+                period,
+                fromdate=None,
+                todate=None,
+                cash=200000.0,
+                commission=0.00015,
+                fast=True):
+    """
+    用 FastBroker（fast 为 False 时用 BackBroker）回测一组参数，
+    返回 (最终总资产, 平仓次数)
+    """
+    import contextlib
+    import io
+
+    from backtest.backtest_feeds import ETFStoreData
+    from backtest.backtest_panel import fund_sources
+
+    sources = fund_sources(('etfs', 'lofs'))
+    cerebro = bt.Cerebro(stdstats=False)
+    if fast:
+        cerebro.setbroker(FastBroker())
+    kwargs = dict(period=period)
+    if 'printlog' in strategy.params._getkeys():
+        kwargs['printlog'] = False
+    cerebro.addstrategy(strategy, **kwargs)
+    for fund in funds:
+        cerebro.adddata(
+            ETFStoreData(dataname=sources.get(fund, fund),
+                         fromdate=fromdate,
+                         todate=todate))
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addanalyzer(ClosedTrades if fast else bt.analyzers.TradeAnalyzer,
+                        _name='trades')
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        strat = cerebro.run(maxcpus=1)[0]
+    trades = strat.analyzers.trades.get_analysis()
+    return cerebro.broker.getvalue(), trades.get('total', {}).get('closed', 0)
+
+
+def check_parity(strategy,
+                 funds,
+                 periods,
+                 fromdate=None,
+                 todate=None,
+                 cash=200000.0,
+                 commission=0.00015,
+                 tolerance=1e-6):
+    """
+    对比 FastBroker 和 BackBroker 的最终资产和平仓次数，
+    返回 [(period, FastBroker 资产, BackBroker 资产)]，不一致时抛出 AssertionError
+    """
+    result = []
+    for period in periods:
+        value, closed = run_cerebro(strategy, funds, period, fromdate, todate,
+                                    cash, commission)
+        expected, expected_closed = run_cerebro(strategy, funds, period,
+                                                fromdate, todate, cash,
+                                                commission, False)
+        result.append((period, value, expected))
+        if not math.isclose(value, expected,
+                            abs_tol=tolerance) or closed != expected_closed:
+            raise AssertionError(
+                f'{strategy.__name__} period={period}: '
+                f'FastBroker {value:.2f}/{closed}，'
+                f'BackBroker {expected:.2f}/{expected_closed}')
+    return result
+
@@ -0,0 +1,236 @@
+"""
+回测结果缓存。
+
+同一策略、同样的参数、基金、日期区间和资金设置，只要数据文件没有变化，结果就一定相同。
+缓存以这些内容的哈希为键保存在 datas/.cache/results 下：
+
+- 策略的键包含策略类（以及它继承的本项目中的父类）的源码哈希，改了策略代码自动失效；
+- 回测路径上其他模块（数据读取、指标、撮合、统计、优化等，见 CODE_FILES）的源码
+  哈希也参与计算，改了这些模块同样失效；
+- 数据文件以内容哈希参与计算，数据更新后自动失效，旧的结果由 LRU 淘汰；
+- 缓存总大小超过 max_bytes 时删除最久没有用到的结果。
+"""
+import datetime
+import hashlib
+import inspect
+import json
+import os
+import pickle
+
+import backtrader as bt
+
+from backtest.backtest_feeds import ETFCsvData
+from backtest.backtest_store import tail
+
+mainpath = os.path.dirname(os.path.dirname(__file__))
+
+CACHE_DIR = os.path.join(mainpath, 'datas/.cache/results')
+
+# 回测路径上除策略类之外的所有模块：组装 Cerebro、读取数据、计算指标、撮合、
+# 统计和生成记录，以及 backtest_strategy 中策略共用的函数。源码变化时所有缓存的
+# 结果失效
+CODE_FILES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), f'{name}.py')
+    for name in ('backtest_broker', 'backtest_cerebro', 'backtest_feeds',
+                 'backtest_indicators', 'backtest_intraday', 'backtest_log',
+                 'backtest_matrix', 'backtest_optimizer', 'backtest_registry',
+                 'backtest_shared', 'backtest_stats', 'backtest_store',
+                 'backtest_strategy', 'backtest_walkforward')
+]
+
+# 每个文件的内容哈希，以 (大小, 修改时间) 判断文件是否变化，不变的文件只读一次
+_file_hashes = dict()
+
+
+def file_hash(path):
+    """
+    数据文件的内容哈希
+    """
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+
+    cached = _file_hashes.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    _file_hashes[path] = (signature, digest)
+    return digest
+
+
+def strategy_hash(strategy):
+    """
+    策略类的源码哈希，包括 backtrader 之外的所有父类
+    """
+    sha = hashlib.sha1()
+    for cls in strategy.__mro__:
+        if cls is bt.Strategy:
+            break
+        try:
+            sha.update(inspect.getsource(cls).encode('utf-8'))
+        except (OSError, TypeError):
+            sha.update(cls.__qualname__.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def code_hash():
+    """
+    CODE_FILES 中各模块的源码哈希
+    """
+    sha = hashlib.sha1()
+    for path in CODE_FILES:
+        sha.update(file_hash(path).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def clamp_end_date(datapaths, end_date, csvformat=ETFCsvData):
+    """
+    晚于所有数据最后一天的结束日期都是等价的（例如 datetime.now()），统一成最后一天
+    """
+    if end_date is None:
+        return None
+    last = max(
+        (int(array[-1, 0])
+         for array in (tail(p, 1, csvformat) for p in datapaths) if len(array)),
+        default=None)
+    if last is None:
+        return end_date
+    last_dt = datetime.datetime.combine(datetime.date.fromordinal(last),
+                                        datetime.time(23, 59, 59, 999990))
+    return min(end_date, last_dt)
+
+
+def run_key(strategy, params, datapaths, start_date, end_date, broker,
+            kind='run'):
+    """
+    一次回测的缓存键。broker 为资金、手续费等设置的字典，kind 区分结果的格式。
+    """
+    datapaths = list(datapaths)
+    parts = {
+        'kind': kind,
+        'strategy': f'{strategy.__module__}.{strategy.__qualname__}',
+        'source': strategy_hash(strategy),
+        'code': code_hash(),
+        'params': params,
+        'datas': [[os.path.basename(p), file_hash(p)] for p in datapaths],
+        'start_date': start_date,
+        'end_date': clamp_end_date(datapaths, end_date),
+        'broker': broker,
+    }
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def to_dict(analysis):
+    """
+    把分析器结果（AutoOrderedDict 等）转换成普通的 dict，方便保存
+    """
+    if isinstance(analysis, dict):
+        return {k: to_dict(v) for k, v in analysis.items()}
+    return analysis
+
+
+class ResultCache(object):
+    """
+    磁盘上的回测结果缓存，每个结果一个 pickle 文件，文件的修改时间即最近使用时间。
+
+    put 时累计缓存的总大小，只有超过 max_bytes 时才扫描目录，淘汰到 max_bytes 的
+    low 倍以下，多次 put 才扫描一次。其他进程写入的结果在下一次扫描时计入。
+    """
+
+    def __init__(self, path=CACHE_DIR, max_bytes=256 * 1024 * 1024, low=0.9):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low = low
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.pkl')
+
+    def get(self, key, default=None):
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._file(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            added = f.tell()
+        try:
+            added -= os.stat(path).st_size
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += added
+        if self._size > self.max_bytes:
+            self.evict(int(self.max_bytes * self.low))
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def entries(self):
+        """
+        [(最近使用时间, 大小, 路径)]，最久没有用到的在前
+        """
+        result = []
+        for filename in os.listdir(self.path):
+            if not filename.endswith('.pkl'):
+                continue
+            path = os.path.join(self.path, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            result.append((stat.st_mtime_ns, stat.st_size, path))
+        return sorted(result)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes=None):
+        """
+        删除最久没有用到的结果，直到总大小不超过 max_bytes（默认为 self.max_bytes），
+        返回删除的个数
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._size = total
+        return removed
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+        self._size = 0
@@ -2,57 +2,264 @@ import os
 import sys
 
 import backtrader as bt
-import backtrader.analyzers as btanalyzers
-from backtrader_plotting import Bokeh
-from backtrader_plotting.schemes import Tradimo
 
-from backtest.backtest_feeds import ETFCsvData
+from backtest.backtest_broker import FastBroker
+from backtest.backtest_cache import run_key, to_dict
+from backtest.backtest_feeds import ETFStoreData
+from backtest.backtest_journal import Journal
+from backtest.backtest_matrix import best_by, run_matrix
+from backtest.backtest_optimizer import RECORD_KIND, add_metrics, optimize
+from backtest.backtest_shared import SharedFundGroup
+from backtest.backtest_stats import RunStats
+from backtest.backtest_walkforward import print_report, walkforward
 
+COMMISSION = 0.00015
 
-def backtestopt(cash, funds, periods, start_date, end_date, strategy):
+# backtestrun 的画图方式
+PLOTS = ('bokeh', 'lttb', None)
 
-    cerebro = bt.Cerebro()
-    cerebro.optstrategy(strategy, period=periods, printlog=False)
 
+def fund_datapaths(funds):
     modpath = os.path.dirname(os.path.abspath(sys.argv[0]))
+    return {
+        fund: os.path.join(modpath, f'datas/{fund}.csv')
+        for fund in funds
+    }
 
-    for fund in funds:
-        datapath = os.path.join(modpath, f'datas/{fund}.csv')
-        data = ETFCsvData(dataname=datapath,
-                          fromdate=start_date,
-                          todate=end_date)
+
+def print_record(rec):
+    print(f"{rec['params']['period']}, "
+          f"{rec['total_return'] * 100:.2f}%, "
+          f"{rec['annual_return'] * 100:.2f}%, {rec['sharpe']}, "
+          f"{rec['max_drawdown']:.2f}%, {rec['trades']}")
+
+
+def backtestopt(cash,
+                funds,
+                periods,
+                start_date,
+                end_date,
+                strategy,
+                maxcpus=None,
+                shared=False,
+                chunksize=1,
+                progress=None,
+                good=None,
+                target=None,
+                cache=None,
+                fast=False,
+                store=None,
+                group=None):
+    """
+    对 periods 中的每个周期回测，每完成一个打印一行并返回所有记录（见 backtest_optimizer）。
+
+    shared 为 True 时，基金数据只加载一次放入共享内存，各个优化进程只读挂载，
+    不再在每个任务中重复加载数据。good 和 target 用于找到足够多的好结果后提前结束。
+    cache 为 ResultCache 时，已经算过的周期直接使用缓存的记录，只回测其余的周期。
+    fast 为 True 时使用 FastBroker（见 backtest_broker），结果和 BackBroker 相同，
+    缓存的记录可以共用。store 为 ResultStore 时把新回测的记录保存到结果库中，
+    组合名为 group（默认为基金代码）。
+    """
+    datapaths = fund_datapaths(funds)
+    broker = {'cash': cash, 'commission': COMMISSION}
+
+    print('period, Total ROI, Annual ROI, Sharpe, Max DrawDown, Trades')
+
+    records = []
+    keys = dict()
+    todo = list(periods)
+    if cache is not None:
+        todo = []
+        for period in periods:
+            keys[period] = run_key(strategy, {
+                'period': period,
+                'printlog': False
+            }, datapaths.values(), start_date, end_date, broker, RECORD_KIND)
+            rec = cache.get(keys[period])
+            if rec is None:
+                todo.append(period)
+            else:
+                records.append(rec)
+                print_record(rec)
+        if not todo:
+            return records
+
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.optstrategy(strategy, period=todo, printlog=False)
+
+    shared_group = None
+    if shared:
+        shared_group = SharedFundGroup(datapaths)
+        datas = shared_group.feeds(fromdate=start_date, todate=end_date)
+    else:
+        datas = [
+            ETFStoreData(dataname=datapath,
+                         fromdate=start_date,
+                         todate=end_date) for datapath in datapaths.values()
+        ]
+
+    for data in datas:
         cerebro.adddata(data)
 
+    if fast:
+        cerebro.setbroker(FastBroker())
     cerebro.broker.setcash(cash)
-    cerebro.broker.setcommission(commission=0.00015)
+    cerebro.broker.setcommission(commission=COMMISSION)
+    add_metrics(cerebro)
 
-    print('period, Total ROI, Annual ROI')
+    try:
+        for rec in optimize(cerebro,
+                            workers=maxcpus,
+                            chunksize=chunksize,
+                            progress=progress,
+                            good=good,
+                            target=target):
+            records.append(rec)
+            print_record(rec)
+            if cache is not None:
+                cache.put(keys[rec['params']['period']], rec)
+            if store is not None:
+                store.add(rec, group or ','.join(funds), funds,
+                          datapaths.values(), start_date, end_date)
+    finally:
+        if shared_group is not None:
+            shared_group.close()
+        if store is not None:
+            store.flush()
 
-    cerebro.run()
+    return records
 
 
-def backtestrun(cash, funds, period, start_date, end_date, strategy):
+def backtestmatrix(cash,
+                   groups,
+                   strategies,
+                   windows,
+                   maxcpus=None,
+                   chunksize=1,
+                   cache=None,
+                   fast=False,
+                   store=None):
+    """
+    回测实验矩阵（见 backtest_matrix），打印每个 (组合, 区间, 策略) 中 Sharpe 最高的一行，
+    返回全部结果的 DataFrame。store 为 ResultStore 时把新回测的结果保存到结果库中
+    """
+    funds = sorted({fund for group in groups.values() for fund in group})
+    frame = run_matrix(fund_datapaths(funds),
+                       groups,
+                       strategies,
+                       windows,
+                       cash,
+                       COMMISSION,
+                       workers=maxcpus,
+                       chunksize=chunksize,
+                       cache=cache,
+                       fast=fast,
+                       store=store)
+    print(best_by(frame).to_string(index=False))
+    return frame
 
-    cerebro = bt.Cerebro()
-    cerebro.addstrategy(strategy, period=period)
 
-    modpath = os.path.dirname(os.path.abspath(sys.argv[0]))
+def backtestwalkforward(cash,
+                        funds,
+                        periods,
+                        start_date,
+                        end_date,
+                        strategy,
+                        train_months=24,
+                        test_months=6,
+                        anchored=False,
+                        key='sharpe',
+                        maxcpus=None,
+                        fast=False):
+    """
+    滚动优化（见 backtest_walkforward），打印每个窗口选出的周期和样本外的收益，返回报告
+    """
+    report = walkforward(fund_datapaths(funds),
+                         strategy,
+                         periods,
+                         start_date,
+                         end_date,
+                         cash,
+                         COMMISSION,
+                         train_months=train_months,
+                         test_months=test_months,
+                         anchored=anchored,
+                         key=key,
+                         workers=maxcpus,
+                         fast=fast)
+    print_report(report)
+    return report
+
+
+def backtestrun(cash,
+                funds,
+                period,
+                start_date,
+                end_date,
+                strategy,
+                cache=None,
+                journal=None,
+                plot='bokeh'):
+    """
+    回测并画图，返回各个分析器的结果，统计指标在 'stats' 中（见 backtest_stats），
+    其中的 Sharpe 和原来的 SharpeRatio_A 一样由每年的收益率计算，和优化记录中按
+    每天的收益率年化的 Sharpe 不同。
+
+    cache 为 ResultCache 时，同样的回测直接返回缓存的分析结果，不再回测和画图。
+    journal 为目录时把每天的指标值、订单和成交记录到该目录（见 backtest_journal），
+    此时不使用缓存。plot 为 'bokeh' 时用 Bokeh 画出每一根 K 线，为 'lttb' 时按
+    窗口宽度抽样画图（见 backtest_plot），为 None 时不画图，也不导入画图的模块。
+    """
+    if plot not in PLOTS:
+        raise ValueError(f'plot 只能是 {PLOTS} 之一')
+    datapaths = fund_datapaths(funds)
+
+    key = None
+    if cache is not None and journal is None:
+        key = run_key(strategy, {'period': period}, datapaths.values(),
+                      start_date, end_date, {
+                          'cash': cash,
+                          'commission': COMMISSION
+                      }, 'stats')
+        analysis = cache.get(key)
+        if analysis is not None:
+            print('使用缓存的回测结果')
+            return analysis
 
-    for fund in funds:
-        datapath = os.path.join(modpath, f'datas/{fund}.csv')
-        data = ETFCsvData(dataname=datapath,
-                          fromdate=start_date,
-                          todate=end_date)
+    # observers 只用于 cerebro.plot
+    cerebro = bt.Cerebro(stdstats=plot == 'bokeh')
+    cerebro.addstrategy(strategy, period=period)
+
+    for datapath in datapaths.values():
+        data = ETFStoreData(dataname=datapath,
+                            fromdate=start_date,
+                            todate=end_date)
         cerebro.adddata(data)
 
     cerebro.broker.setcash(cash)
-    cerebro.broker.setcommission(commission=0.00015)
+    cerebro.broker.setcommission(commission=COMMISSION)
+
+    cerebro.addanalyzer(RunStats, _name='stats')
+    if journal is not None:
+        cerebro.addanalyzer(Journal, path=journal, _name='journal')
+    if plot == 'lttb':
+        from backtest.backtest_plot import PlotRecorder
+        cerebro.addanalyzer(PlotRecorder, _name='plot')
+
+    strat = cerebro.run()[0]
+    analysis = {
+        name: to_dict(analyzer.get_analysis())
+        for name, analyzer in strat.analyzers.getitems() if name != 'plot'
+    }
+    if key is not None:
+        cache.put(key, analysis)
 
-    cerebro.addanalyzer(btanalyzers.SharpeRatio_A, _name='sharp')
-    cerebro.addanalyzer(btanalyzers.AnnualReturn, _name='annualreturn')
-    cerebro.addanalyzer(btanalyzers.Returns, _name='return')
-    cerebro.addanalyzer(btanalyzers.SQN, _name='SQN')
+    if plot == 'bokeh':
+        from backtrader_plotting import Bokeh
+        from backtrader_plotting.schemes import Tradimo
+        cerebro.plot(Bokeh(style='bar', scheme=Tradimo()))
+    elif plot == 'lttb':
+        from backtest.backtest_plot import plot_run
+        plot_run(strat)
 
-    cerebro.run()
-    b = Bokeh(style='bar', scheme=Tradimo())
-    cerebro.plot(b)
+    return analysis
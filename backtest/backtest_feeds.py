@@ -1,10 +1,84 @@
 """
 编写私有的数据文件类。
 """
+import datetime
+import math
+import os
+
+import numpy as np
+from backtrader.feed import DataBase
 from backtrader.feeds import GenericCSVData
+from backtrader.utils.dateintern import (HOURS_PER_DAY, MINUTES_PER_DAY,
+                                         MUSECONDS_PER_DAY, SECONDS_PER_DAY)
+
+from backtest.backtest_store import load_store
+
+
+def seek_offset(path, target, column, separator=',', headers=True):
+    """
+    在按日期排序的 CSV 中二分查找第一行日期 >= target 的字节偏移。
+
+    target 和 CSV 中的日期都是 '%Y-%m-%d' 这类可以按字符串比较的格式。
+    """
+    target = target.encode()
+    separator = separator.encode()
+
+    with open(path, 'rb') as f:
+        if headers:
+            f.readline()
+        begin = f.tell()
+        end = f.seek(0, os.SEEK_END)
+
+        def linestart(pos):
+            # pos 之后（含 pos）第一个行首的偏移，以及这一行的内容
+            if pos > begin:
+                f.seek(pos - 1)
+                f.readline()
+            else:
+                f.seek(begin)
+            start = f.tell()
+            return start, f.readline()
+
+        lo, hi = begin, end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            _, line = linestart(mid)
+            if not line or line.split(separator)[column].strip() >= target:
+                hi = mid
+            else:
+                lo = mid + 1
+
+        return linestart(lo)[0]
 
 
-class ETFCsvData(GenericCSVData):
+class SeekCSVData(GenericCSVData):
+    """
+    有 fromdate 时直接定位到开始日期所在行，不再解析之前的全部历史。
+
+    超过 todate 的行由 DataBase.load 负责停止读取。
+    """
+
+    def start(self):
+        super(SeekCSVData, self).start()
+
+        if (self.p.fromdate is None or self.f is None
+                or hasattr(self.p.dataname, 'readline')
+                or not isinstance(self.p.dtformat, str)):
+            return
+
+        for dateformat in ('%Y-%m-%d', '%Y%m%d'):
+            if self.p.dtformat.startswith(dateformat):
+                break
+        else:
+            return
+
+        target = self.p.fromdate.strftime(dateformat)
+        self.f.seek(
+            seek_offset(self.p.dataname, target, self.p.datetime,
+                        self.p.separator, self.p.headers))
+
+
+class ETFCsvData(SeekCSVData):
     params = (
         ('nullvalue', 0.0),
         ('dtformat', '%Y-%m-%d'),
@@ -17,7 +91,7 @@ class ETFCsvData(GenericCSVData):
         ('openinterest', -1),
     )
 
-class OpenFundCsvData(GenericCSVData):
+class OpenFundCsvData(SeekCSVData):
     params = (
         ('nullvalue', 0.0),
         ('dtformat', '%Y-%m-%d'),
@@ -29,3 +103,104 @@ class OpenFundCsvData(GenericCSVData):
         ('volume', 2),
         ('openinterest', -1),
     )
+
+
+class StoreData(DataBase):
+    """
+    从二进制存储（backtest_store）读取日线数据，dataname 仍然是 CSV 路径。
+
+    数据以内存映射方式访问，不复制整个文件；CSV 有更新时会自动重新转换。
+    csvformat 指定 CSV 的列布局。按日期列二分查找 fromdate/todate，
+    只读取区间内的行。
+    """
+    params = (('csvformat', ETFCsvData), )
+
+    def __init__(self):
+        if not self._name:
+            self._name, _ = os.path.splitext(os.path.basename(self.p.dataname))
+        self._array = None
+
+    def _getarray(self):
+        return load_store(self.p.dataname, self.p.csvformat)
+
+    def start(self):
+        super(StoreData, self).start()
+        self._array = self._getarray()
+        self._rows = None
+
+    def stop(self):
+        super(StoreData, self).stop()
+        self._array = None
+        self._rows = None
+
+    def preload(self):
+        super(StoreData, self).preload()
+        # 预加载之后不再需要映射，避免多进程优化时被 pickle
+        self._array = None
+        self._rows = None
+
+    def _window(self):
+        """
+        按日期列二分查找 fromdate/todate 对应的行区间
+        """
+        dates = self._array[:, 0]
+        begin, end = 0, len(dates)
+        if self.p.fromdate is not None:
+            begin = int(
+                np.searchsorted(dates, self.p.fromdate.toordinal(), 'left'))
+        if self.p.todate is not None:
+            end = int(
+                np.searchsorted(dates, self.p.todate.toordinal(), 'right'))
+        return begin, max(begin, end)
+
+    def _prepare(self):
+        begin, end = self._window()
+        window = self._array[begin:end]
+
+        sessionend = self.p.sessionend
+        if self._tz is None:
+            # 和 date2num(datetime.combine(date, sessionend)) 的结果完全一致
+            parts = (sessionend.hour / HOURS_PER_DAY,
+                     sessionend.minute / MINUTES_PER_DAY,
+                     sessionend.second / SECONDS_PER_DAY,
+                     sessionend.microsecond / MUSECONDS_PER_DAY)
+            dtnums = [math.fsum((x, ) + parts) for x in window[:, 0].tolist()]
+        else:
+            dtnums = [
+                self.date2num(
+                    datetime.datetime.combine(
+                        datetime.date.fromordinal(int(x)), sessionend))
+                for x in window[:, 0].tolist()
+            ]
+
+        columns = [window[:, i].tolist() for i in range(1, window.shape[1])]
+        self._rows = zip(dtnums, *columns)
+
+    def _load(self):
+        if self._array is None:
+            return False
+        if self._rows is None:
+            self._prepare()
+
+        row = next(self._rows, None)
+        if row is None:
+            return False
+
+        (self.lines.datetime[0], self.lines.open[0], self.lines.high[0],
+         self.lines.low[0], self.lines.close[0], self.lines.volume[0],
+         self.lines.openinterest[0]) = row
+        return True
+
+
+class ETFStoreData(StoreData):
+    """
+    ETFCsvData 的替代
+    """
+    params = (('csvformat', ETFCsvData), )
+
+
+class OpenFundStoreData(StoreData):
+    """
+    OpenFundCsvData 的替代
+    """
+    params = (('csvformat', OpenFundCsvData), )
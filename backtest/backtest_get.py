@@ -1,14 +1,83 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import akshare as ak
+import pandas as pd
 
 mainpath = os.path.dirname(os.path.dirname(__file__))
 
+HIST_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume']
+
+
+class AkshareSource(object):
+    """
+    ETF/LOF 日线数据源，使用 akshare 的新浪接口。
+
+    数据源只需要实现 fund_hist(symbol, start_date=None)，返回 HIST_COLUMNS 各列，
+    start_date 不为空时只返回该日期（含）之后的行。测试时可以换成 CsvSource。
+    akshare 在用到时才导入，离线使用 CsvSource 时不需要安装。
+    """
+
+    def fund_hist(self, symbol, start_date=None):
+        import akshare as ak
+
+        df = ak.fund_etf_hist_sina(symbol=symbol)
+        # 新浪接口不支持按日期查询，只能下载后过滤
+        return filter_since(df[HIST_COLUMNS], start_date)
+
+    def minute_hist(self, symbol, period='30', adjust='qfq'):
+        """
+        最近的分钟线，以时间为索引，包含 open/high/low/close/volume 列
+        """
+        import akshare as ak
+
+        df = ak.stock_zh_a_minute(symbol=symbol, period=period, adjust=adjust)
+        df.index = pd.to_datetime(df['day'])
+        return df[HIST_COLUMNS[1:]].apply(pd.to_numeric, errors='coerce')
+
+
+class CsvSource(object):
+    """
+    从本地目录读取 {symbol}.csv 的数据源，格式和 datas/etfs 中的文件相同，
+    用来替代 akshare 做离线测试。
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def fund_hist(self, symbol, start_date=None):
+        path = os.path.join(self.root, f'{symbol}.csv')
+        if not os.path.exists(path):
+            raise KeyError(symbol)
+        df = pd.read_csv(path, encoding='utf-8')
+        return filter_since(df[HIST_COLUMNS], start_date)
+
+
+def filter_since(df, start_date=None):
+    """
+    统一日期格式为 %Y-%m-%d，并只保留 start_date（含）之后的行
+    """
+    df = df.copy()
+    dates = pd.to_datetime(df['date'])
+    df['date'] = dates.dt.strftime('%Y-%m-%d')
+    if start_date is not None:
+        df = df[dates >= pd.Timestamp(start_date)]
+    return df.reset_index(drop=True)
+
+
+def fund_path(etf_fund_code, down_path=''):
+    if down_path in ('etfs', 'lofs'):
+        return os.path.join(mainpath, f'datas/{down_path}/{etf_fund_code}.csv')
+    return os.path.join(mainpath, f'datas/{etf_fund_code}.csv')
+
 
 def get_all_fund_list():
     """
     获取所有基金数据
     """
+    import akshare as ak
+
     fund_em_fund_name_df = ak.fund_em_fund_name()
     path = os.path.join(mainpath, f'datas/all_fund.csv')
     fund_em_fund_name_df.to_csv(path)
@@ -18,6 +87,8 @@ def get_etf_list():
     """
     获取etf基金清单
     """
+    import akshare as ak
+
     fund_list = ak.fund_etf_category_sina(symbol="ETF基金")
     path = os.path.join(mainpath, f'datas/etf_list.csv')
     fund_list.to_csv(path, encoding='utf-8')
@@ -27,32 +98,117 @@ def get_lof_list():
     """
     获取LOF基金清单
     """
+    import akshare as ak
+
     fund_list = ak.fund_etf_category_sina(symbol="LOF基金")
     path = os.path.join(mainpath, f'datas/lof_list.csv')
     fund_list.to_csv(path, encoding='utf-8')
 
 
-def get_fund_detail(etf_fund_code, down_path=''):
+def get_fund_detail(etf_fund_code, down_path='', source=None,
+                    incremental=False):
     """
     获取 ETF 基金数据
+
+    incremental 为 True 且文件已存在时，只追加本地最后日期之后的新数据。
+    返回写入的行数。
     """
-    fund_detail = ak.fund_etf_hist_sina(symbol=etf_fund_code)
-    path = ''
-    if down_path == '':
-        path = os.path.join(mainpath, f'datas/{etf_fund_code}.csv')
-    if down_path == 'etfs':
-        path = os.path.join(mainpath, f'datas/etfs/{etf_fund_code}.csv')
-    if down_path == 'lofs':
-        path = os.path.join(mainpath, f'datas/lofs/{etf_fund_code}.csv')
+    source = source or AkshareSource()
+    path = fund_path(etf_fund_code, down_path)
+
+    if incremental and os.path.exists(path):
+        return update_fund_detail(etf_fund_code, down_path, source)
 
+    fund_detail = source.fund_hist(etf_fund_code)
     fund_detail['fundname'] = etf_fund_code
     fund_detail.to_csv(path, encoding='utf-8')
+    return len(fund_detail)
+
+
+def read_last_row(path, blocksize=4096):
+    """
+    从文件末尾读取最后一行，不读取整个文件。
+
+    返回最后一行的内容和文件末尾的换行符（没有换行结尾时为空字符串）。
+    """
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        tail = b''
+        while pos > 0:
+            step = min(blocksize, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            lines = tail.rstrip(b'\r\n').splitlines()
+            if len(lines) > 1 or (pos == 0 and lines):
+                break
+        else:
+            return '', '\n'
+
+    if tail.endswith(b'\r\n'):
+        newline = '\r\n'
+    elif tail.endswith(b'\n'):
+        newline = '\n'
+    else:
+        newline = ''
+    return lines[-1].decode('utf-8'), newline
+
+
+def append_rows(path, text):
+    """
+    以一次写入的方式追加到文件末尾，失败时截断回原来的长度
+    """
+    data = text.encode('utf-8')
+    with open(path, 'ab') as f:
+        size = f.tell()
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(size)
+            raise
+
+
+def update_fund_detail(etf_fund_code, down_path, source):
+    """
+    读取本地最后一行的序号和日期，只下载并追加之后的数据
+    """
+    path = fund_path(etf_fund_code, down_path)
+    last_line, newline = read_last_row(path)
+    fields = last_line.split(',')
+    try:
+        last_index, last_date = int(fields[0]), pd.Timestamp(fields[1])
+    except (IndexError, ValueError):
+        # 只有表头或格式不对，退回全量下载
+        return get_fund_detail(etf_fund_code, down_path, source=source)
+
+    # 数据源可能忽略 start_date，返回和本地末尾重叠的行，这里再过滤一次
+    start_date = last_date + pd.Timedelta(days=1)
+    new_rows = filter_since(source.fund_hist(etf_fund_code,
+                                             start_date=start_date),
+                            start_date)
+    if len(new_rows) == 0:
+        return 0
+
+    new_rows['fundname'] = etf_fund_code
+    new_rows.index = range(last_index + 1, last_index + 1 + len(new_rows))
+
+    # 和原文件保持相同的换行符
+    lines = new_rows.to_csv(header=False).splitlines()
+    text = (newline or '\n').join(lines) + (newline or '\n')
+    if not newline:
+        text = '\n' + text
+    append_rows(path, text)
+    return len(new_rows)
 
 
 def get_open_fund_info(fund_code):
     """
     获取开放式基金数据
     """
+    import akshare as ak
+
     fund_data = ak.fund_em_open_fund_info(fund=fund_code, indicator="单位净值走势")
     fund_data_new = fund_data.rename(columns={
         '净值日期': 'datetime',
@@ -75,7 +231,7 @@ def download_open_fund():
         get_open_fund_info(fund_code=fund)
 
 
-def download_etf_fund():
+def download_etf_fund(incremental=False):
     """
     sh513050 中概互联
     sz159992 创新药
@@ -94,7 +250,7 @@ def download_etf_fund():
         'sz159915', 'sh518880', 'sh513100'
     ]
     for fund in funds:
-        get_fund_detail(fund)
+        get_fund_detail(fund, incremental=incremental)
 
 
 def name_list(csv_name):
@@ -111,25 +267,156 @@ def name_list(csv_name):
     return fund_list
 
 
-def download_all_fund(csv_name, down_path=''):
+class RateLimiter(object):
+    """
+    限制对同一个数据源的调用频率，每秒最多 rate 次，多个线程共用
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
 
-    from progress.bar import IncrementalBar
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
 
-    fund_list = name_list(csv_name)
 
-    bar = IncrementalBar('Download', max=len(fund_list))
-    new_fund_list = []
-    for fund in fund_list:
-        bar.next()
+def journal_path(csv_name, down_path=''):
+    name, _ = os.path.splitext(csv_name)
+    return os.path.join(mainpath, f'datas/.{name}_{down_path}.journal')
+
+
+def read_journal(path):
+    """
+    读取下载日志，返回 {基金代码: 状态}，后写入的状态覆盖之前的
+    """
+    journal = dict()
+    if not os.path.exists(path):
+        return journal
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 2:
+                journal[fields[0]] = fields[1]
+    return journal
+
+
+# 只有网络和 IO 错误重试，requests 的异常也是 OSError 的子类
+RETRY_ERRORS = (OSError, )
+
+
+def download_fund(fund, down_path, source, limiter, incremental, retries,
+                  backoff):
+    """
+    下载一个基金，网络和 IO 错误按指数退避重试，其他错误不重试。
+
+    返回状态和错误信息，状态为 'done'、'new'（数据源中还没有该基金）或 'failed'。
+    """
+    for attempt in range(retries + 1):
+        limiter.wait()
         try:
-            get_fund_detail(fund, down_path)
+            get_fund_detail(fund,
+                            down_path,
+                            source=source,
+                            incremental=incremental)
+            return 'done', None
         except KeyError:
-            new_fund_list.append(fund)
+            return 'new', None
+        except RETRY_ERRORS as e:
+            if attempt == retries:
+                return 'failed', repr(e)
+            time.sleep(backoff * 2**attempt)
+        except Exception as e:
+            return 'failed', repr(e)
+
+
+def download_all_fund(csv_name,
+                      down_path='',
+                      incremental=False,
+                      source=None,
+                      workers=4,
+                      rate=2.0,
+                      retries=3,
+                      backoff=1.0,
+                      progress=None):
+    """
+    并发下载 csv_name 清单中的所有基金。
+
+    最多 workers 个线程同时下载，对数据源的请求每秒不超过 rate 次，网络和 IO 错误
+    重试 retries 次。每个基金完成后写入下载日志，中断后再次运行会跳过已经完成的
+    基金；全部成功后删除日志。每完成一个基金调用 progress(已完成, 总数)，为 None
+    时显示进度条（用到时才导入 progress）。
+    """
+    source = source or AkshareSource()
+    limiter = RateLimiter(rate)
+
+    journal_file = journal_path(csv_name, down_path)
+    journal = read_journal(journal_file)
+
+    fund_list = [
+        fund for fund in name_list(csv_name)
+        if journal.get(fund) not in ('done', 'new')
+    ]
 
+    bar = None
+    if progress is None:
+        from progress.bar import IncrementalBar
+
+        bar = IncrementalBar('Download', max=len(fund_list))
+        progress = lambda done, total: bar.next()
+
+    start = time.time()
+    results = dict()
+    errors = dict()
+    with open(journal_file, 'a', encoding='utf-8') as journal_f, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_fund, fund, down_path, source, limiter,
+                            incremental, retries, backoff): fund
+            for fund in fund_list
+        }
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                fund = futures[future]
+                status, error = future.result()
+                results[fund] = status
+                if error is not None:
+                    errors[fund] = error
+                journal_f.write(f'{fund}\t{status}\n')
+                journal_f.flush()
+                progress(done, len(fund_list))
+        except BaseException:
+            # 中断时取消还没开始的下载，已完成的基金已经写入日志
+            for future in futures:
+                future.cancel()
+            raise
+    if bar is not None:
         bar.finish()
 
+    elapsed = time.time() - start
+    new_fund_list = [k for k, v in results.items() if v == 'new']
+    failed_fund_list = [k for k, v in results.items() if v == 'failed']
+
     if len(new_fund_list) > 0:
         print(f'新基金有: {new_fund_list}')
+    if len(failed_fund_list) > 0:
+        print(f'下载失败: {failed_fund_list}，再次运行会继续下载')
+        for fund in failed_fund_list:
+            print(f'{fund}: {errors[fund]}')
+    else:
+        os.remove(journal_file)
+
+    print(f'下载 {len(results)} 个基金，用时 {elapsed:.1f} 秒，'
+          f'{len(results) / max(elapsed, 1e-9):.2f} 个/秒')
+
+    return results
 
 
 if __name__ == '__main__':
@@ -140,5 +427,5 @@ if __name__ == '__main__':
     # download_etf_fund()
     # download_open_fund()
 
-    download_all_fund('etf_list.csv', 'etfs')
-    download_all_fund('lof_list.csv', 'lofs')
+    download_all_fund('etf_list.csv', 'etfs', incremental=True)
+    download_all_fund('lof_list.csv', 'lofs', incremental=True)
@@ -0,0 +1,252 @@
+"""
+预先计算并保存在磁盘上的指标。
+
+同一个基金、同一个指标和参数，不管在多少个策略、多少次优化中使用，结果都一样。
+第一次使用时在基金的全部历史上计算一次，保存在二进制存储旁边：
+
+    datas/etfs/.store/indicators/sh510500.momosc.period=20.<数据版本>.npy
+
+之后直接读取，按日期对齐到数据源上作为指标的线提供给策略，线的名字和 backtrader
+的指标相同。数据更新后数据版本变化，自动重新计算。
+
+和 backtrader 一样，数据源（按 fromdate 截取之后）不足最小周期的 K 线上没有值；
+这些指标在最小周期之后只用到窗口内的数据，所以结果和直接计算的完全一致。
+"""
+import array
+import collections
+import glob
+import hashlib
+import math
+import os
+
+import backtrader as bt
+import numpy as np
+
+from backtest.backtest_feeds import ETFCsvData, StoreData
+from backtest.backtest_store import COLUMNS, load_store, store_path
+
+# 进程内已经读取的指标，{路径: (日期, 值)}，按最近使用的顺序最多保留 MAX_LOADED 个。
+# 日期和值都是内存映射，不复制到进程的内存中
+MAX_LOADED = 256
+_loaded = collections.OrderedDict()
+
+
+def _lagged(close, period):
+    result = np.full(len(close), np.nan)
+    result[period:] = close[:len(close) - period]
+    return result
+
+
+def _sma(values, period):
+    """
+    和 bt.indicators.SMA 一样用 math.fsum 求和
+    """
+    result = np.full(len(values), np.nan)
+    values = values.tolist()
+    for i in range(period - 1, len(values)):
+        result[i] = math.fsum(values[i - period + 1:i + 1]) / period
+    return result
+
+
+def momentum(close, period):
+    return [close - _lagged(close, period)]
+
+
+def momentum_oscillator(close, period, band=100.0):
+    return [100.0 * (close / _lagged(close, period))]
+
+
+def bollinger_bands(close, period, devfactor=2.0):
+    mid = _sma(close, period)
+    meansq = _sma(close**2, period)
+    # 逐个用 Python 的 pow 计算，和 bt.indicators.StdDev 的舍入完全一致
+    stddev = np.array([
+        devfactor * pow(abs(m2 - pow(m, 2)), 0.5)
+        for m, m2 in zip(mid.tolist(), meansq.tolist())
+    ])
+    return [mid, mid + stddev, mid - stddev]
+
+
+def bollinger_bands_pct(close, period, devfactor=2.0):
+    mid, top, bot = bollinger_bands(close, period, devfactor)
+    with np.errstate(all='ignore'):
+        pctb = (close - bot) / (top - bot)
+    return [mid, top, bot, np.where(np.isfinite(pctb), pctb, np.nan)]
+
+
+def fund_info(data):
+    """
+    数据源对应的 (CSV 路径, csvformat)，不是从 CSV 或二进制存储读取的数据源返回 None
+    """
+    if isinstance(data, StoreData):
+        return data.p.dataname, data.p.csvformat
+    if isinstance(data, bt.feeds.GenericCSVData) and isinstance(
+            data.p.dataname, str):
+        return data.p.dataname, type(data)
+    return None
+
+
+def data_version(csv_path):
+    """
+    二进制存储的版本，CSV 更新后重新转换，版本随之变化
+    """
+    stat = os.stat(store_path(csv_path))
+    text = f'{stat.st_size}-{stat.st_mtime_ns}'
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def indicator_path(csv_path, kind, params, version):
+    dirname = os.path.join(os.path.dirname(store_path(csv_path)), 'indicators')
+    name, _ = os.path.splitext(os.path.basename(csv_path))
+    text = ','.join(f'{k}={v}' for k, v in params)
+    return os.path.join(dirname, f'{name}.{kind}.{text}.{version}.npy')
+
+
+def load_indicator(csv_path, csvformat, kind, func, params):
+    """
+    读取指标的 (日期, 值)，值为 (K 线数, 线数) 的数组。没有缓存或数据已经更新时
+    在全部历史上重新计算并保存，同时删除旧版本。
+    """
+    store = load_store(csv_path, csvformat)
+    path = indicator_path(csv_path, kind, params, data_version(csv_path))
+
+    cached = _loaded.get(path)
+    if cached is not None:
+        _loaded.move_to_end(path)
+        return cached
+
+    if not os.path.exists(path):
+        close = np.array(store[:, COLUMNS.index('close')])
+        values = np.column_stack(func(close, **dict(params)))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        prefix = path[:path.rindex('.', 0, len(path) - 4) + 1]
+        for old in glob.glob(glob.escape(prefix) + '*.npy'):
+            if old != path:
+                os.remove(old)
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp_path, path)
+
+    # 存储是 Fortran 顺序，日期列本身就是连续的
+    cached = _loaded[path] = (store[:, 0], np.load(path, mmap_mode='r'))
+    while len(_loaded) > MAX_LOADED:
+        _loaded.popitem(last=False)
+    return cached
+
+
+class CachedIndicator(bt.Indicator):
+    """
+    从磁盘缓存中按日期读取指标值，子类设置 kind、func、lines 和 params
+    """
+    kind = None
+    func = None
+
+    def _minperiod_of(self):
+        return self.p.period
+
+    def __init__(self):
+        csv_path, csvformat = fund_info(self.data)
+        params = tuple(
+            (key, getattr(self.p, key)) for key in self.p._getkeys())
+        self._dates, self._values = load_indicator(csv_path, csvformat,
+                                                   self.kind,
+                                                   type(self).func, params)
+        self.addminperiod(self._minperiod_of())
+
+    def _rows(self, dtnums):
+        ordinals = np.asarray(dtnums, dtype='f8').astype('i8')
+        idx = np.searchsorted(self._dates, ordinals)
+        idx = np.minimum(idx, len(self._dates) - 1)
+        found = self._dates[idx] == ordinals
+        return idx, found
+
+    def next(self):
+        idx, found = self._rows([self.data.datetime[0]])
+        for i, line in enumerate(self.lines):
+            line[0] = self._values[idx[0], i] if found[0] else float('nan')
+
+    def once(self, start, end):
+        if end <= start:
+            return
+        idx, found = self._rows(self.data.datetime.array[start:end])
+        for i, line in enumerate(self.lines):
+            values = np.where(found, self._values[idx, i], np.nan)
+            line.array[start:end] = array.array('d', values.tolist())
+
+
+class CachedMomentum(CachedIndicator):
+    lines = ('momentum', )
+    params = (('period', 12), )
+    kind = 'momentum'
+    func = momentum
+
+    def _minperiod_of(self):
+        return self.p.period + 1
+
+
+class CachedMomentumOscillator(CachedIndicator):
+    lines = ('momosc', )
+    params = (
+        ('period', 12),
+        ('band', 100.0),
+    )
+    kind = 'momosc'
+    func = momentum_oscillator
+
+    def _minperiod_of(self):
+        return self.p.period + 1
+
+
+class CachedBollingerBands(CachedIndicator):
+    lines = ('mid', 'top', 'bot')
+    params = (
+        ('period', 20),
+        ('devfactor', 2.0),
+    )
+    kind = 'bbands'
+    func = bollinger_bands
+
+
+class CachedBollingerBandsPct(CachedIndicator):
+    lines = ('mid', 'top', 'bot', 'pctb')
+    params = (
+        ('period', 20),
+        ('devfactor', 2.0),
+    )
+    kind = 'bbandspct'
+    func = bollinger_bands_pct
+
+
+CACHED = {
+    bt.indicators.Momentum: CachedMomentum,
+    bt.indicators.MomentumOscillator: CachedMomentumOscillator,
+    bt.indicators.BollingerBands: CachedBollingerBands,
+    bt.indicators.BollingerBandsPct: CachedBollingerBandsPct,
+}
+
+
+def cached_indicator(cls, data, **kwargs):
+    """
+    有缓存实现并且数据来自文件时返回缓存的指标，否则返回 cls(data, **kwargs)
+    """
+    cached = CACHED.get(cls)
+    if cached is None or fund_info(data) is None or \
+            not set(kwargs) <= set(cached.params._getkeys()):
+        return cls(data, **kwargs)
+    return cached(data, **kwargs)
+
+
+def warm(datapaths, cls, periods, csvformat=ETFCsvData, **kwargs):
+    """
+    在优化之前为 datapaths 中的所有基金和 periods 中的所有周期计算好指标
+    """
+    cached = CACHED[cls]
+    for csv_path in datapaths:
+        for period in periods:
+            p = dict(cached.params._getitems())
+            p.update(kwargs, period=period)
+            load_indicator(csv_path, csvformat, cached.kind, cached.func,
+                           tuple(p.items()))
@@ -0,0 +1,381 @@
+"""
+分钟线的本地存储。
+
+下载的分钟线（1m、5m 或 30m）按基金保存在 datas/minutes 下，每次下载只合并新的 K 线：
+
+    datas/minutes/sz001227.1m.npy
+
+其他周期（5m、30m 和日线 1d）由最细的已有周期重新采样得到，缓存在 .store 目录下，
+原始 K 线更新时只重新计算变化的那天之后的部分：
+
+    datas/minutes/.store/sz001227.30m.npy
+
+缓存中同时保存按 K 线时间预先算好的时段标记（morning、afternoon、first、last），
+IntradayData 把它们作为数据源的线提供给策略，next 中直接读取
+self.data.afternoon[0]，不需要每根 K 线转换时间再比较。
+
+所有文件都是 (行数, 列数) 的 float64 数组，第一列是 K 线时间（本地时间的 Unix 秒）。
+"""
+import json
+import math
+import os
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+from backtrader.feed import DataBase
+from backtrader.utils.dateintern import (HOURS_PER_DAY, MINUTES_PER_DAY,
+                                         SECONDS_PER_DAY)
+
+mainpath = os.path.dirname(os.path.dirname(__file__))
+
+INTRADAY_DIR = os.path.join(mainpath, 'datas/minutes')
+STORE_DIR = '.store'
+
+# 周期及对应的分钟数，日线为 None
+FREQS = {'1m': 1, '5m': 5, '30m': 30, '1d': None}
+
+COLUMNS = ('datetime', 'open', 'high', 'low', 'close', 'volume')
+SESSIONS = ('morning', 'afternoon', 'first', 'last')
+
+# 上午收盘、下午开盘的时间（当天的秒数）
+MORNING_END = 11 * 3600 + 30 * 60
+AFTERNOON_START = 13 * 3600
+
+# 1970-01-01 的公历序数
+_EPOCH_ORDINAL = 719163
+
+
+def base_path(symbol, freq, path=INTRADAY_DIR):
+    return os.path.join(path, f'{symbol}.{freq}.npy')
+
+
+def derived_path(symbol, freq, path=INTRADAY_DIR):
+    return os.path.join(path, STORE_DIR, f'{symbol}.{freq}.npy')
+
+
+def meta_path(symbol, freq, path=INTRADAY_DIR):
+    return os.path.join(path, STORE_DIR, f'{symbol}.{freq}.json')
+
+
+def _save(path, array):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _read_meta(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(path, meta):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path)
+
+
+def to_array(df):
+    """
+    以时间为索引、包含 open/high/low/close/volume 列的 DataFrame 转换成存储的数组
+    """
+    df = df.sort_index()
+    df = df[~df.index.duplicated(keep='last')]
+    result = np.empty((len(df), len(COLUMNS)), dtype='f8')
+    result[:, 0] = pd.DatetimeIndex(df.index).values.astype(
+        'datetime64[s]').astype('i8')
+    for i, column in enumerate(COLUMNS[1:], start=1):
+        result[:, i] = pd.to_numeric(df[column], errors='coerce').values
+    return result
+
+
+def to_frame(array):
+    return pd.DataFrame(array[:, 1:len(COLUMNS)],
+                        index=pd.to_datetime(array[:, 0].astype('i8'),
+                                             unit='s'),
+                        columns=COLUMNS[1:])
+
+
+def save_bars(symbol, freq, df, path=INTRADAY_DIR):
+    """
+    把下载的 K 线合并到 symbol 的 freq 周期存储中，时间相同的以新数据为准。
+    由它重新采样的缓存记下第一根变化的 K 线，下次读取时从那一天开始重新计算。
+    返回新增或变化的 K 线数。
+    """
+    new = to_array(df)
+    if len(new) == 0:
+        return 0
+
+    target = base_path(symbol, freq, path)
+    old = np.load(target) if os.path.exists(target) else np.empty(
+        (0, len(COLUMNS)))
+
+    merged = np.concatenate([old[old[:, 0] < new[0, 0]], new,
+                             old[old[:, 0] > new[-1, 0]]])
+    if len(merged) > 1:
+        # 新数据中间缺少的旧 K 线也保留
+        missing = old[(old[:, 0] >= new[0, 0]) & (old[:, 0] <= new[-1, 0])
+                      & ~np.isin(old[:, 0], new[:, 0])]
+        if len(missing):
+            merged = np.concatenate([merged, missing])
+            merged = merged[np.argsort(merged[:, 0], kind='stable')]
+
+    # 第一根和原来不同的 K 线
+    n = min(len(old), len(merged))
+    diff = np.flatnonzero(~np.all(
+        (old[:n] == merged[:n]) | (np.isnan(old[:n]) & np.isnan(merged[:n])),
+        axis=1))
+    first = diff[0] if len(diff) else n
+    changed = len(merged) - first
+    if changed == 0:
+        return 0
+
+    _save(target, merged)
+
+    dirty = float(merged[first, 0])
+    for other in FREQS:
+        meta_file = meta_path(symbol, other, path)
+        meta = _read_meta(meta_file)
+        if meta is None or meta.get('base') != freq:
+            continue
+        if meta.get('dirty') is None or dirty < meta['dirty']:
+            meta['dirty'] = dirty
+            _write_meta(meta_file, meta)
+    return changed
+
+
+def find_base(symbol, freq, path=INTRADAY_DIR):
+    """
+    可以采样出 freq 周期的最细的已下载周期
+    """
+    minutes = FREQS[freq]
+    for base, base_minutes in FREQS.items():
+        if base_minutes is None or not os.path.exists(
+                base_path(symbol, base, path)):
+            continue
+        if minutes is None or minutes % base_minutes == 0:
+            return base
+    raise FileNotFoundError(f'{symbol} 没有可以采样出 {freq} 的分钟线')
+
+
+def resample(array, freq):
+    """
+    重新采样到 freq 周期。分钟线按 A 股的习惯以 K 线结束时间标记（10:00 的 30 分钟线
+    包含 9:31 到 10:00），午休等没有成交的区间不产生 K 线；日线以当天 0 点标记。
+    """
+    if len(array) == 0:
+        return np.empty((0, len(COLUMNS)))
+
+    minutes = FREQS[freq]
+    if minutes is None:
+        rule, label, closed = '1D', 'left', 'left'
+    else:
+        rule, label, closed = f'{minutes}min', 'right', 'right'
+
+    result = to_frame(array).resample(rule, label=label, closed=closed).agg({
+        'open': 'first',
+        'high': 'max',
+        'low': 'min',
+        'close': 'last',
+        'volume': 'sum',
+    })
+    return to_array(result.dropna(subset=['close']))
+
+
+def session_masks(seconds):
+    """
+    每根 K 线的时段标记（1.0 为是）：上午、下午、当天第一根、当天最后一根
+    """
+    days = seconds // 86400
+    tod = seconds - days * 86400
+
+    first = np.ones(len(seconds), dtype=bool)
+    first[1:] = days[1:] != days[:-1]
+    last = np.ones(len(seconds), dtype=bool)
+    last[:-1] = days[:-1] != days[1:]
+
+    return np.column_stack([
+        (tod > 0) & (tod <= MORNING_END),
+        tod >= AFTERNOON_START,
+        first,
+        last,
+    ]).astype('f8')
+
+
+def with_sessions(bars):
+    return np.column_stack([bars, session_masks(bars[:, 0].astype('i8'))])
+
+
+def load_bars(symbol, freq, path=INTRADAY_DIR, mmap_mode='r'):
+    """
+    读取 symbol 的 freq 周期 K 线（含时段标记），列为 COLUMNS + SESSIONS。
+
+    缓存不存在时由最细的已下载周期采样生成；下载的数据有更新时，
+    只重新计算第一根变化的 K 线所在那一天之后的部分。
+    """
+    base = find_base(symbol, freq, path)
+    target = derived_path(symbol, freq, path)
+    meta_file = meta_path(symbol, freq, path)
+    meta = _read_meta(meta_file)
+
+    if meta is not None and meta.get('base') == base and os.path.exists(
+            target):
+        if meta.get('dirty') is None:
+            return np.load(target, mmap_mode=mmap_mode)
+        # 从变化的那一天（0 点）开始重新采样，之前的缓存保留
+        start = meta['dirty'] // 86400 * 86400
+        cached = np.load(target)
+        kept = cached[cached[:, 0] < start]
+    else:
+        start, kept = None, np.empty((0, len(COLUMNS) + len(SESSIONS)))
+
+    source = np.load(base_path(symbol, base, path), mmap_mode='r')
+    if start is not None:
+        source = source[np.searchsorted(source[:, 0], start):]
+
+    if base == freq:
+        fresh = np.array(source)
+    else:
+        fresh = resample(source, freq)
+
+    bars = np.concatenate([kept[:, :len(COLUMNS)], fresh])
+    _save(target, with_sessions(bars))
+    _write_meta(meta_file, {'base': base, 'rows': len(bars), 'dirty': None})
+    return np.load(target, mmap_mode=mmap_mode)
+
+
+def last_bar(symbol, freq, path=INTRADAY_DIR):
+    """
+    已下载的 freq 周期最后一根 K 线的时间，没有下载过时返回 None
+    """
+    target = base_path(symbol, freq, path)
+    if not os.path.exists(target):
+        return None
+    array = np.load(target, mmap_mode='r')
+    if len(array) == 0:
+        return None
+    return pd.Timestamp(int(array[-1, 0]), unit='s').to_pydatetime()
+
+
+def update(symbol, freq='30m', adjust='qfq', source=None, path=INTRADAY_DIR):
+    """
+    下载 symbol 最近的 freq 分钟线并合并到本地存储，今天已经更新过时不再下载。
+    返回新增或变化的 K 线数。
+    """
+    last = last_bar(symbol, freq, path)
+    if last is not None and last.date() >= pd.Timestamp.now().date():
+        return 0
+
+    if source is None:
+        from backtest.backtest_get import AkshareSource
+        source = AkshareSource()
+    df = source.minute_hist(symbol, period=str(FREQS[freq]), adjust=adjust)
+    return save_bars(symbol, freq, df, path)
+
+
+def dtnums(seconds):
+    """
+    Unix 秒转换成 backtrader 的时间数值，和 date2num 的结果完全一致
+    """
+    result = []
+    for value in seconds.astype('i8').tolist():
+        days, rest = divmod(value, 86400)
+        hour, rest = divmod(rest, 3600)
+        minute, second = divmod(rest, 60)
+        result.append(
+            math.fsum((float(days + _EPOCH_ORDINAL), hour / HOURS_PER_DAY,
+                       minute / MINUTES_PER_DAY, second / SECONDS_PER_DAY)))
+    return result
+
+
+class IntradayData(DataBase):
+    """
+    从分钟线存储读取 K 线，dataname 为基金代码，freq 为周期（1m、5m、30m、1d）。
+
+    除了 OHLCV 之外还提供 SESSIONS 中的时段标记线，例如 self.data.afternoon[0]
+    为 1.0 表示这根 K 线在下午。
+    """
+    lines = SESSIONS
+    params = (
+        ('freq', '30m'),
+        ('path', INTRADAY_DIR),
+    )
+
+    def __init__(self):
+        if not self._name:
+            self._name = self.p.dataname
+        minutes = FREQS[self.p.freq]
+        if minutes is None:
+            self.p.timeframe, self.p.compression = bt.TimeFrame.Days, 1
+        else:
+            self.p.timeframe = bt.TimeFrame.Minutes
+            self.p.compression = minutes
+        self._array = None
+        self._rows = None
+
+    def start(self):
+        super(IntradayData, self).start()
+        self._array = load_bars(self.p.dataname, self.p.freq, self.p.path)
+        self._rows = None
+
+    def stop(self):
+        super(IntradayData, self).stop()
+        self._array = None
+        self._rows = None
+
+    def preload(self):
+        super(IntradayData, self).preload()
+        # 预加载之后不再需要映射，避免多进程优化时被 pickle
+        self._array = None
+        self._rows = None
+
+    def _window(self):
+        seconds = self._array[:, 0]
+        begin, end = 0, len(seconds)
+        if self.p.fromdate is not None:
+            begin = int(
+                np.searchsorted(seconds,
+                                pd.Timestamp(self.p.fromdate).value // 10**9,
+                                'left'))
+        if self.p.todate is not None:
+            end = int(
+                np.searchsorted(seconds,
+                                pd.Timestamp(self.p.todate).value // 10**9,
+                                'right'))
+        return begin, max(begin, end)
+
+    def _prepare(self):
+        begin, end = self._window()
+        window = self._array[begin:end]
+        columns = [window[:, i].tolist() for i in range(1, window.shape[1])]
+        self._rows = zip(dtnums(window[:, 0]), *columns)
+
+    def _load(self):
+        if self._array is None:
+            return False
+        if self._rows is None:
+            self._prepare()
+
+        row = next(self._rows, None)
+        if row is None:
+            return False
+
+        dtnum, open_, high, low, close, volume = row[:len(COLUMNS)]
+        lines = self.lines
+        lines.datetime[0] = dtnum
+        lines.open[0] = open_
+        lines.high[0] = high
+        lines.low[0] = low
+        lines.close[0] = close
+        lines.volume[0] = volume
+        lines.openinterest[0] = 0.0
+        for name, value in zip(SESSIONS, row[len(COLUMNS):]):
+            getattr(lines, name)[0] = value
+        return True
+
@@ -0,0 +1,276 @@
+"""
+回测日志的列式存储，代替重定向 print 输出得到的 CSV（原来的 sss.csv、views/ss.csv）。
+
+Journal 分析器在回测中记录三张表：
+
+- signals：每根 K 线所有基金的指标值，dt 和 (K 线数, 基金数) 的 value 两列；
+- orders：每个提交的订单，dt、ref、fund（基金序号）、size（卖出为负）、price（下单价）；
+- fills：每次成交或订单失败，dt、ref、fund、status（bt.Order 的状态）、
+  size、price、value、comm，失败时 size 为 0。
+
+每列先写入预先分配的 numpy 缓冲区，攒够 batch 行后追加到 目录/表名.列名.bin
+（原始二进制），schema.json 中记录基金代码、每列的类型和形状以及行数。
+read_journal 以 np.memmap 直接映射这些文件，不需要解析：
+
+    cerebro.addanalyzer(Journal, path='views/journal')
+    ...
+    journal = read_journal('views/journal')
+    signal_frame(journal).plot()
+
+指标值取策略的 values（RotationStrategy 中当前所有基金的指标），没有时取 signals
+中每条线的当前值，都没有时不记录 signals。FastBroker 不发送订单通知，orders 和
+fills 为空。
+"""
+import json
+import os
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+SCHEMA = 'schema.json'
+BATCH = 4096
+
+# 1970-01-01 的公历序数，backtrader 的数字时间减去它就是 Unix 时间的天数
+_EPOCH_ORDINAL = 719163
+
+ORDER_COLUMNS = (('dt', 'f8'), ('ref', 'i8'), ('fund', 'i4'), ('size', 'f8'),
+                 ('price', 'f8'))
+FILL_COLUMNS = (('dt', 'f8'), ('ref', 'i8'), ('fund', 'i4'), ('status', 'i1'),
+                ('size', 'f8'), ('price', 'f8'), ('value', 'f8'), ('comm',
+                                                                    'f8'))
+
+
+class Table(object):
+    """
+    一张表：每列一个预先分配的缓冲区和一个只追加的文件
+    """
+
+    def __init__(self, directory, name, columns, batch):
+        self.name = name
+        self.batch = batch
+        self.rows = 0
+        self.n = 0
+        self.columns = [(column, np.dtype(dtype), tuple(shape))
+                        for column, dtype, *shape in columns]
+        self.buffers = [
+            np.empty((batch, ) + shape, dtype)
+            for _, dtype, shape in self.columns
+        ]
+        self.files = [
+            open(os.path.join(directory, f'{name}.{column}.bin'), 'wb')
+            for column, _, _ in self.columns
+        ]
+
+    def append(self, *values):
+        n = self.n
+        for buffer, value in zip(self.buffers, values):
+            buffer[n] = value
+        self.n = n + 1
+        if self.n == self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.n:
+            # 写到文件之后才更新 rows，回测中读取时 schema.json 中的行数都已经在文件中
+            for buffer, f in zip(self.buffers, self.files):
+                f.write(buffer[:self.n].tobytes())
+                f.flush()
+            self.rows += self.n
+            self.n = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+
+    def schema(self):
+        return {
+            'rows': self.rows,
+            'columns': {
+                column: {
+                    'dtype': dtype.str,
+                    'shape': list(shape)
+                }
+                for column, dtype, shape in self.columns
+            }
+        }
+
+
+def write_schema(path, tables, **labels):
+    """
+    写 path 目录的 schema.json：labels 中的列表（例如基金代码）和各张表的列和行数
+    """
+    schema = dict(labels)
+    schema['tables'] = {name: table.schema() for name, table in tables.items()}
+    tmp = os.path.join(path, SCHEMA + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(schema, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(path, SCHEMA))
+
+
+class JournalWriter(object):
+    """
+    把各张表写到目录 path 中，每次写出缓冲区后更新 schema.json
+    """
+
+    def __init__(self, path, funds, width=None, batch=BATCH):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.funds = list(funds)
+        self.tables = dict()
+        if width is not None:
+            self.tables['signals'] = Table(path, 'signals',
+                                           [('dt', 'f8'),
+                                            ('value', 'f8', width)], batch)
+        self.tables['orders'] = Table(path, 'orders', ORDER_COLUMNS, batch)
+        self.tables['fills'] = Table(path, 'fills', FILL_COLUMNS, batch)
+        self.write_schema()
+
+    def append(self, table, *values):
+        table = self.tables[table]
+        table.append(*values)
+        if table.n == 0:
+            self.write_schema()
+
+    def write_schema(self):
+        write_schema(self.path, self.tables, funds=self.funds)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.write_schema()
+
+
+class Journal(bt.Analyzer):
+    """
+    把指标值、订单和成交记录到 path 目录（见模块说明）
+    """
+    params = (
+        ('path', None),
+        ('batch', BATCH),
+    )
+
+    def start(self):
+        strategy = self.strategy
+        self._index = {data: i for i, data in enumerate(self.datas)}
+        self._executed = dict()
+
+        self._values = getattr(strategy, 'values', None)
+        self._signals = getattr(strategy, 'signals', None)
+        width = None
+        if self._values is not None:
+            width = len(self._values)
+        elif self._signals is not None:
+            width = len(self._signals)
+
+        self.writer = JournalWriter(self.p.path,
+                                    [data._name for data in self.datas],
+                                    width, self.p.batch)
+
+    def prenext(self):
+        # 策略的 next 还没有开始，指标没有值
+        pass
+
+    def next(self):
+        if self._values is not None:
+            values = self._values
+        elif self._signals is not None:
+            values = [line[0] for line in self._signals]
+        else:
+            return
+        self.writer.append('signals', self.strategy.datetime[0], values)
+
+    def notify_order(self, order):
+        fund = self._index.get(order.data, -1)
+        if order.status == order.Submitted:
+            self.writer.append('orders', order.created.dt, order.ref, fund,
+                               order.created.size, order.created.price)
+            return
+        if order.status == order.Accepted:
+            return
+
+        size, value, comm = 0.0, 0.0, 0.0
+        if order.status in [order.Partial, order.Completed]:
+            # 部分成交时 executed 中是累计值，记录这一次的增量
+            executed = order.executed
+            last = self._executed.pop(order.ref, (0.0, 0.0, 0.0))
+            size = executed.size - last[0]
+            value = executed.value - last[1]
+            comm = executed.comm - last[2]
+            if order.status == order.Partial:
+                self._executed[order.ref] = (executed.size, executed.value,
+                                             executed.comm)
+
+        # 通知在下一根 K 线之前发出，时间取成交时间，失败的订单取数据源的当前时间
+        dt = order.executed.dt or order.data.datetime[0]
+        self.writer.append('fills', dt, order.ref, fund, order.status, size,
+                           order.executed.price, value, comm)
+
+    def stop(self):
+        self.writer.close()
+
+    def get_analysis(self):
+        return {'path': self.p.path}
+
+
+def read_journal(path, mmap_mode='r'):
+    """
+    读取 path 目录中的日志，返回 {'funds': 基金代码列表, 表名: {列名: np.memmap}}，
+    行数为 0 的列为空数组。schema.json 中的其他标签（例如 backtest_results 导出的
+    组合名）也原样返回
+    """
+    with open(os.path.join(path, SCHEMA), encoding='utf-8') as f:
+        schema = json.load(f)
+
+    tables = schema.pop('tables')
+    journal = dict(schema)
+    for name, table in tables.items():
+        rows = table['rows']
+        columns = dict()
+        for column, spec in table['columns'].items():
+            shape = (rows, ) + tuple(spec['shape'])
+            filename = os.path.join(path, f'{name}.{column}.bin')
+            if rows:
+                columns[column] = np.memmap(filename,
+                                            dtype=spec['dtype'],
+                                            mode=mmap_mode,
+                                            shape=shape)
+            else:
+                columns[column] = np.empty(shape, dtype=spec['dtype'])
+        journal[name] = columns
+    return journal
+
+
+def to_datetime(dts):
+    """
+    backtrader 的数字时间转换为 pd.DatetimeIndex（精确到微秒，日线的时间在当天收盘之后）
+    """
+    us = np.round((np.asarray(dts) - _EPOCH_ORDINAL) * 86400000000.0)
+    return pd.DatetimeIndex(us.astype('i8').astype('datetime64[us]'))
+
+
+def signal_frame(journal):
+    """
+    指标值的 DataFrame，行为日期，列为基金代码
+    """
+    signals = journal['signals']
+    return pd.DataFrame(signals['value'],
+                        index=to_datetime(signals['dt']).normalize(),
+                        columns=journal['funds'],
+                        copy=False)
+
+
+def fill_frame(journal):
+    """
+    成交和失败订单的 DataFrame，fund 换成基金代码，status 换成状态名
+    """
+    fills = journal['fills']
+    funds = np.array(journal['funds'] + [''], dtype=object)
+    frame = pd.DataFrame({column: np.asarray(fills[column])
+                          for column in fills})
+    frame['dt'] = to_datetime(fills['dt'])
+    frame['fund'] = funds[np.asarray(fills['fund'])]
+    frame['status'] = [bt.Order.Status[s] for s in fills['status']]
+    return frame
+
@@ -0,0 +1,191 @@
+"""
+策略日志。
+
+策略的 log 以 % 格式记录日志：
+
+    self.log('执行买入，%s，价格：%.2f', order.data._name, order.executed.price)
+
+没有启用日志（printlog 为 False）时只做一次判断，不格式化字符串、不转换日期；
+启用时把 (时间, 格式, 参数) 交给 open_log 打开的日志，输出时才格式化：
+
+- None：缓冲后由后台线程写到标准输出；
+- 整数 n：只保存在内存中最近的 n 条（环形缓冲区），用 lines() 读取；
+- 字符串：缓冲后由后台线程写到文件，文件名中的 {strategy}、{pid} 和策略参数
+  （例如 {period}）会被替换，并行优化时每次回测写到单独的文件。
+
+参数在记录时取值，之后对象变化不影响日志内容。策略继承 LoggingStrategy 即可使用。
+"""
+import atexit
+import collections
+import os
+import queue
+import sys
+import threading
+import weakref
+
+import backtrader as bt
+
+BATCH = 512
+
+# 进程中所有还没关闭的缓冲日志，退出时写完
+_logs = weakref.WeakSet()
+_writer = None
+
+
+def format_record(record):
+    """
+    (时间, 格式, 参数) 格式化为 '日期, 内容' 一行，时间为 backtrader 的数字时间或 date
+    """
+    dt, txt, args = record
+    if args:
+        txt = txt % args
+    if isinstance(dt, float):
+        dt = bt.num2date(dt).date()
+    return '%s, %s\n' % (dt.isoformat(), txt)
+
+
+class _Writer(object):
+    """
+    后台写日志的线程，每个进程一个（fork 出的子进程重新创建）
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            stream, records = self.queue.get()
+            try:
+                stream.write(''.join(map(format_record, records)))
+                stream.flush()
+            finally:
+                self.queue.task_done()
+
+    def put(self, stream, records):
+        self.queue.put((stream, records))
+
+    def join(self):
+        self.queue.join()
+
+
+def _get_writer():
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        _writer = _Writer()
+    return _writer
+
+
+class BufferedLog(object):
+    """
+    攒够 batch 条记录交给后台线程格式化并写入 stream（或 path 文件）
+    """
+
+    def __init__(self, stream=None, path=None, batch=BATCH):
+        if path is not None:
+            dirname = os.path.dirname(path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            stream = open(path, 'w', encoding='utf-8')
+        self.stream = stream if stream is not None else sys.stdout
+        self.path = path
+        self.batch = batch
+        self.records = []
+        _logs.add(self)
+
+    def append(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.batch:
+            _get_writer().put(self.stream, self.records)
+            self.records = []
+
+    def flush(self):
+        """
+        写出所有记录，等待后台线程写完后返回
+        """
+        if self.records:
+            _get_writer().put(self.stream, self.records)
+            self.records = []
+        if _writer is not None and _writer.pid == os.getpid():
+            _writer.join()
+
+    def close(self):
+        self.flush()
+        _logs.discard(self)
+        if self.path is not None and not self.stream.closed:
+            self.stream.close()
+
+
+class RingLog(object):
+    """
+    只在内存中保存最近的 maxlen 条记录，不做任何输出
+    """
+
+    def __init__(self, maxlen):
+        self.records = collections.deque(maxlen=maxlen)
+
+    def append(self, record):
+        self.records.append(record)
+
+    def lines(self):
+        return [format_record(record).rstrip('\n') for record in self.records]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_log(dest=None, strategy=None):
+    """
+    按 dest 打开策略 strategy 的日志（见模块说明）
+    """
+    if isinstance(dest, int) and not isinstance(dest, bool):
+        return RingLog(dest)
+    if dest is None:
+        return BufferedLog()
+
+    fields = dict()
+    if strategy is not None:
+        fields.update((key, getattr(strategy.params, key))
+                      for key in strategy.params._getkeys())
+        fields['strategy'] = type(strategy).__name__
+    fields['pid'] = os.getpid()
+    return BufferedLog(path=dest.format(**fields))
+
+
+class LoggingStrategy(bt.Strategy):
+    """
+    带日志的策略基类，log(txt, *args) 以 % 格式记录日志，printlog 为 False 时不做任何
+    格式化；logto 为日志的去向（见 open_log）。子类的 stop 先调用这里，写完日志再打印结果。
+
+    不写成放在 bt.Strategy 前面的 mixin，否则 backtrader 的元类会把 Strategy 的
+    lines 合并两次。
+    """
+    params = (
+        ('printlog', False),
+        ('logto', None),
+    )
+
+    logger = None
+
+    def log(self, txt, *args, dt=None, doprint=False):
+        if self.params.printlog or doprint:
+            if self.logger is None:
+                self.logger = open_log(self.params.logto, self)
+            self.logger.append(
+                (self.datas[0].datetime[0] if dt is None else dt, txt, args))
+
+    def stop(self):
+        if self.logger is not None:
+            self.logger.close()
+
+
+@atexit.register
+def _flush_all():
+    for log in list(_logs):
+        log.flush()
+
@@ -0,0 +1,183 @@
+"""
+批量实验：基金组合 × 策略 × 参数 × 日期区间。
+
+实验矩阵用字典描述，例如：
+
+    groups = {'funds_1': ['sz159915', 'sh510310', 'sh510500'], ...}
+    strategies = {MomStrategy: {'period': range(1, 60)},
+                  MomOscStrategy: {'period': range(1, 60)}}
+    windows = {'2017-': (datetime(2017, 5, 28), datetime.now())}
+
+展开后的每个实验是一次独立的回测，全部交给同一个进程池。所有组合用到的基金
+（并集）只加载一次放入共享内存，多个组合共有的基金不会重复加载。
+结果合并成一张 DataFrame，每行一个实验。
+"""
+import contextlib
+import io
+import itertools
+import multiprocessing
+
+import backtrader as bt
+import pandas as pd
+
+from backtest.backtest_broker import FastBroker
+from backtest.backtest_cache import run_key
+from backtest.backtest_optimizer import (RECORD_FIELDS, RECORD_KIND,
+                                         add_metrics, record)
+from backtest.backtest_shared import SharedFundGroup
+
+# 子进程中的共享数据，由进程池的 initializer 设置
+_group = None
+
+METRICS = RECORD_FIELDS
+
+
+def expand(grid):
+    """
+    {参数名: 取值列表} 展开成所有组合的列表
+    """
+    names = list(grid)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(list(grid[name]) for name in names))
+    ]
+
+
+def experiments(groups, strategies, windows):
+    """
+    展开实验矩阵，返回 [(组合名, 基金列表, 策略类, 参数, 区间名, 开始, 结束)]
+    """
+    return [(group, list(funds), strategy, dict(params), window, fromdate,
+             todate)
+            for group, funds in groups.items()
+            for strategy, grid in strategies.items()
+            for params in expand(grid)
+            for window, (fromdate, todate) in windows.items()]
+
+
+def _init(group):
+    global _group
+    _group = group
+
+
+def _run(task):
+    index, (group, funds, strategy, params, window, fromdate,
+            todate), cash, commission, fast = task
+
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(strategy, **params)
+    for data in _group.feeds(fromdate=fromdate, todate=todate, funds=funds):
+        cerebro.adddata(data)
+    if fast:
+        cerebro.setbroker(FastBroker())
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    add_metrics(cerebro)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        strat = cerebro.run(maxcpus=1)[0]
+    return index, record(strat)
+
+
+def run_matrix(datapaths,
+               groups,
+               strategies,
+               windows,
+               cash,
+               commission,
+               workers=None,
+               chunksize=1,
+               cache=None,
+               progress=None,
+               fast=False,
+               store=None):
+    """
+    回测实验矩阵中的所有实验，返回结果的 DataFrame。
+
+    datapaths 为 {基金代码: CSV 路径}，需要包含 groups 中用到的所有基金。
+    策略参数中没有 printlog 时按 False 回测。cache 为 ResultCache 时和 backtestopt
+    使用同样的缓存键，已经算过的实验直接读取。每完成一个调用 progress(已完成, 总数)。
+    fast 为 True 时使用 FastBroker。store 为 ResultStore 时把新回测的结果保存到结果库中
+    （见 backtest_results）。
+    """
+    tasks = experiments(groups, strategies, windows)
+
+    broker = {'cash': cash, 'commission': commission}
+    records = [None] * len(tasks)
+    keys = [None] * len(tasks)
+    todo = []
+    for i, (group, funds, strategy, params, window, fromdate,
+            todate) in enumerate(tasks):
+        if 'printlog' in strategy.params._getkeys():
+            params.setdefault('printlog', False)
+        if cache is not None:
+            keys[i] = run_key(strategy, params,
+                              [datapaths[fund] for fund in funds], fromdate,
+                              todate, broker, RECORD_KIND)
+            records[i] = cache.get(keys[i])
+        if records[i] is None:
+            todo.append((i, tasks[i], cash, commission, fast))
+
+    if todo:
+        used = sorted({fund for _, task, _, _, _ in todo for fund in task[1]})
+        group = SharedFundGroup({fund: datapaths[fund] for fund in used})
+        if workers == 1:
+            _init(group)
+            pool = None
+            results = map(_run, todo)
+        else:
+            pool = multiprocessing.Pool(workers,
+                                        initializer=_init,
+                                        initargs=(group, ))
+            results = pool.imap_unordered(_run, todo, chunksize=chunksize)
+
+        try:
+            for done, (i, rec) in enumerate(results, start=1):
+                records[i] = rec
+                if cache is not None:
+                    cache.put(keys[i], rec)
+                if store is not None:
+                    name, funds, _, _, window, fromdate, todate = tasks[i]
+                    store.add(rec, name, funds,
+                              [datapaths[fund] for fund in funds], fromdate,
+                              todate, window)
+                if progress is not None:
+                    progress(done, len(todo))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            group.close()
+            if store is not None:
+                store.flush()
+
+    return to_frame(tasks, records)
+
+
+def to_frame(tasks, records):
+    """
+    每个实验一行：组合、区间、策略、各个参数和各项指标
+    """
+    rows = []
+    for (group, funds, strategy, params, window, fromdate,
+         todate), rec in zip(tasks, records):
+        row = {
+            'group': group,
+            'funds': ','.join(funds),
+            'window': window,
+            'strategy': strategy.__name__,
+        }
+        row.update(
+            (key, value) for key, value in params.items() if key != 'printlog')
+        row.update((key, rec[key]) for key in METRICS)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def best_by(frame, by=('group', 'window', 'strategy'), key='sharpe'):
+    """
+    每个 (组合, 区间, 策略) 中 key 最大的一行
+    """
+    frame = frame.dropna(subset=[key])
+    idx = frame.groupby(list(by))[key].idxmax()
+    return frame.loc[idx].reset_index(drop=True)
@@ -0,0 +1,157 @@
+"""
+参数优化，结果以记录的形式返回，不再只在 strategy.stop() 中打印。
+
+cerebro.optstrategy 设置好参数网格后交给 optimize，每组参数在进程池中单独回测，
+跑完一组就返回一条记录：
+
+    {'index': 3, 'strategy': 'MomStrategy', 'params': {'period': 4, ...},
+     'final_value': ..., 'total_return': ..., 'annual_return': ...,
+     'sharpe': ..., 'sqn': ..., 'max_drawdown': ..., 'exposure': ...,
+     'trades': ...}
+
+各项指标由一个 RunStats 分析器在回测中一次算完（见 backtest_stats）：sharpe 由每天
+的收益率计算并年化，total_return 以实际的初始资金计算，annual_return 按实际经过的
+天数年化，max_drawdown 为百分比，exposure 为有持仓的 K 线比例。
+"""
+import contextlib
+import io
+import itertools
+import multiprocessing
+
+import backtrader as bt
+
+from backtest.backtest_stats import RunStats
+
+# 记录中的字段和缓存键中区分结果格式的 kind，字段变化时修改 kind，旧的缓存不再使用
+RECORD_FIELDS = ('final_value', 'total_return', 'annual_return', 'sharpe', 'sqn',
+                 'max_drawdown', 'exposure', 'trades')
+RECORD_KIND = 'opt-stats'
+
+# 子进程中的 Cerebro 模板，由进程池的 initializer 设置，每个进程只 pickle 一次
+_cerebro = None
+# 进程中是否已经用 cerebro.run 回测过一组参数
+_loaded = False
+
+
+def add_metrics(cerebro, fromdate=None):
+    """
+    添加计算记录所需的分析器，fromdate 之前的 K 线不参与统计（见 RunStats）
+    """
+    cerebro.addanalyzer(RunStats,
+                        timeframe=bt.TimeFrame.Days,
+                        fromdate=fromdate,
+                        _name='opt_stats')
+
+
+def record(strat):
+    """
+    从一次回测的结果（Strategy 或 OptReturn）中取出各项指标
+    """
+    stats = strat.analyzers.opt_stats.get_analysis()
+    rec = {
+        'strategy': strat.strategycls.__name__
+        if hasattr(strat, 'strategycls') else type(strat).__name__,
+        'params': {
+            key: getattr(strat.params, key)
+            for key in strat.params._getkeys()
+        },
+    }
+    rec.update((field, stats[field]) for field in RECORD_FIELDS)
+    return rec
+
+
+def combinations(cerebro):
+    """
+    和 Cerebro.run 一样，展开 optstrategy 的所有参数组合
+    """
+    return list(itertools.product(*cerebro.strats))
+
+
+def _init(cerebro):
+    global _cerebro, _loaded
+    _cerebro = cerebro
+    _loaded = False
+
+
+def _run(task):
+    """
+    回测一组参数，策略在 stop() 中的打印不输出
+    """
+    global _loaded
+    index, iterstrat = task
+    cerebro = _cerebro
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not _loaded:
+            # 第一组参数用 cerebro.run 回测，由它做好回测前的准备并加载数据
+            cerebro.strats = [[strat] for strat in iterstrat]
+            results = cerebro.run(maxcpus=1)
+            _loaded = True
+        else:
+            # 之后和 Cerebro 自己多进程优化时一样调用 cerebro(iterstrat)：optdatas
+            # 打开并且数据已经预加载时复用数据，只需回到开头，否则重新加载
+            for data in cerebro.datas:
+                data.home()
+            results = [cerebro(iterstrat)]
+
+    return [
+        dict(record(strat), index=index)
+        for strats in results for strat in strats
+    ]
+
+
+def optimize(cerebro,
+             workers=None,
+             chunksize=1,
+             progress=None,
+             good=None,
+             target=None):
+    """
+    在进程池中回测 cerebro 中 optstrategy 的所有参数组合，逐条返回记录（生成器）。
+
+    workers 为进程数（默认 CPU 个数，为 1 时不启动进程池），chunksize 为每次发给
+    一个进程的参数组数。cerebro 的 optdatas 参数打开时（默认），每个进程只预加载
+    一次数据，各组参数共用。
+    每完成一组调用 progress(已完成, 总数)。
+
+    good(record) 为 True 的记录达到 target 条后取消剩下的回测；调用方提前结束迭代
+    也会取消剩下的回测。
+    """
+    tasks = list(enumerate(combinations(cerebro)))
+    total = len(tasks)
+    strats = cerebro.strats
+
+    if workers == 1:
+        _init(cerebro)
+        pool = None
+        results = map(_run, tasks)
+    else:
+        pool = multiprocessing.Pool(workers,
+                                    initializer=_init,
+                                    initargs=(cerebro, ))
+        results = pool.imap_unordered(_run, tasks, chunksize=chunksize)
+
+    found = 0
+    try:
+        for done, records in enumerate(results, start=1):
+            if progress is not None:
+                progress(done, total)
+            for rec in records:
+                yield rec
+                if good is not None and good(rec):
+                    found += 1
+            if target is not None and found >= target:
+                break
+    finally:
+        cerebro.strats = strats
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def best(records, key='sharpe', n=10):
+    """
+    按 key 从大到小取前 n 条记录，key 为 None 的记录不参与排序
+    """
+    records = [rec for rec in records if rec.get(key) is not None]
+    return sorted(records, key=lambda rec: rec[key], reverse=True)[:n]
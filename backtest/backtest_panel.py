@@ -0,0 +1,210 @@
+"""
+全部基金的对齐面板数据。
+
+把 datas/etfs 和 datas/lofs 下的所有基金合并成一个 (OHLCV, 交易日, 基金) 的三维数组，
+交易日为所有基金日期的并集。字段放在第一维，每个字段的 (交易日, 基金) 矩阵在内存中
+是连续的。某个基金在某天没有数据（还没上市、停牌、已退市）时
+mask 为 False，对应的值为 NaN。
+
+面板保存在 datas/.panel 下，之后只重新读取有变化的基金：
+
+    dates.npy   (交易日,) 公历序数
+    values.npy  (5, 交易日, 基金) float64，字段顺序见 FIELDS
+    mask.npy    (交易日, 基金) bool
+    meta.json   数组布局版本、基金列表以及生成时各 CSV 的大小和修改时间
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+
+from backtest.backtest_feeds import ETFCsvData
+from backtest.backtest_store import load_store
+
+mainpath = os.path.dirname(os.path.dirname(__file__))
+
+PANEL_DIR = os.path.join(mainpath, 'datas/.panel')
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+# values 的布局变化时加一，旧版本的面板会整个重新生成
+LAYOUT = 2
+
+
+class Panel(object):
+    """
+    对齐后的面板数据，数组都以只读内存映射方式打开
+    """
+
+    def __init__(self, dates, funds, values, mask):
+        self.dates = dates
+        self.funds = list(funds)
+        self.values = values
+        self.mask = mask
+        self._index = {fund: i for i, fund in enumerate(self.funds)}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def field(self, name):
+        """
+        某个字段的 (交易日, 基金) 视图，内存连续
+        """
+        return self.values[FIELDS.index(name)]
+
+    def fund_index(self, funds):
+        return [self._index[fund] for fund in funds]
+
+    def date_range(self, fromdate=None, todate=None):
+        """
+        [fromdate, todate] 对应的行区间
+        """
+        begin, end = 0, len(self.dates)
+        if fromdate is not None:
+            begin = int(np.searchsorted(self.dates, fromdate.toordinal()))
+        if todate is not None:
+            end = int(
+                np.searchsorted(self.dates, todate.toordinal(), 'right'))
+        return begin, end
+
+    def slice(self, fromdate=None, todate=None, funds=None):
+        """
+        按日期区间和基金截取，返回 (dates, values, mask)，values 为 (5, 交易日, 基金)。
+
+        不指定 funds 时返回的是视图，每个字段都是连续内存；指定 funds 时会复制所选的列。
+        """
+        begin, end = self.date_range(fromdate, todate)
+        dates = self.dates[begin:end]
+        values = self.values[:, begin:end]
+        mask = self.mask[begin:end]
+        if funds is not None:
+            idx = self.fund_index(funds)
+            values = values[:, :, idx]
+            mask = mask[:, idx]
+        return dates, values, mask
+
+    def to_datetime(self, i):
+        return datetime.date.fromordinal(int(self.dates[i]))
+
+
+def fund_sources(down_paths=('etfs', 'lofs')):
+    """
+    返回 {基金代码: CSV 路径}，同名基金以先出现的目录为准
+    """
+    sources = dict()
+    for down_path in down_paths:
+        csv_dir = os.path.join(mainpath, f'datas/{down_path}')
+        for filename in sorted(os.listdir(csv_dir)):
+            name, ext = os.path.splitext(filename)
+            if ext == '.csv' and name not in sources:
+                sources[name] = os.path.join(csv_dir, filename)
+    return sources
+
+
+def signature(csv_path):
+    stat = os.stat(csv_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_panel(path=PANEL_DIR):
+    """
+    读取已经生成的面板，不存在或者布局是旧版本时返回 None
+    """
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('layout') != LAYOUT:
+        return None
+
+    return Panel(np.load(os.path.join(path, 'dates.npy'), mmap_mode='r'),
+                 meta['funds'],
+                 np.load(os.path.join(path, 'values.npy'), mmap_mode='r'),
+                 np.load(os.path.join(path, 'mask.npy'), mmap_mode='r'))
+
+
+def _save(path, dates, funds, values, mask, signatures):
+    os.makedirs(path, exist_ok=True)
+
+    # 先写临时文件，全部完成后再替换，避免读到新旧混合的面板
+    names = {'dates': dates, 'values': values, 'mask': mask}
+    for name, array in names.items():
+        with open(os.path.join(path, f'{name}.npy.tmp'), 'wb') as f:
+            np.save(f, array)
+    with open(os.path.join(path, 'meta.json.tmp'), 'w',
+              encoding='utf-8') as f:
+        json.dump({
+            'layout': LAYOUT,
+            'funds': funds,
+            'signatures': signatures
+        }, f)
+
+    for name in list(names) + ['meta']:
+        filename = f'{name}.json' if name == 'meta' else f'{name}.npy'
+        os.replace(os.path.join(path, f'{filename}.tmp'),
+                   os.path.join(path, filename))
+
+
+def update_panel(down_paths=('etfs', 'lofs'), path=PANEL_DIR,
+                 csvformat=ETFCsvData):
+    """
+    生成或更新面板。
+
+    只有新增或 CSV 有变化的基金会重新读取，其余基金直接从旧面板中按日期搬过来。
+    没有任何变化时直接返回旧面板。
+    """
+    sources = fund_sources(down_paths)
+    signatures = {name: signature(p) for name, p in sources.items()}
+
+    old = load_panel(path)
+    old_signatures = dict()
+    if old is not None:
+        with open(os.path.join(path, 'meta.json'), 'r',
+                  encoding='utf-8') as f:
+            old_signatures = json.load(f)['signatures']
+        if old_signatures == signatures and old.funds == list(sources):
+            return old
+
+    changed = [
+        name for name in sources
+        if old is None or old_signatures.get(name) != signatures[name]
+    ]
+    arrays = {name: load_store(sources[name], csvformat) for name in changed}
+
+    # 新的交易日历：旧日历加上有变化的基金的日期
+    calendars = [array[:, 0] for array in arrays.values()]
+    if old is not None:
+        calendars.append(np.asarray(old.dates))
+    dates = np.unique(np.concatenate(calendars)).astype('i8') \
+        if calendars else np.empty(0, dtype='i8')
+
+    funds = list(sources)
+    values = np.full((len(FIELDS), len(dates), len(funds)), np.nan)
+    mask = np.zeros((len(dates), len(funds)), dtype=bool)
+
+    if old is not None:
+        rows = np.searchsorted(dates, old.dates)
+        for j, name in enumerate(funds):
+            if name in arrays or name not in old._index:
+                continue
+            k = old._index[name]
+            values[:, rows, j] = old.values[:, :, k]
+            mask[rows, j] = old.mask[:, k]
+
+    for name, array in arrays.items():
+        j = funds.index(name)
+        rows = np.searchsorted(dates, array[:, 0])
+        values[:, rows, j] = array[:, 1:1 + len(FIELDS)].T
+        mask[rows, j] = True
+
+    old = None  # 释放旧面板的内存映射后再替换文件
+    _save(path, dates, funds, values, mask,
+          {name: signatures[name] for name in funds})
+    return load_panel(path)
+
+
+if __name__ == '__main__':
+    panel = update_panel()
+    print(f'{len(panel.funds)} 个基金，{len(panel)} 个交易日，'
+          f'{panel.to_datetime(0)} ~ {panel.to_datetime(-1)}')
@@ -0,0 +1,395 @@
+"""
+长时间、多基金回测的画图。
+
+cerebro.plot（包括 Bokeh）把每一根 K 线都画出来，十几年的日线或几年的 30 分钟线
+画得很慢，生成的 HTML 也很大。这里用 matplotlib 画总资产、每个基金的收盘价和
+买卖点、策略的指标值，每条曲线只画和坐标轴宽度（像素）成比例的点数：
+
+- 用 LTTB（Largest-Triangle-Three-Buckets）抽样保留曲线的形状，点很多时先按
+  每段的最小、最大值预选（MinMaxLTTB），保留峰谷；
+- 放大、平移或改变窗口大小时，按新的区间重新取点抽样。StoreData 和 IntradayData
+  的收盘价直接从二进制存储的内存映射中二分查找区间，只读取需要的部分；
+- 回测时由 PlotRecorder 分析器记录总资产、成交和指标值，不依赖 observers。
+
+    cerebro.addanalyzer(PlotRecorder, _name='plot')
+    strat = cerebro.run()[0]
+    plot_run(strat)                   # 打开窗口
+    plot_run(strat, path='run.png')   # 不打开窗口，保存到文件
+
+backtestrun 的 plot 参数选择 Bokeh、这里的抽样画图或者不画图，不画图时不导入任何
+画图的模块。
+"""
+import datetime
+from array import array
+
+import backtrader as bt
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from backtest.backtest_feeds import StoreData
+from backtest.backtest_intraday import COLUMNS as INTRADAY_COLUMNS
+from backtest.backtest_intraday import IntradayData, load_bars
+from backtest.backtest_store import COLUMNS as STORE_COLUMNS
+
+# 每个像素保留的点数
+POINTS_PER_PIXEL = 2
+# MinMaxLTTB 预选的点数为最终点数的倍数
+MINMAX_RATIO = 4
+
+# 1970-01-01 的公历序数，backtrader 的数字时间减去它就是 matplotlib 的日期数
+_EPOCH_ORDINAL = 719163
+
+
+def lttb(x, y, n):
+    """
+    Largest-Triangle-Three-Buckets 抽样，返回保留的 n 个点的下标（包括首尾两点）。
+    中间的点分成 n - 2 个桶，每个桶保留和前一个保留点、下一个桶的平均点组成的
+    三角形面积最大的点
+    """
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.array([0, size - 1][:max(n, 0)], dtype=np.intp)
+
+    edges = np.linspace(1, size - 1, n - 1).astype(np.intp)
+    # 每个桶的平均点，最后一个桶之后是最后一个点
+    sums_x = np.add.reduceat(x[1:size - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:size - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    mean_x = np.append(sums_x / counts, x[size - 1])
+    mean_y = np.append(sums_y / counts, y[size - 1])
+
+    result = np.empty(n, dtype=np.intp)
+    result[0], result[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        cx, cy = mean_x[i + 1], mean_y[i + 1]
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) *
+                      (cy - ay))
+        a = lo + int(np.argmax(area))
+        result[i + 1] = a
+    return result
+
+
+def minmax(y, n):
+    """
+    把 y 的中间部分分成 n // 2 个等长的桶，返回首尾两点和每个桶的最小、最大值的下标
+    （按下标排序）
+    """
+    size = len(y)
+    buckets = max((n - 2) // 2, 1)
+    width = (size - 2) // buckets
+    if width < 2:
+        return np.arange(size)
+    stop = 1 + buckets * width
+    block = np.asarray(y[1:stop]).reshape(buckets, width)
+    starts = np.arange(1, stop, width)
+    picked = [[0], starts + block.argmin(axis=1), starts + block.argmax(axis=1)]
+    if stop < size - 1:
+        tail = np.asarray(y[stop:size - 1])
+        picked.append([stop + tail.argmin(), stop + tail.argmax()])
+    picked.append([size - 1])
+    return np.unique(np.concatenate(picked))
+
+
+def decimate(x, y, n, ratio=MINMAX_RATIO):
+    """
+    MinMaxLTTB：先按最小、最大值预选 n * ratio 个点，再用 LTTB 抽样到 n 个点，
+    比直接 LTTB 快，也更容易保留峰谷。返回保留的点的下标
+    """
+    if len(x) <= n:
+        return np.arange(len(x))
+    candidates = np.arange(len(x))
+    if len(x) > n * ratio:
+        candidates = minmax(y, n * ratio)
+    keep = lttb(np.asarray(x[candidates]), np.asarray(y[candidates]), n)
+    return candidates[keep]
+
+
+class Series(object):
+    """
+    按 x 递增的一条线，x、y 可以是内存映射的数组，取区间时只读取需要的部分。
+    画图的横坐标为 (x - offset) / scale，即 matplotlib 的日期数；begin、end 为 x 的
+    取值范围（回测的区间）
+    """
+
+    def __init__(self, x, y, offset=0.0, scale=1.0, begin=None, end=None):
+        self.x = x
+        self.y = y
+        self.offset = offset
+        self.scale = scale
+        self.first = 0 if begin is None else int(
+            np.searchsorted(x, begin, 'left'))
+        self.last = len(x) if end is None else int(
+            np.searchsorted(x, end, 'right'))
+
+    def __len__(self):
+        return max(self.last - self.first, 0)
+
+    def limits(self):
+        """
+        整条线的横坐标范围
+        """
+        if not len(self):
+            return None
+        return ((self.x[self.first] - self.offset) / self.scale,
+                (self.x[self.last - 1] - self.offset) / self.scale)
+
+    def window(self, x0, x1):
+        """
+        横坐标在 [x0, x1] 中的点，两边各多取一个点使曲线延伸到坐标轴边缘，去掉 NaN
+        """
+        x = self.x[self.first:self.last]
+        lo = int(np.searchsorted(x, x0 * self.scale + self.offset, 'left'))
+        hi = int(np.searchsorted(x, x1 * self.scale + self.offset, 'right'))
+        lo, hi = max(lo - 1, 0), min(hi + 1, len(x))
+        xs = (np.asarray(x[lo:hi], dtype='f8') - self.offset) / self.scale
+        ys = np.asarray(self.y[self.first + lo:self.first + hi], dtype='f8')
+        finite = np.isfinite(ys)
+        if not finite.all():
+            xs, ys = xs[finite], ys[finite]
+        return xs, ys
+
+
+def data_series(data, column='close'):
+    """
+    数据源的一列（默认收盘价）。StoreData 和 IntradayData 映射二进制存储，只取
+    fromdate 到 todate 的部分，其他数据源使用回测时加载的线
+    """
+    if isinstance(data, StoreData):
+        array = data._getarray()
+        begin = data.p.fromdate.toordinal() if data.p.fromdate else None
+        end = None
+        if data.p.todate:
+            end = data.p.todate.toordinal()
+            # 日线在 sessionend 收盘，晚于 todate 时回测不包括这一天
+            if (isinstance(data.p.todate, datetime.datetime)
+                    and data.p.todate.time() < data.p.sessionend):
+                end -= 1
+        return Series(array[:, 0],
+                      array[:, STORE_COLUMNS.index(column)],
+                      offset=_EPOCH_ORDINAL,
+                      begin=begin,
+                      end=end)
+
+    if isinstance(data, IntradayData):
+        array = load_bars(data.p.dataname, data.p.freq, data.p.path)
+        begin = end = None
+        if data.p.fromdate is not None:
+            begin = pd.Timestamp(data.p.fromdate).value // 10**9
+        if data.p.todate is not None:
+            end = pd.Timestamp(data.p.todate).value // 10**9
+        # K 线时间为本地时间的 Unix 秒
+        return Series(array[:, 0],
+                      array[:, INTRADAY_COLUMNS.index(column)],
+                      scale=86400.0,
+                      begin=begin,
+                      end=end)
+
+    return Series(np.asarray(data.datetime.array),
+                  np.asarray(getattr(data.lines, column).array),
+                  offset=_EPOCH_ORDINAL)
+
+
+class PlotRecorder(bt.Analyzer):
+    """
+    记录画图用的每根 K 线的总资产、策略的指标值（values 或 signals）和每次成交
+    """
+
+    def start(self):
+        self._index = {data: i for i, data in enumerate(self.datas)}
+        self._values = getattr(self.strategy, 'values', None)
+        self._signals = getattr(self.strategy, 'signals', None)
+        self.value = self.strategy.broker.getvalue()
+
+        self.dts = array('d')
+        self.values = array('d')
+        self.signal_dts = array('d')
+        self.signals = []
+        self.fills = []
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        self.value = value
+
+    def prenext(self):
+        self.dts.append(self.strategy.datetime[0])
+        self.values.append(self.value)
+
+    def next(self):
+        self.prenext()
+        if self._values is not None:
+            values = list(self._values)
+        elif self._signals is not None:
+            values = [line[0] for line in self._signals]
+        else:
+            return
+        self.signal_dts.append(self.strategy.datetime[0])
+        self.signals.append(values)
+
+    def notify_order(self, order):
+        if order.status == order.Completed:
+            self.fills.append(
+                (order.executed.dt, self._index.get(order.data, -1),
+                 order.executed.price, order.executed.size))
+
+    def get_analysis(self):
+        return {
+            'dt': np.array(self.dts, dtype='f8'),
+            'value': np.array(self.values, dtype='f8'),
+            'signal_dt': np.array(self.signal_dts, dtype='f8'),
+            'signals': np.array(self.signals, dtype='f8'),
+            'fills': self.fills,
+        }
+
+
+class DecimatedLine(object):
+    """
+    坐标轴 ax 上的一条抽样曲线，update 时按当前的横坐标区间和坐标轴宽度重新抽样
+    """
+
+    def __init__(self, ax, series, points=None, **style):
+        self.ax = ax
+        self.series = series
+        self.points = points
+        self.line, = ax.plot([], [], **style)
+
+    def update(self):
+        x0, x1 = self.ax.get_xlim()
+        n = self.points
+        if n is None:
+            n = max(int(self.ax.bbox.width * POINTS_PER_PIXEL), 3)
+        x, y = self.series.window(x0, x1)
+        keep = decimate(x, y, n)
+        self.line.set_data(x[keep], y[keep])
+
+
+class LazyFigure(object):
+    """
+    管理一张图中的所有抽样曲线：任何一个坐标轴的横坐标区间或窗口大小变化时
+    重新抽样，并按曲线可见的部分调整纵坐标
+    """
+
+    def __init__(self, fig):
+        self.fig = fig
+        self.lines = []
+        self._updating = False
+        fig.canvas.mpl_connect('resize_event', self.update)
+
+    def add(self, ax, series, points=None, **style):
+        if not any(line.ax is ax for line in self.lines):
+            ax.callbacks.connect('xlim_changed', self.update)
+        line = DecimatedLine(ax, series, points, **style)
+        self.lines.append(line)
+        return line
+
+    def limits(self):
+        limits = [line.series.limits() for line in self.lines]
+        limits = [limit for limit in limits if limit is not None]
+        if not limits:
+            return None
+        return (min(lo for lo, _ in limits), max(hi for _, hi in limits))
+
+    def update(self, *args):
+        # 调整纵坐标不会再触发横坐标的回调，这里只防止重入
+        if self._updating:
+            return
+        self._updating = True
+        try:
+            # 纵坐标只按抽样曲线可见的部分计算，不包括整个区间的买卖点
+            ranges = dict()
+            for line in self.lines:
+                line.update()
+                y = line.line.get_ydata()
+                if not len(y):
+                    continue
+                lo, hi = ranges.get(line.ax, (np.inf, -np.inf))
+                ranges[line.ax] = (min(lo, y.min()), max(hi, y.max()))
+            for ax, (lo, hi) in ranges.items():
+                pad = (hi - lo) * 0.05 or abs(hi) * 0.05 or 1.0
+                ax.set_ylim(lo - pad, hi + pad)
+            self.fig.canvas.draw_idle()
+        finally:
+            self._updating = False
+
+
+def plot_run(strat, path=None, points=None, recorder='plot', show=None):
+    """
+    画一次回测的结果：总资产、每个基金的收盘价和买卖点、策略的指标值，共用横坐标。
+    strat 需要添加名为 recorder 的 PlotRecorder。path 不为 None 时保存到文件，
+    默认不打开窗口；points 固定每条曲线的点数（默认按坐标轴宽度）。返回 LazyFigure
+    """
+    if show is None:
+        show = path is None
+
+    analysis = strat.analyzers.getbyname(recorder).get_analysis()
+    datas = strat.datas
+    signals = analysis['signals']
+    has_signals = signals.ndim == 2 and signals.shape[0] > 0
+
+    rows = 1 + len(datas) + int(has_signals)
+    fig, axes = plt.subplots(rows,
+                             1,
+                             sharex=True,
+                             squeeze=False,
+                             figsize=(12, 2.2 * rows + 1))
+    axes = axes[:, 0]
+    lazy = LazyFigure(fig)
+
+    dts = analysis['dt']
+    lazy.add(axes[0],
+             Series(dts, analysis['value'], offset=_EPOCH_ORDINAL),
+             points,
+             color='tab:blue',
+             label='value')
+    axes[0].set_ylabel('value')
+
+    # 成交很少，全部画出来
+    fills = np.array([fill[:3] for fill in analysis['fills']], dtype='f8')
+    sizes = np.array([fill[3] for fill in analysis['fills']], dtype='f8')
+    for i, data in enumerate(datas):
+        ax = axes[1 + i]
+        lazy.add(ax, data_series(data), points, color='tab:gray', lw=1)
+        ax.set_ylabel(data._name)
+        if len(fills):
+            mine = fills[:, 1] == i
+            for marker, color, side in (('^', 'tab:red', sizes > 0),
+                                        ('v', 'tab:green', sizes < 0)):
+                chosen = mine & side
+                ax.scatter(fills[chosen, 0] - _EPOCH_ORDINAL,
+                           fills[chosen, 2],
+                           marker=marker,
+                           color=color,
+                           s=25,
+                           zorder=3)
+
+    if has_signals:
+        ax = axes[-1]
+        for i, data in enumerate(datas[:signals.shape[1]]):
+            lazy.add(ax,
+                     Series(analysis['signal_dt'],
+                            signals[:, i],
+                            offset=_EPOCH_ORDINAL),
+                     points,
+                     lw=1,
+                     label=data._name)
+        ax.set_ylabel(getattr(strat, 'signal', 'signal') or 'signal')
+        ax.legend(loc='upper left', fontsize='small')
+
+    limits = lazy.limits()
+    if limits is not None:
+        axes[0].set_xlim(*limits)
+    axes[-1].xaxis_date()
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    lazy.update()
+
+    if path is not None:
+        fig.savefig(path)
+    if show:
+        plt.show()
+    return lazy
+
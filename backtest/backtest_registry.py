@@ -0,0 +1,139 @@
+"""
+同一次回测中共用相同的指标。
+
+策略中经常为了分别取 mid、bot、top 而创建三次一样的 BollingerBands，每一次都要完整
+计算一遍。shared_indicator 按 (指标类, 输入, 参数) 查找当前策略中已经创建过的指标，
+有则直接返回同一个对象：
+
+    self.mid = shared_indicator(self, bt.indicators.BollingerBands,
+                                self.datas[0], period=20).mid
+
+owner 可以是策略，也可以是策略中的指标（在指标的 __init__ 中传入 self），
+沿 _owner 向上找到策略，整个策略共用一个登记表。
+
+指标创建的子指标由那个指标推进，策略直接读取时 runonce 模式下的位置不对，最小周期
+也不计入策略。所以策略复用其他指标中创建的实例时，返回一个属于策略的 ReusedLines，
+逐根复制被复用指标的线，不重新计算。
+"""
+import backtrader as bt
+from backtrader.lineroot import LineRoot
+
+
+class ReusedLines(bt.Indicator):
+    """
+    策略中复用的其他指标创建的实例，线和被复用的指标相同，由策略推进。
+
+    第一个数据是被复用指标最终的时钟（数据源），第二个数据是被复用的指标。
+    """
+    plotinfo = dict(plot=False)
+
+    def next(self):
+        for line, source in zip(self.lines, self.data1.lines):
+            line[0] = source[0]
+
+    def once(self, start, end):
+        for line, source in zip(self.lines, self.data1.lines):
+            line.array[start:end] = source.array[start:end]
+
+
+# {指标类: 对应的 ReusedLines 子类}
+_reused_classes = dict()
+
+
+def reused_lines(indicator):
+    """
+    在当前策略中创建 indicator 的 ReusedLines
+    """
+    cls = type(indicator)
+    found = _reused_classes.get(cls)
+    if found is None:
+        attrs = {'__module__': __name__, 'lines': cls.lines._getlines()}
+        found = _reused_classes[cls] = type(f'Reused{cls.__name__}',
+                                            (ReusedLines, ), attrs)
+    # 被复用的指标不由策略推进，它的长度不变，代理要以最终的数据源为时钟
+    clock = indicator
+    while getattr(clock, '_clock', None) is not None:
+        clock = clock._clock
+    return found(clock, indicator)
+
+
+class IndicatorRegistry(object):
+    """
+    一个策略中已经创建的指标，created 为实际创建的个数，reused 为省掉的重复个数
+    """
+
+    def __init__(self):
+        self._indicators = dict()
+        self._reused = dict()
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def key(cls, args, kwargs):
+        params = dict(cls.params._getitems())
+        params.update(kwargs)
+        keyargs = tuple(('line', id(arg)) if isinstance(arg, LineRoot) else
+                        ('value', arg) for arg in args)
+        return cls, keyargs, tuple(sorted(params.items()))
+
+    def get(self, owner, cls, args, kwargs):
+        key = self.key(cls, args, kwargs)
+        found = self._indicators.get(key)
+        if found is not None:
+            self.reused += 1
+            indicator = found[0]
+            if indicator._owner is owner:
+                return indicator
+            if isinstance(owner, bt.Strategy):
+                # 其他指标创建的实例，策略中使用它的 ReusedLines
+                if key not in self._reused:
+                    self._reused[key] = reused_lines(indicator)
+                return self._reused[key]
+            # 其他指标创建的实例，这里的输出要等它有值之后才开始计算
+            for line in owner.lines:
+                line.updateminperiod(indicator._minperiod)
+            return indicator
+
+        indicator = cls(*args, **kwargs)
+        # 同时保存输入，保证作为键的 id 在策略运行期间不会被重用
+        self._indicators[key] = (indicator, args)
+        self.created += 1
+        return indicator
+
+    def stats(self):
+        return {'created': self.created, 'reused': self.reused}
+
+
+def find_strategy(owner):
+    while owner is not None and not isinstance(owner, bt.Strategy):
+        owner = owner._owner
+    return owner
+
+
+def registry(owner):
+    """
+    owner 所在策略的登记表，第一次使用时创建
+    """
+    strategy = find_strategy(owner)
+    found = getattr(strategy, '_indicator_registry', None)
+    if found is None:
+        found = strategy._indicator_registry = IndicatorRegistry()
+    return found
+
+
+def shared_indicator(owner, cls, *args, **kwargs):
+    """
+    返回 cls(*args, **kwargs)，同一策略中已经有相同输入和参数的指标时返回已有的对象
+    """
+    return registry(owner).get(owner, cls, args, kwargs)
+
+
+def registry_stats(strategy):
+    """
+    {'created': 创建的指标个数, 'reused': 省掉的重复指标个数}
+    """
+    found = getattr(strategy, '_indicator_registry', None)
+    return found.stats() if found is not None else {
+        'created': 0,
+        'reused': 0
+    }
@@ -0,0 +1,466 @@
+"""
+回测结果库，把每次优化、实验矩阵的结果保存到 SQLite 中，不再只打印到屏幕上。
+
+每条结果记录策略、参数、基金组合、区间、各项指标（见 backtest_optimizer 的记录）
+和数据版本，分为四张表：
+
+- groups：组合名和基金列表；
+- params：策略名和参数（JSON），常用的 period 单独一列；
+- versions：数据版本，每个数据文件的内容哈希第一次出现时分配一个递增的编号，
+  一次回测的数据版本为它用到的数据文件中最大的编号，数据更新后的结果版本号更大；
+- runs：每次回测一行，引用上面三张表，各项指标各占一列。
+
+runs 上按 (组合, sharpe) 和 (数据版本, sharpe) 建索引，每个组合最好的参数、
+某个数据版本之后 sharpe 大于 1 的结果等查询只扫描索引中需要的部分。(数据版本, sharpe)
+的索引同时包含组合和参数的编号，runs 只取 columns 中的几列时不需要读表：
+
+    store = ResultStore()
+    backtestopt(..., store=store)
+    store.best()                          # 每个组合 sharpe 最高的一行
+    store.runs(min_sharpe=1.0, since=3)   # 数据版本 3 之后 sharpe 大于 1 的结果
+    store.runs(since=3, columns=('group', 'period', 'sharpe'), limit=100)
+
+并行回测的结果由主进程收集，add 先放入缓冲区，攒够 batch 条在一个事务中批量写入：
+组合、参数和数据版本的编号对整批记录一起查询或插入，再用 executemany 写入 runs。
+数据库使用 WAL 模式，多个进程同时写入时互相等待而不是报错。
+
+export 把查询结果逐批写成 backtest_journal 的列式格式，read_journal 直接映射，
+heatmap 得到 组合 × 周期 的指标表。
+"""
+import datetime
+import json
+import operator
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest.backtest_cache import clamp_end_date, file_hash
+from backtest.backtest_journal import Table, read_journal, write_schema
+from backtest.backtest_optimizer import RECORD_FIELDS
+
+mainpath = os.path.dirname(os.path.dirname(__file__))
+
+RESULTS_DB = os.path.join(mainpath, 'datas/results.sqlite')
+BATCH = 1000
+# 页缓存（KB），大批量写入时索引的页都留在内存中
+CACHE_KB = 64 * 1024
+# 一条 SELECT 中 IN (VALUES ...) 的最多行数
+LOOKUP_BATCH = 200
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    funds TEXT NOT NULL,
+    UNIQUE (name, funds)
+);
+CREATE TABLE IF NOT EXISTS params (
+    id INTEGER PRIMARY KEY,
+    strategy TEXT NOT NULL,
+    params TEXT NOT NULL,
+    period INTEGER,
+    UNIQUE (strategy, params)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (name, digest)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL REFERENCES groups (id),
+    params_id INTEGER NOT NULL REFERENCES params (id),
+    version INTEGER NOT NULL REFERENCES versions (id),
+    window TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    created REAL NOT NULL,
+    final_value REAL,
+    total_return REAL,
+    annual_return REAL,
+    sharpe REAL,
+    sqn REAL,
+    max_drawdown REAL,
+    exposure REAL,
+    trades INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_group_sharpe ON runs (group_id, sharpe);
+DROP INDEX IF EXISTS runs_version_sharpe;
+CREATE INDEX IF NOT EXISTS runs_version_sharpe_cover
+    ON runs (version, sharpe, group_id, params_id);
+CREATE INDEX IF NOT EXISTS runs_sharpe_version ON runs (sharpe, version);
+CREATE INDEX IF NOT EXISTS runs_params ON runs (params_id);
+'''
+
+# 查询结果的列和对应的 SQL 表达式，g 为 groups，p 为 params，r 为 runs
+COLUMN_SQL = dict([('id', 'r.id'), ('group', 'g.name'), ('funds', 'g.funds'),
+                   ('strategy', 'p.strategy'), ('params', 'p.params'),
+                   ('period', 'p.period'), ('version', 'r.version'),
+                   ('window', 'r.window'), ('start_date', 'r.start_date'),
+                   ('end_date', 'r.end_date')] +
+                  [(field, f'r.{field}') for field in RECORD_FIELDS])
+COLUMNS = tuple(COLUMN_SQL)
+_metrics = operator.itemgetter(*RECORD_FIELDS)
+
+
+def _date(dt):
+    return None if dt is None else dt.isoformat(sep=' ')
+
+
+def _params(params):
+    params = {
+        key: value
+        for key, value in params.items() if key not in ('printlog', 'logto')
+    }
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def _select_sql(columns, clauses, order=None, limit=None, inner=None):
+    """
+    查询 columns 的 SQL，只连接用到的 groups、params 表。inner 为额外连接的子查询
+    """
+    exprs = [COLUMN_SQL[column] for column in columns]
+    used = ' '.join(exprs + clauses + [order or ''])
+    sql = f'SELECT {", ".join(exprs)} FROM runs r'
+    if inner is not None:
+        sql += f' JOIN ({inner}) k ON k.id = r.id'
+    if 'g.' in used:
+        sql += ' JOIN groups g ON g.id = r.group_id'
+    if 'p.' in used:
+        sql += ' JOIN params p ON p.id = r.params_id'
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    if order is not None:
+        sql += f' ORDER BY {order}'
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+    return sql
+
+
+class ResultStore(object):
+    """
+    SQLite 中的回测结果库（见模块说明）
+    """
+
+    def __init__(self, path=RESULTS_DB, batch=BATCH):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.batch = batch
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'PRAGMA cache_size=-{CACHE_KB}')
+        self.conn.executescript(SCHEMA)
+
+        self._ids = dict()
+        self._versions = dict()
+        self._end_dates = dict()
+        self._params = dict()
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _id(self, table, columns, values, extra=()):
+        """
+        按唯一列 columns 取得一行的编号，没有时插入，编号在进程中缓存
+        """
+        key = (table, values)
+        i = self._ids.get(key)
+        if i is None:
+            names = columns + tuple(name for name, _ in extra)
+            self.conn.execute(
+                f'INSERT OR IGNORE INTO {table} ({", ".join(names)}) '
+                f'VALUES ({", ".join("?" * len(names))})',
+                values + tuple(value for _, value in extra))
+            where = ' AND '.join(f'{column} = ?' for column in columns)
+            i = self.conn.execute(f'SELECT id FROM {table} WHERE {where}',
+                                  values).fetchone()[0]
+            self._ids[key] = i
+        return i
+
+    def _bulk_ids(self, table, columns, keys, extra=()):
+        """
+        keys 为 {唯一列 columns 的值: extra 列的值}，返回 {唯一列的值: 编号}。
+        缓存中没有的一起插入，再分批查询编号，编号在进程中缓存
+        """
+        missing = [key for key in keys if (table, key) not in self._ids]
+        if missing:
+            names = columns + extra
+            self.conn.executemany(
+                f'INSERT OR IGNORE INTO {table} ({", ".join(names)}) '
+                f'VALUES ({", ".join("?" * len(names))})',
+                [key + keys[key] for key in missing])
+            marks = f'({", ".join("?" * len(columns))})'
+            for begin in range(0, len(missing), LOOKUP_BATCH):
+                chunk = missing[begin:begin + LOOKUP_BATCH]
+                rows = self.conn.execute(
+                    f'SELECT id, {", ".join(columns)} FROM {table} '
+                    f'WHERE ({", ".join(columns)}) IN '
+                    f'(VALUES {", ".join([marks] * len(chunk))})',
+                    [value for key in chunk for value in key])
+                for i, *values in rows:
+                    self._ids[(table, tuple(values))] = i
+        return {key: self._ids[(table, key)] for key in keys}
+
+    def _params_json(self, params):
+        """
+        参数的 JSON，相同的参数只转换一次
+        """
+        try:
+            key = tuple(sorted(params.items()))
+            found = self._params.get(key)
+        except TypeError:
+            # 参数中有不能哈希或比较的值
+            return _params(params)
+        if found is None:
+            found = self._params[key] = _params(params)
+        return found
+
+    def version(self, datapaths):
+        """
+        数据文件 datapaths 当前内容的版本号
+        """
+        version = 0
+        for path in datapaths:
+            key = (os.path.basename(path), file_hash(path))
+            i = self._versions.get(key)
+            if i is None:
+                with self.conn:
+                    i = self._id('versions', ('name', 'digest'), key,
+                                 (('created', time.time()), ))
+                self._versions[key] = i
+            version = max(version, i)
+        return version
+
+    def versions(self):
+        """
+        所有数据版本：[(版本号, 数据文件名, 第一次出现的时间)]
+        """
+        rows = self.conn.execute(
+            'SELECT id, name, created FROM versions ORDER BY id').fetchall()
+        return [(i, name, datetime.datetime.fromtimestamp(created))
+                for i, name, created in rows]
+
+    def add(self,
+            rec,
+            group,
+            funds,
+            datapaths,
+            start_date=None,
+            end_date=None,
+            window=None):
+        """
+        缓冲一条记录，攒够 batch 条后写入。funds 为基金列表，datapaths 为对应的数据文件。
+        数据版本在写入时按数据文件当时的内容确定，更新数据文件之前先 flush
+        """
+        datapaths = tuple(datapaths)
+        # 和缓存键一样，晚于数据最后一天的结束日期统一成最后一天
+        key = (datapaths, end_date)
+        if key not in self._end_dates:
+            self._end_dates[key] = _date(clamp_end_date(datapaths, end_date))
+        self._pending.append((datapaths, ','.join(funds), group,
+                              rec['strategy'], rec['params'], window,
+                              _date(start_date), self._end_dates[key],
+                              time.time()) +
+                             _metrics(rec))
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """
+        在一个事务中写入缓冲的所有记录，组合、参数和数据版本按整批查询或插入
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+        # 同一批记录用到的每组数据文件只计算一次版本
+        versions = {
+            datapaths: self.version(datapaths)
+            for datapaths in {row[0] for row in pending}
+        }
+        params = [(row[3], self._params_json(row[4]), row[4].get('period'))
+                  for row in pending]
+        with self.conn:
+            group_ids = self._bulk_ids('groups', ('name', 'funds'),
+                                       {(row[2], row[1]): ()
+                                        for row in pending})
+            params_ids = self._bulk_ids(
+                'params', ('strategy', 'params'),
+                {(strategy, text): (period, )
+                 for strategy, text, period in params}, ('period', ))
+            rows = [(group_ids[(group, funds)], params_ids[(strategy, text)],
+                     versions[datapaths], window, start_date, end_date,
+                     created, *metrics)
+                    for (datapaths, funds, group, _, _, window, start_date,
+                         end_date, created, *metrics), (strategy, text, _) in
+                    zip(pending, params)]
+            self.conn.executemany(
+                'INSERT INTO runs (group_id, params_id, version, window, '
+                'start_date, end_date, created, {metrics}) VALUES ({marks})'.
+                format(metrics=', '.join(RECORD_FIELDS),
+                       marks=', '.join('?' * (7 + len(RECORD_FIELDS)))),
+                rows)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        # 更新查询计划用的统计信息
+        self.conn.execute('PRAGMA optimize')
+        self.conn.close()
+
+    def __len__(self):
+        self.flush()
+        return self.conn.execute('SELECT count(*) FROM runs').fetchone()[0]
+
+    def _where(self, strategy=None, group=None, window=None, since=None,
+               min_sharpe=None):
+        clauses, args = [], []
+        if strategy is not None:
+            clauses.append('p.strategy = ?')
+            args.append(getattr(strategy, '__name__', strategy))
+        if group is not None:
+            clauses.append('g.name = ?')
+            args.append(group)
+        if window is not None:
+            clauses.append('r.window = ?')
+            args.append(window)
+        if since is not None:
+            clauses.append('r.version >= ?')
+            args.append(since)
+        if min_sharpe is not None:
+            clauses.append('r.sharpe > ?')
+            args.append(min_sharpe)
+        return clauses, args
+
+    def runs(self,
+             strategy=None,
+             group=None,
+             window=None,
+             since=None,
+             min_sharpe=None,
+             columns=COLUMNS,
+             limit=None):
+        """
+        按条件查询结果的 DataFrame：strategy 为策略类或策略名，since 为最小的数据版本，
+        min_sharpe 为 sharpe 的下限（不含），columns 为需要的列（见 COLUMNS），
+        limit 为最多返回的行数。
+
+        行的顺序为所用索引的顺序（例如按 since 查询时按数据版本和 sharpe），不按 id
+        排序，否则 SQLite 会按主键扫描整张表而不使用索引
+        """
+        self.flush()
+        columns = list(columns)
+        clauses, args = self._where(strategy, group, window, since,
+                                    min_sharpe)
+        cursor = self.conn.execute(
+            _select_sql(columns, clauses, limit=limit), args)
+        return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+
+    def best(self, key='sharpe', strategy=None, window=None, since=None):
+        """
+        每个组合中 key 最大的一行（相同时取最新的一行），按组合的编号排列
+        """
+        if key not in RECORD_FIELDS:
+            raise ValueError(f'未知的指标：{key}')
+        self.flush()
+        clauses, args = self._where(strategy, None, window, since)
+        # 一次查询：对每个组合 b 用 (组合, key) 的索引从大到小找第一条满足条件的结果
+        first = _select_sql(['id'],
+                            ['r.group_id = b.id', f'r.{key} IS NOT NULL'] +
+                            clauses,
+                            order=f'r.{key} DESC, r.id DESC',
+                            limit=1)
+        sql = _select_sql(COLUMNS, [],
+                          order='r.group_id',
+                          inner=f'SELECT ({first}) AS id FROM groups b')
+        return pd.DataFrame.from_records(self.conn.execute(sql,
+                                                           args).fetchall(),
+                                         columns=list(COLUMNS))
+
+    def export(self,
+               path,
+               strategy=None,
+               group=None,
+               window=None,
+               since=None,
+               min_sharpe=None,
+               batch=BATCH):
+        """
+        把查询结果写到 path 目录（backtest_journal 的列式格式），返回行数。
+        组合和策略保存为 schema.json 中 groups、strategies 列表的序号，没有 period
+        参数时 period 为 NaN
+        """
+        self.flush()
+        os.makedirs(path, exist_ok=True)
+        columns = [('id', 'i8'), ('group', 'i4'), ('strategy', 'i4'),
+                   ('version', 'i4'), ('period', 'f8')
+                   ] + [(field, 'f8') for field in RECORD_FIELDS]
+        table = Table(path, 'runs', columns, batch)
+        groups, strategies = dict(), dict()
+
+        clauses, args = self._where(strategy, group, window, since,
+                                    min_sharpe)
+        cursor = self.conn.execute(
+            _select_sql(('id', 'group', 'strategy', 'period', 'version') +
+                        RECORD_FIELDS,
+                        clauses,
+                        order='r.id'), args)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                for i, name, strategy_name, period, version, *metrics in rows:
+                    table.append(
+                        i, groups.setdefault(name, len(groups)),
+                        strategies.setdefault(strategy_name, len(strategies)),
+                        version, np.nan if period is None else period,
+                        *(np.nan if m is None else m for m in metrics))
+        finally:
+            table.close()
+        write_schema(path, {'runs': table},
+                     groups=list(groups),
+                     strategies=list(strategies))
+        return table.rows
+
+
+def run_frame(journal):
+    """
+    export 导出的结果的 DataFrame，组合和策略换成名字
+    """
+    runs = journal['runs']
+    frame = pd.DataFrame({column: np.asarray(runs[column])
+                          for column in runs})
+    frame['group'] = np.array(journal['groups'], dtype=object)[frame['group']]
+    frame['strategy'] = np.array(journal['strategies'],
+                                 dtype=object)[frame['strategy']]
+    return frame
+
+
+def heatmap(journal, key='sharpe', strategy=None):
+    """
+    组合 × 周期 的 key，同一个格子有多个结果时取最大值。journal 为 export 的目录
+    或 read_journal 的结果
+    """
+    if isinstance(journal, str):
+        journal = read_journal(journal)
+    frame = run_frame(journal)
+    if strategy is not None:
+        frame = frame[frame['strategy'] == getattr(strategy, '__name__',
+                                                   strategy)]
+    return frame.pivot_table(index='group',
+                             columns='period',
+                             values=key,
+                             aggfunc='max')
+
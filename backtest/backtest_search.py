@@ -0,0 +1,339 @@
+"""
+多参数策略的自适应参数搜索。
+
+参数多的时候 optstrategy 的网格组合数太多，这里在固定的回测次数内寻找好的参数区域：
+
+- successive_halving：随机抽取 n 组参数，先在很短的日期区间上回测，只保留最好的
+  1/eta 进入下一轮，区间扩大 eta 倍，直到在完整区间上回测剩下的几组；
+- tpe_search：先随机回测 startup 组参数，之后把已有结果分成好（前 gamma）和差两部分，
+  对每个参数分别用核密度估计两部分的分布，从好的分布中抽样，选择 好/差 密度比最大的
+  候选（Tree-structured Parzen Estimator）。没有进步或达到目标时提前结束。
+
+参数空间为 {参数名: 取值}，取值为列表时从中选择，为 (下限, 上限) 时在区间内均匀取值，
+上下限都是整数时只取整数。每组参数由 objective(params, fromdate, todate) 回测，
+返回 backtest_optimizer.record 格式的记录，按 key 的值从大到小比较。同一批参数
+在进程池中并行回测，objective 需要可以 pickle（例如 StrategyObjective）。
+"""
+import contextlib
+import datetime
+import io
+import math
+import multiprocessing
+
+import backtrader as bt
+import numpy as np
+
+from backtest.backtest_optimizer import add_metrics, record
+
+# 子进程中的 objective，由进程池的 initializer 设置
+_objective = None
+
+
+class StrategyObjective(object):
+    """
+    回测 strategy 的一组参数。feeds(fromdate, todate) 返回数据源列表，
+    setup(cerebro) 做其他设置（例如 sizer），fixed 为固定的策略参数。
+    """
+
+    def __init__(self,
+                 strategy,
+                 feeds,
+                 cash=200000.0,
+                 commission=0.00015,
+                 setup=None,
+                 fixed=None):
+        self.strategy = strategy
+        self.feeds = feeds
+        self.cash = cash
+        self.commission = commission
+        self.setup = setup
+        self.fixed = fixed or dict()
+
+    def __call__(self, params, fromdate, todate):
+        cerebro = bt.Cerebro(stdstats=False)
+        cerebro.addstrategy(self.strategy, **dict(self.fixed, **params))
+        for data in self.feeds(fromdate, todate):
+            cerebro.adddata(data)
+        cerebro.broker.setcash(self.cash)
+        cerebro.broker.setcommission(commission=self.commission)
+        if self.setup is not None:
+            self.setup(cerebro)
+        add_metrics(cerebro)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            strat = cerebro.run(maxcpus=1)[0]
+        return record(strat)
+
+
+def _init(objective):
+    global _objective
+    _objective = objective
+
+
+def _run(task):
+    params, fromdate, todate = task
+    return _objective(params, fromdate, todate)
+
+
+class Evaluator(object):
+    """
+    在进程池中回测一批参数，workers 为 1 时在当前进程中回测
+    """
+
+    def __init__(self, objective, key='sharpe', workers=None):
+        self.key = key
+        self.workers = workers or multiprocessing.cpu_count()
+        self.trials = []
+        if workers == 1:
+            _init(objective)
+            self._pool = None
+        else:
+            self._pool = multiprocessing.Pool(workers,
+                                              initializer=_init,
+                                              initargs=(objective, ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def score(self, rec):
+        value = rec.get(self.key)
+        if value is None or math.isnan(value):
+            return float('-inf')
+        return value
+
+    def evaluate(self, params_list, fromdate, todate, **info):
+        """
+        回测 params_list 中的每组参数，按顺序返回结果
+        {'params', 'fromdate', 'todate', 'score', 'record', ...info}
+        """
+        tasks = [(params, fromdate, todate) for params in params_list]
+        if self._pool is None:
+            records = list(map(_run, tasks))
+        else:
+            records = self._pool.map(_run, tasks)
+
+        trials = [
+            dict(info,
+                 params=params,
+                 fromdate=fromdate,
+                 todate=todate,
+                 score=self.score(rec),
+                 record=rec) for params, rec in zip(params_list, records)
+        ]
+        self.trials.extend(trials)
+        return trials
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def _is_int_range(spec):
+    return isinstance(spec[0], int) and isinstance(spec[1], int)
+
+
+def sample(space, rng):
+    """
+    在参数空间中均匀抽取一组参数
+    """
+    params = dict()
+    for name, spec in space.items():
+        if isinstance(spec, list):
+            params[name] = spec[rng.integers(len(spec))]
+        elif _is_int_range(spec):
+            params[name] = int(rng.integers(spec[0], spec[1] + 1))
+        else:
+            params[name] = float(rng.uniform(spec[0], spec[1]))
+    return params
+
+
+def _param_key(params):
+    return tuple(sorted(params.items()))
+
+
+def successive_halving(objective,
+                       space,
+                       start_date,
+                       end_date,
+                       n=27,
+                       eta=3,
+                       min_fraction=1.0 / 9,
+                       key='sharpe',
+                       workers=None,
+                       seed=0):
+    """
+    随机抽取 n 组参数，从 start_date 开始、长度为完整区间 min_fraction 的日期区间回测，
+    每一轮保留最好的 1/eta，区间扩大 eta 倍，最后一轮使用完整区间。
+
+    返回 {'best': 最后一轮最好的结果, 'trials': 所有回测的结果}，结果中的 rung 为轮次。
+    """
+    rng = np.random.default_rng(seed)
+    span = end_date - start_date
+
+    candidates, seen = [], set()
+    for _ in range(n * 10):
+        if len(candidates) >= n:
+            break
+        params = sample(space, rng)
+        if _param_key(params) not in seen:
+            seen.add(_param_key(params))
+            candidates.append(params)
+
+    fractions = []
+    fraction = 1.0
+    while fraction > min_fraction * (1.0 + 1e-9):
+        fractions.insert(0, fraction)
+        fraction /= eta
+    fractions.insert(0, max(fraction, min_fraction))
+
+    with Evaluator(objective, key, workers) as evaluator:
+        for rung, fraction in enumerate(fractions):
+            todate = start_date + datetime.timedelta(
+                seconds=span.total_seconds() * fraction)
+            trials = evaluator.evaluate(candidates,
+                                        start_date,
+                                        min(todate, end_date),
+                                        rung=rung)
+            trials.sort(key=lambda trial: trial['score'], reverse=True)
+            if rung == len(fractions) - 1:
+                break
+            keep = max(1, len(trials) // eta)
+            candidates = [trial['params'] for trial in trials[:keep]]
+
+    return {'best': trials[0], 'trials': evaluator.trials}
+
+
+class _Parzen(object):
+    """
+    一个参数在一组结果上的分布：区间参数为以每个值为中心的正态分布加上均匀先验，
+    列表参数为加 1 平滑后的频率
+    """
+
+    def __init__(self, spec, values):
+        self.spec = spec
+        if isinstance(spec, list):
+            counts = np.ones(len(spec))
+            for value in values:
+                counts[spec.index(value)] += 1
+            self.probs = counts / counts.sum()
+            return
+
+        low, high = spec
+        self.values = np.asarray(values, dtype='f8')
+        width = float(high - low)
+        std = self.values.std() if len(self.values) > 1 else width
+        self.sigma = max(std, width / 20.0) * max(len(self.values),
+                                                  1)**(-1.0 / 5)
+
+    def draw(self, rng):
+        if isinstance(self.spec, list):
+            return self.spec[rng.choice(len(self.spec), p=self.probs)]
+
+        low, high = self.spec
+        if len(self.values) == 0 or rng.random() < 1.0 / (len(self.values) + 1):
+            value = rng.uniform(low, high)
+        else:
+            value = rng.normal(rng.choice(self.values), self.sigma)
+        value = min(max(value, low), high)
+        return int(round(value)) if _is_int_range(self.spec) else float(value)
+
+    def logpdf(self, value):
+        if isinstance(self.spec, list):
+            return math.log(self.probs[self.spec.index(value)])
+
+        low, high = self.spec
+        n = len(self.values)
+        density = 1.0 / ((high - low) or 1.0) / (n + 1)
+        if n:
+            z = (value - self.values) / self.sigma
+            density += np.exp(-0.5 * z * z).sum() / (
+                self.sigma * math.sqrt(2.0 * math.pi)) / (n + 1)
+        return math.log(density)
+
+
+def suggest(space, trials, rng, gamma=0.25, candidates=24, exclude=()):
+    """
+    根据已有结果建议一组参数：从好的结果的分布中抽取 candidates 组，
+    取 好/差 密度比最大、并且不在 exclude 中的一组
+    """
+    ranked = sorted(trials, key=lambda trial: trial['score'], reverse=True)
+    n_good = max(1, int(math.ceil(gamma * len(ranked))))
+    good = [trial['params'] for trial in ranked[:n_good]]
+    bad = [trial['params'] for trial in ranked[n_good:]]
+
+    l = {name: _Parzen(spec, [p[name] for p in good])
+         for name, spec in space.items()}
+    g = {name: _Parzen(spec, [p[name] for p in bad])
+         for name, spec in space.items()}
+
+    best, best_ratio = None, float('-inf')
+    for _ in range(candidates):
+        params = {name: l[name].draw(rng) for name in space}
+        if _param_key(params) in exclude:
+            continue
+        ratio = sum(l[name].logpdf(params[name]) - g[name].logpdf(params[name])
+                    for name in space)
+        if ratio > best_ratio:
+            best, best_ratio = params, ratio
+    return best if best is not None else sample(space, rng)
+
+
+def tpe_search(objective,
+               space,
+               start_date,
+               end_date,
+               budget=100,
+               startup=20,
+               batch=None,
+               gamma=0.25,
+               candidates=24,
+               patience=None,
+               target=None,
+               key='sharpe',
+               workers=None,
+               seed=0):
+    """
+    在完整区间上最多回测 budget 组参数，每批 batch 组（默认进程数）并行回测。
+    patience 批没有更好的结果，或者最好的结果达到 target 时提前结束。
+
+    返回 {'best': 最好的结果, 'trials': 所有回测的结果}
+    """
+    rng = np.random.default_rng(seed)
+
+    with Evaluator(objective, key, workers) as evaluator:
+        batch = batch or evaluator.workers
+        trials, seen = [], set()
+        best, stale = None, 0
+
+        while len(trials) < budget:
+            size = min(batch, budget - len(trials))
+            params_list = []
+            for _ in range(size):
+                if len(trials) < startup:
+                    params = sample(space, rng)
+                else:
+                    params = suggest(space, trials, rng, gamma, candidates,
+                                     seen)
+                seen.add(_param_key(params))
+                params_list.append(params)
+
+            new = evaluator.evaluate(params_list, start_date, end_date)
+            trials.extend(new)
+
+            top = max(new, key=lambda trial: trial['score'])
+            if best is None or top['score'] > best['score']:
+                best, stale = top, 0
+            elif len(trials) > startup:
+                stale += 1
+
+            if target is not None and best['score'] >= target:
+                break
+            if patience is not None and stale >= patience:
+                break
+
+    return {'best': best, 'trials': trials}
@@ -0,0 +1,126 @@
+"""
+参数优化时在多个进程之间共享基金数据。
+
+SharedFundGroup 在主进程中把一组基金的二进制存储（backtest_store）一次性复制到
+一块共享内存里，子进程只按名字挂载这块内存并以只读方式读取，不再各自解析 CSV，
+也不需要把已经加载好的数据 pickle 给每个任务。
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtest.backtest_feeds import ETFCsvData, StoreData
+from backtest.backtest_store import COLUMNS, load_store
+
+# 每个进程中已经挂载的共享内存，按名字缓存，进程内只挂载一次
+_attached = dict()
+
+
+def attach(shm_name, offset, nrows):
+    """
+    挂载共享内存中的一个基金，返回只读的 (行数, 7) 数组
+    """
+    shm = _attached.get(shm_name)
+    if shm is None:
+        shm = _attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+
+    array = np.ndarray((nrows, len(COLUMNS)),
+                       dtype='f8',
+                       buffer=shm.buf,
+                       offset=offset,
+                       order='F')
+    array.flags.writeable = False
+    return array
+
+
+class SharedStoreData(StoreData):
+    """
+    从共享内存读取数据的 StoreData，shared 为 SharedFundGroup 中的 (名字, 偏移, 行数)
+    """
+    params = (('shared', None), )
+
+    def _getarray(self):
+        return attach(*self.p.shared)
+
+
+class SharedFundGroup(object):
+    """
+    一组基金的共享内存数据
+
+    with SharedFundGroup(datapaths) as group:
+        for data in group.feeds(fromdate, todate):
+            cerebro.adddata(data)
+        cerebro.run(optdatas=False)
+
+    datapaths 为 {基金代码: CSV 路径}。只有创建它的进程会在 close 时释放共享内存，
+    被 pickle 到子进程中的对象只保存名字和偏移。
+    """
+
+    def __init__(self, datapaths, csvformat=ETFCsvData):
+        arrays = dict()
+        for name, path in datapaths.items():
+            arrays[name] = load_store(path, csvformat)
+
+        size = sum(array.nbytes for array in arrays.values())
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.shm_name = self._shm.name
+        _attached[self.shm_name] = self._shm
+        self.datapaths = dict(datapaths)
+        self.csvformat = csvformat
+
+        self.manifest = dict()
+        offset = 0
+        for name, array in arrays.items():
+            nrows = len(array)
+            view = np.ndarray(array.shape,
+                              dtype='f8',
+                              buffer=self._shm.buf,
+                              offset=offset,
+                              order='F')
+            view[:] = array
+            self.manifest[name] = (self.shm_name, offset, nrows)
+            offset += array.nbytes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.manifest)
+
+    def names(self):
+        return list(self.manifest)
+
+    def array(self, name):
+        """
+        只读的 (行数, 7) 数组，列顺序见 backtest_store.COLUMNS
+        """
+        return attach(*self.manifest[name])
+
+    def feeds(self, fromdate=None, todate=None, funds=None):
+        """
+        为 funds（默认全部基金）创建数据源，数据名和 CSV 文件名一致
+        """
+        funds = self.names() if funds is None else funds
+        return [
+            SharedStoreData(dataname=self.datapaths[name],
+                            shared=self.manifest[name],
+                            fromdate=fromdate,
+                            todate=todate) for name in funds
+        ]
+
+    def close(self):
+        if self._shm is None:
+            return
+
+        _attached.pop(self.shm_name, None)
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
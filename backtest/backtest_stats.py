@@ -0,0 +1,221 @@
+"""
+一次遍历、常数内存的回测统计。
+
+RunStats 分析器代替 SharpeRatio_A、Returns、AnnualReturn、DrawDown、SQN 和
+TradeAnalyzer 的组合，每根 K 线只更新几个累计量，不保存每天的收益或每笔交易：
+
+- 每个周期（timeframe，默认为年，和 SharpeRatio_A 的默认设置相同）的收益率和
+  TimeReturn 一样按周期内最后一根 K 线的总资产计算，均值和方差用 Welford 算法
+  累计，Sharpe 和 SharpeRatio_A 一样按无风险利率 1% 计算并年化（日线每年 252 个
+  交易日）。参数优化的记录用 timeframe=Days，和原来优化时的 Sharpe 相同；
+- 总收益以实际的初始资金计算，年化收益按第一根到最后一根 K 线的实际天数
+  （每年 365.25 天）计算，backtest_walkforward 的样本外年化收益也按这个方法计算；
+- SQN 由每笔平仓交易的净盈亏（pnlcomm）累计，使用 FastBroker 时平仓次数和
+  盈亏从 broker 中读取；
+- 最大回撤为百分比，exposure 为有持仓的 K 线比例。
+
+get_analysis() 返回一个普通的 dict，可以直接放入优化的记录中。策略的 stop() 中
+打印的收益由 strategy_returns 按同样的方法计算。
+"""
+import datetime
+import math
+
+import backtrader as bt
+
+DAYS_PER_YEAR = 365.25
+TRADING_DAYS = 252
+RISKFREE = 0.01
+
+# 各周期收益率年化 Sharpe 时的每年周期数，和 SharpeRatio 相同
+FACTORS = {
+    bt.TimeFrame.Days: TRADING_DAYS,
+    bt.TimeFrame.Weeks: 52,
+    bt.TimeFrame.Months: 12,
+    bt.TimeFrame.Years: 1,
+}
+
+
+def annualize(total_return, days):
+    """
+    days 天的总收益率换算成年化收益率
+    """
+    if days <= 0 or total_return <= -1.0:
+        return 0.0 if total_return > -1.0 else -1.0
+    return (1.0 + total_return)**(DAYS_PER_YEAR / days) - 1.0
+
+
+def period_key(day, timeframe):
+    """
+    日期序号（date.toordinal()）所在的周期，周按 ISO 周历
+    """
+    if timeframe == bt.TimeFrame.Days:
+        return day
+    date = datetime.date.fromordinal(day)
+    if timeframe == bt.TimeFrame.Weeks:
+        return date.isocalendar()[:2]
+    if timeframe == bt.TimeFrame.Months:
+        return date.year, date.month
+    return date.year
+
+
+def strategy_returns(strategy):
+    """
+    策略到当前 K 线为止的总收益率和年化收益率，以实际的初始资金和经过的天数计算，
+    用于在 stop() 中打印结果
+    """
+    broker = strategy.broker
+    total_return = broker.getvalue() / broker.startingcash - 1.0
+    days = 0.0
+    if len(strategy) > 1:
+        days = strategy.datetime[0] - strategy.datetime[1 - len(strategy)]
+    return total_return, annualize(total_return, days)
+
+
+class Welford(object):
+    """
+    累计均值和方差（总体方差，和 backtrader 的 standarddev 一致）
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.n) if self.n else 0.0
+
+
+class RunStats(bt.Analyzer):
+    """
+    Sharpe、年化和总收益、SQN、最大回撤和持仓比例（见模块说明）。
+
+    timeframe 为计算 Sharpe 的收益率周期（Days、Weeks、Months 或 Years），factor 为
+    每年的周期数，为 None 时按 FACTORS 取值。fromdate 之前的 K 线不参与统计，
+    初始资金为 fromdate 前一根 K 线收盘后的总资产。
+    """
+    params = (
+        ('timeframe', bt.TimeFrame.Years),
+        ('riskfreerate', RISKFREE),
+        ('factor', None),
+        ('fromdate', None),
+    )
+
+    def start(self):
+        broker = self.strategy.broker
+        self.start_value = broker.getvalue()
+        self.value = self.start_value
+        self.cash = broker.getcash()
+
+        if self.p.timeframe not in FACTORS:
+            raise ValueError(f'timeframe 只能是 {list(FACTORS)} 之一')
+        self.factor = self.p.factor or FACTORS[self.p.timeframe]
+        self._fromnum = None if self.p.fromdate is None else bt.date2num(
+            self.p.fromdate)
+
+        self.returns = Welford()
+        self.pnls = Welford()
+        self._day = None
+        self._period = None
+        self._period_start = self.start_value
+        self._period_value = self.start_value
+
+        self.first_dt = None
+        self.last_dt = None
+        self.bars = 0
+        self.invested = 0
+
+        self.peak = self.start_value
+        self.max_drawdown = 0.0
+        self.max_moneydown = 0.0
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        self.cash = cash
+        self.value = value
+
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            self.pnls.add(trade.pnlcomm)
+
+    def next(self):
+        dt = self.strategy.datetime[0]
+        if self._fromnum is not None and dt < self._fromnum:
+            # 统计从 fromdate 开始，以这根 K 线收盘后的总资产为初始资金
+            self.start_value = self._period_start = self.peak = self.value
+            return
+        day = int(dt)
+        if day != self._day:
+            # 只在换日时计算周期
+            self._day = day
+            period = period_key(day, self.p.timeframe)
+            if period != self._period:
+                if self._period is not None:
+                    self._close_period()
+                self._period = period
+        if self.first_dt is None:
+            self.first_dt = dt
+        self.last_dt = dt
+        self._period_value = self.value
+
+        self.bars += 1
+        if self.value != self.cash:
+            self.invested += 1
+
+        if self.value > self.peak:
+            self.peak = self.value
+        moneydown = self.peak - self.value
+        if moneydown > self.max_moneydown:
+            self.max_moneydown = moneydown
+        drawdown = 100.0 * moneydown / self.peak
+        if drawdown > self.max_drawdown:
+            self.max_drawdown = drawdown
+
+    def _close_period(self):
+        # 本周期的收益率，以上一个周期最后一根 K 线（第一个周期为初始资金）为基准
+        self.returns.add(self._period_value / self._period_start - 1.0)
+        self._period_start = self._period_value
+
+    def sharpe(self):
+        returns = self.returns
+        std = returns.std
+        if not returns.n or not std:
+            return None
+        rate = (1.0 + self.p.riskfreerate)**(1.0 / self.factor) - 1.0
+        return math.sqrt(self.factor) * (returns.mean - rate) / std
+
+    def sqn(self):
+        # FastBroker 不发送交易通知，平仓交易的盈亏由 broker 累计
+        pnls = getattr(self.strategy.broker, 'pnls', self.pnls)
+        if pnls.n < 2 or not pnls.std:
+            return None
+        return math.sqrt(pnls.n) * pnls.mean / pnls.std
+
+    def stop(self):
+        if self._period is not None:
+            self._close_period()
+            self._day = self._period = None
+
+        # 优化时 OptReturn 中的分析器不再引用策略，结果在这里算好
+        broker = self.strategy.broker
+        total_return = self.value / self.start_value - 1.0
+        days = (self.last_dt - self.first_dt) if self.bars else 0.0
+        self.rets = {
+            'start_value': self.start_value,
+            'final_value': self.value,
+            'total_return': total_return,
+            'annual_return': annualize(total_return, days),
+            'days': days,
+            'sharpe': self.sharpe(),
+            'sqn': self.sqn(),
+            'max_drawdown': self.max_drawdown,
+            'max_moneydown': self.max_moneydown,
+            'exposure': self.invested / self.bars if self.bars else 0.0,
+            'trades': getattr(broker, 'closed', self.pnls.n),
+            'bars': self.bars,
+        }
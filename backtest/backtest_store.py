@@ -0,0 +1,132 @@
+"""
+基金数据的二进制列式存储。
+
+CSV 文件只在第一次使用（或源文件更新之后）转换一次，之后以 numpy 内存映射的方式读取，
+不再逐行解析和 strptime。每个基金保存为一个 (行数, 7) 的 Fortran 顺序 float64 数组，
+每一列在磁盘上都是连续的：
+
+    date(公历序数), open, high, low, close, volume, openinterest
+
+存储文件放在 CSV 同目录的 .store 目录下，例如 datas/etfs/.store/sh510050.npy。
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+mainpath = os.path.dirname(os.path.dirname(__file__))
+
+STORE_DIR = '.store'
+COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume', 'openinterest')
+
+# 1970-01-01 的公历序数，datetime64[D] 加上它就是 date.toordinal()
+_EPOCH_ORDINAL = 719163
+
+
+def store_path(csv_path):
+    """
+    CSV 文件对应的二进制存储文件路径
+    """
+    dirname, filename = os.path.split(os.path.abspath(csv_path))
+    name, _ = os.path.splitext(filename)
+    return os.path.join(dirname, STORE_DIR, f'{name}.npy')
+
+
+def is_stale(csv_path):
+    """
+    存储文件不存在，或者源 CSV 比存储文件新，都需要重新转换
+    """
+    path = store_path(csv_path)
+    if not os.path.exists(path):
+        return True
+    return os.path.getmtime(csv_path) > os.path.getmtime(path)
+
+
+def read_csv_columns(csv_path, csvformat):
+    """
+    按照 csvformat（GenericCSVData 子类，如 ETFCsvData）中的列序号读取 CSV，
+    返回 (行数, 7) 的 Fortran 顺序数组。
+    """
+    p = dict(csvformat.params._getitems())
+
+    df = pd.read_csv(csv_path,
+                     header=None,
+                     skiprows=1 if p.get('headers', True) else 0,
+                     sep=p.get('separator', ','),
+                     dtype=str,
+                     keep_default_na=False)
+
+    result = np.empty((len(df), len(COLUMNS)), dtype='f8', order='F')
+
+    dates = pd.to_datetime(df[p['datetime']], format=p['dtformat'])
+    days = dates.values.astype('datetime64[D]').astype('i8')
+    result[:, 0] = days + _EPOCH_ORDINAL
+
+    # 和 GenericCSVData 一致：缺失的列和空字段都用 nullvalue 填充
+    for i, column in enumerate(COLUMNS[1:], start=1):
+        idx = p.get(column, -1)
+        if idx is None or idx < 0:
+            result[:, i] = p['nullvalue']
+        else:
+            values = df[idx].replace('', np.nan).astype('f8')
+            result[:, i] = values.fillna(p['nullvalue']).values
+
+    return result
+
+
+def convert(csv_path, csvformat):
+    """
+    把一个 CSV 转换成二进制存储，先写临时文件再替换，避免读到写了一半的文件
+    """
+    path = store_path(csv_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    array = read_csv_columns(csv_path, csvformat)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def load_store(csv_path, csvformat, mmap_mode='r'):
+    """
+    读取 CSV 对应的二进制存储（内存映射，不复制数据），过期则先重新转换
+    """
+    if is_stale(csv_path):
+        convert(csv_path, csvformat)
+    return np.load(store_path(csv_path), mmap_mode=mmap_mode)
+
+
+def tail(csv_path, n, csvformat):
+    """
+    最后 n 行（不足 n 行时返回全部），只读取文件末尾需要的部分
+    """
+    array = load_store(csv_path, csvformat)
+    return array[max(len(array) - n, 0):]
+
+
+def convert_all(down_path, csvformat, force=False):
+    """
+    转换 datas/{down_path} 下的所有 CSV，只处理过期的文件
+    """
+    csv_dir = os.path.join(mainpath, f'datas/{down_path}')
+    converted = []
+    for filename in sorted(os.listdir(csv_dir)):
+        if not filename.endswith('.csv'):
+            continue
+        csv_path = os.path.join(csv_dir, filename)
+        if force or is_stale(csv_path):
+            convert(csv_path, csvformat)
+            converted.append(filename)
+    return converted
+
+
+if __name__ == '__main__':
+    from backtest.backtest_feeds import ETFCsvData
+
+    for down_path in ['etfs', 'lofs']:
+        converted = convert_all(down_path, ETFCsvData)
+        print(f'{down_path}: 转换了 {len(converted)} 个文件')
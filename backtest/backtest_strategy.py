@@ -1,15 +1,18 @@
 import calendar
 
 import backtrader as bt
+import numpy as np
 
+from backtest.backtest_indicators import cached_indicator
+from backtest.backtest_log import LoggingStrategy
+from backtest.backtest_stats import strategy_returns
 
-class MyStrategy(bt.Strategy):
-    params = (('printlog', False), )
 
-    def log(self, txt, dt=None, doprint=False):
-        if self.params.printlog or doprint:
-            dt = dt or self.datas[0].datetime.date(0)
-            print('%s, %s' % (dt.isoformat(), txt))
+class MyStrategy(LoggingStrategy):
+    """
+    日志见 backtest_log.LoggingStrategy，logto 为日志的去向：None 为标准输出，整数为
+    内存中的环形缓冲区，字符串为文件名模板，例如 'logs/{strategy}_{period}.log'
+    """
 
     def __init__(self):
         pass
@@ -17,23 +20,15 @@ class MyStrategy(bt.Strategy):
     def next(self):
         pass
 
-    def stop(self):
-        pass
-
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
             return
 
         if order.status in [order.Completed]:
-            if order.isbuy():
-                self.log(
-                    f'执行买入，{order.data._name}，价格：{order.executed.price:.2f}，花费：{order.executed.value:.2f}，手续费：{order.executed.comm:.2f}'
-                )
-
-            else:
-                self.log(
-                    f'执行卖出，{order.data._name}，价格：{order.executed.price:.2f}，花费：{order.executed.value:.2f}，手续费：{order.executed.comm:.2f}'
-                )
+            self.log('%s，%s，价格：%.2f，花费：%.2f，手续费：%.2f',
+                     '执行买入' if order.isbuy() else '执行卖出',
+                     order.data._name, order.executed.price,
+                     order.executed.value, order.executed.comm)
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
             self.log('交易取消、保证金不足、交易被拒绝')
 
@@ -43,7 +38,7 @@ class MyStrategy(bt.Strategy):
         if not trade.isclosed:
             return
 
-        self.log(f'营业利润，毛利润：{trade.pnl:.2f}，净利润：{trade.pnlcomm:.2f}')
+        self.log('营业利润，毛利润：%.2f，净利润：%.2f', trade.pnl, trade.pnlcomm)
 
 
 """
@@ -51,24 +46,20 @@ class MyStrategy(bt.Strategy):
 """
 
 
-class DeclineStrategy(bt.Strategy):
+class DeclineStrategy(MyStrategy):
     params = (('decline', -2.0), )
 
-    def log(self, txt, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        print('%s, %s' % (dt.isoformat(), txt))
-
     def __init__(self):
         self.dataprice = self.datas[0].close
         self.rate = (self.datas[0].close -
                      self.datas[0].open) / self.datas[0].open * 100
 
     def next(self):
-        print(self.rate[0])
+        self.log('涨跌幅：%.2f%%', self.rate[0])
         if self.rate[0] <= self.params.decline or (
                 self.rate[0] + self.rate[-1]) <= self.params.decline:
             buy_size = round(250 / self.dataprice[0], 2)
-            print(buy_size)
+            self.log('买入数量：%s', buy_size)
             self.buy(size=100)
 
 
@@ -77,7 +68,7 @@ class DeclineStrategy(bt.Strategy):
 """
 
 
-class WeekStrategy(bt.Strategy):
+class WeekStrategy(MyStrategy):
     params = (('weeknum', 3), )
 
     def weekday(self, date):
@@ -85,10 +76,6 @@ class WeekStrategy(bt.Strategy):
         return (calendar.weekday(date_time.year, date_time.month,
                                  date_time.day))
 
-    def log(self, txt, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        print('%s, %s' % (dt.isoformat(), txt))
-
     def __init__(self):
         self.dataprice = self.datas[0].close
 
@@ -99,145 +86,262 @@ class WeekStrategy(bt.Strategy):
 
 
 """
-动量钟摆策略
+多基金轮动策略的基类
 """
 
 
-class MomOscStrategy(MyStrategy):
+class RotationStrategy(MyStrategy):
+    """
+    每根 K 线比较所有基金的同一个指标，持有最好的基金，其余的全部卖出。
+
+    子类实现 indicator(data)，返回该基金用于排名的指标，signal 为指标中用于排名的线；
+    以及 choose()，返回要买入的基金序号（None 为空仓），返回 HOLD 表示这根 K 线不操作。
+
+    当前所有基金的指标值和收盘价保存在 self.values 和 self.prices 中（numpy 数组，
+    没有值的为 NaN），持仓数量保存在 self.sizes 中，成交时更新（使用 FastBroker 时
+    就是 broker 中的持仓数组）。
+    runonce 模式下指标已经全部算好，第一次 next 时把所有基金的指标和收盘价按时间对齐成
+    (K 线数, 基金数) 的矩阵，之后每根 K 线只取一行，基金再多 next 的开销也基本不变。
+    调仓统一通过 rebalance(weights) 完成。
+    """
     params = (
         ('period', 20),
         ('printlog', True),
+        ('target', 0.98),
     )
 
+    HOLD = -1
+    signal = None
+
     def __init__(self):
         self.dataprice = self.datas[0].close
         self.order = None
-        self.month = -1
-        self.mom = [
-            bt.indicators.MomentumOscillator(i, period=self.params.period)
-            for i in self.datas
-        ]
+        self.inds = [self.indicator(data) for data in self.datas]
+        self.signals = [getattr(ind, self.signal) for ind in self.inds]
+        self.values = np.full(len(self.datas), np.nan)
+        self.prices = np.full(len(self.datas), np.nan)
+        # FastBroker 不发送订单通知，直接使用它在成交时更新的持仓数组
+        position_sizes = getattr(self.broker, 'position_sizes', None)
+        self.sizes = np.zeros(len(
+            self.datas)) if position_sizes is None else position_sizes(
+                self.datas)
+        self._index = {data: i for i, data in enumerate(self.datas)}
+        self._weights = np.full(len(self.datas), np.nan)
+        self._executed = dict()
+        self._dts = None
+        self._matrix = None
+        self._closes = None
+
+    def indicator(self, data):
+        raise NotImplementedError
+
+    def choose(self):
+        raise NotImplementedError
+
+    def _build_matrix(self):
+        """
+        指标已经全部算好时（runonce），按所有基金日期的并集对齐，没有 K 线的日子
+        沿用上一个值，和 backtrader 中数据源停牌时的行为一致
+        """
+        dts, columns, closes = [], [], []
+        for data, signal in zip(self.datas, self.signals):
+            if len(signal.array) != data.buflen():
+                return False
+            dts.append(np.frombuffer(data.datetime.array, dtype='f8'))
+            columns.append(np.frombuffer(signal.array, dtype='f8'))
+            closes.append(np.frombuffer(data.close.array, dtype='f8'))
+
+        self._dts = np.unique(np.concatenate(dts))
+        self._matrix = np.full((len(self._dts), len(self.datas)), np.nan)
+        self._closes = np.full((len(self._dts), len(self.datas)), np.nan)
+        for i, dt in enumerate(dts):
+            rows = np.searchsorted(dt, self._dts, 'right') - 1
+            valid = rows >= 0
+            self._matrix[valid, i] = columns[i][rows[valid]]
+            self._closes[valid, i] = closes[i][rows[valid]]
+        return True
+
+    def update_values(self):
+        if self._matrix is None and not self._build_matrix():
+            # 逐根 K 线计算的模式，只能逐个读取
+            for i, (data, signal) in enumerate(zip(self.datas, self.signals)):
+                self.values[i] = signal[0]
+                self.prices[i] = data.close[0]
+            return self.values
+
+        row = np.searchsorted(self._dts, self.datetime[0])
+        self.values[:] = self._matrix[row]
+        self.prices[:] = self._closes[row]
+        return self.values
+
+    def ranked(self, k=1):
+        """
+        指标值最大的 k 个基金的序号，从大到小，NaN 排在最后，值相同时序号小的在前
+        """
+        values = np.where(np.isnan(self.values), -np.inf, self.values)
+        k = min(k, len(values))
+        if k == 1:
+            return np.array([np.argmax(values)])
+
+        idx = np.argpartition(-values, k - 1)[:k]
+        return idx[np.lexsort((idx, -values[idx]))]
+
+    def best(self):
+        """
+        (指标值最大的基金序号, 指标值)
+        """
+        i = int(self.ranked(1)[0])
+        return i, self.values[i]
 
     def next(self):
-        buy_id = 999
-
-        c = [i.momosc[0] for i in self.mom]
-        [self.log(f'{self.datas[c.index(i)]._name}, {i}') for i in c]
+        self.update_values()
+        if self.params.printlog:
+            for data, value in zip(self.datas, self.values):
+                self.log('%s, %s', data._name, value)
 
-        value, value1, value2 = map(lambda x: x, c)
-        index, value = c.index(max(c)), max(c)
-
-        if value > 100:
-            buy_id = index
-
-        if value > 100 and value1 > 100 and value2 > 100:
-            buy_id = 888
+        buy_id = self.choose()
+        if buy_id == self.HOLD:
+            return
 
-        for i in range(0, len(c)):
+        # 已经持有的基金不加仓
+        weights = np.zeros(len(self.datas))
+        if buy_id is not None:
+            weights[buy_id] = self.params.target if self.sizes[
+                buy_id] == 0 else np.nan
+        self.rebalance(weights)
+
+    def rebalance(self, weights):
+        """
+        按目标权重（占总资产的比例，NaN 为不调整）一次调整所有基金的仓位。
+
+        和 order_target_percent 一样按当前收盘价计算数量。目标为 0 且没有持仓，
+        或者已有持仓且目标权重没有变化的基金不下单。先提交所有卖单再提交买单，
+        买入金额（含手续费）超过现金加上卖出所得时按比例减少，避免保证金不足被拒绝。
+        返回提交的订单。
+        """
+        weights = np.asarray(weights, dtype='f8')
+        prices, sizes = self.prices, self.sizes
+
+        keep = np.isnan(weights) | ((weights == 0) & (sizes == 0)) | (
+            (sizes != 0) & (weights == self._weights) & (weights != 0))
+
+        with np.errstate(all='ignore'):
+            diff = weights * self.broker.getvalue() - sizes * prices
+            delta = np.sign(diff) * np.floor_divide(np.abs(diff), prices)
+        delta = np.where(weights == 0, -sizes, delta)
+        delta[keep | ~np.isfinite(delta)] = 0.0
+
+        sells = np.flatnonzero(delta < 0)
+        buys = np.flatnonzero(delta > 0)
+
+        cash = self.broker.getcash()
+        for i in sells:
+            comminfo = self.broker.getcommissioninfo(self.datas[i])
+            cash += -delta[i] * prices[i] - comminfo.getcommission(
+                delta[i], prices[i])
+
+        costs = np.array([
+            delta[i] * prices[i] + self.broker.getcommissioninfo(
+                self.datas[i]).getcommission(delta[i], prices[i])
+            for i in buys
+        ])
+        if len(buys) and costs.sum() > cash:
+            delta[buys] = np.floor(delta[buys] * max(cash, 0.0) / costs.sum())
+
+        orders = []
+        for i in sells:
+            data = self.datas[i]
+            if weights[i] == 0:
+                orders.append(self.close(data=data, size=int(sizes[i])))
+            else:
+                orders.append(self.sell(data=data, size=int(-delta[i])))
+        for i in buys:
+            if delta[i] > 0:
+                orders.append(self.buy(data=self.datas[i], size=int(delta[i])))
 
-            if buy_id != 888 and i != buy_id:
-                position_size = self.broker.getposition(
-                    data=self.datas[i]).size
-                if position_size != 0:
-                    self.order_target_percent(data=self.datas[i], target=0)
+        changed = ~np.isnan(weights)
+        self._weights[changed] = weights[changed]
+        return orders
 
-        if buy_id != 999 and buy_id != 888:
-            position_size = self.broker.getposition(
-                data=self.datas[buy_id]).size
-            if position_size == 0:
-                self.order_target_percent(data=self.datas[buy_id], target=0.98)
+    def notify_order(self, order):
+        super(RotationStrategy, self).notify_order(order)
+
+        # 按成交数量更新持仓，部分成交时 executed.size 是累计的
+        if order.status in [order.Partial, order.Completed]:
+            executed = order.executed.size
+            self.sizes[self._index[order.data]] += executed - self._executed.get(
+                order.ref, 0.0)
+            if order.status == order.Completed:
+                self._executed.pop(order.ref, None)
+            else:
+                self._executed[order.ref] = executed
 
     def stop(self):
-        return_all = self.broker.getvalue() / 200000.0
-        print('{0}, {1}%, {2}%'.format(
-            self.params.period, round((return_all - 1.0) * 100, 2),
-            round((pow(return_all, 1.0 / 8) - 1.0) * 100, 2)))
-
+        super(RotationStrategy, self).stop()
+        total_return, annual_return = strategy_returns(self)
+        print('{0}, {1}%, {2}%'.format(self.params.period,
+                                       round(total_return * 100, 2),
+                                       round(annual_return * 100, 2)))
 
-class MomStrategy(MyStrategy):
-    params = (
-        ('period', 20),
-        ('printlog', True),
-    )
 
-    def __init__(self):
-        self.dataprice = self.datas[0].close
-        self.order = None
-        self.month = -1
-        self.mom = [
-            bt.indicators.Momentum(i, period=self.params.period)
-            for i in self.datas
-        ]
+"""
+动量钟摆策略
+"""
 
-    def next(self):
-        buy_id = 999
 
-        c = [
-            i.momentum[0]  #/ (i.datas[0].close + i.datas[0].open) * 2
-            for i in self.mom
-        ]
-        index, value = c.index(max(c)), max(c)
-        [self.log(f'{self.datas[c.index(i)]._name}, {i}') for i in c]
-        if value > 0:
-            buy_id = index
+class MomOscStrategy(RotationStrategy):
+    """
+    买入动量钟摆大于 100 且最大的基金；所有基金都大于 100 时不操作，都不大于 100 时空仓
+    """
+    params = (('threshold', 100.0), )
+    signal = 'momosc'
 
-        for i in range(0, len(c)):
-            if i != buy_id:
-                position_size = self.broker.getposition(
-                    data=self.datas[i]).size
-                if position_size != 0:
-                    self.order_target_percent(data=self.datas[i], target=0)
+    def indicator(self, data):
+        return cached_indicator(bt.indicators.MomentumOscillator,
+                                data,
+                                period=self.params.period)
 
-        if buy_id != 999:
-            position_size = self.broker.getposition(
-                data=self.datas[buy_id]).size
-            if position_size == 0:
-                self.order_target_percent(data=self.datas[buy_id], target=0.98)
+    def choose(self):
+        threshold = self.params.threshold
+        if (self.values > threshold).all():
+            return self.HOLD
 
-    def stop(self):
-        return_all = self.broker.getvalue() / 200000.0
-        print('{0}, {1}%, {2}%'.format(
-            self.params.period, round((return_all - 1.0) * 100, 2),
-            round((pow(return_all, 1.0 / 8) - 1.0) * 100, 2)))
+        index, value = self.best()
+        return index if value > threshold else None
 
 
-class BBandStrategy(bt.Strategy):
-    params = (('period', 20), )
+class MomStrategy(RotationStrategy):
+    """
+    买入动量大于 0 且最大的基金，都不大于 0 时空仓
+    """
 
-    def __init__(self):
-        self.dataprice = self.datas[0].close
-        self.order = None
-        self.month = -1
-        self.bbandPcts = [
-            bt.indicators.BollingerBandsPct(i, period=self.params.period)
-            for i in self.datas
-        ]
+    signal = 'momentum'
 
-    def next(self):
-        buy_id = 0
+    def indicator(self, data):
+        return cached_indicator(bt.indicators.Momentum,
+                                data,
+                                period=self.params.period)
 
-        c = [i.pctb[0] for i in self.bbandPcts]
-        index, value = c.index(max(c)), max(c)
+    def choose(self):
+        index, value = self.best()
+        return index if value > 0 else None
 
-        if value > 0:
-            buy_id = index
 
-        for i in range(0, len(c)):
-            if i != buy_id:
-                position_size = self.broker.getposition(
-                    data=self.datas[i]).size
-                if position_size != 0:
-                    self.order_target_percent(data=self.datas[i], target=0)
+class BBandStrategy(RotationStrategy):
+    """
+    买入布林带 %B 最大的基金，都不大于 0 时买入第一个基金
+    """
+    params = (('printlog', False), )
+    signal = 'pctb'
 
-        position_size = self.broker.getposition(data=self.datas[buy_id]).size
-        if position_size == 0:
-            self.order_target_percent(data=self.datas[buy_id], target=0.98)
+    def indicator(self, data):
+        return cached_indicator(bt.indicators.BollingerBandsPct,
+                                data,
+                                period=self.params.period)
 
-    def stop(self):
-        return_all = self.broker.getvalue() / 200000.0
-        print('{0}, {1}%, {2}%'.format(
-            self.params.period, round((return_all - 1.0) * 100, 2),
-            round((pow(return_all, 1.0 / 8) - 1.0) * 100, 2)))
+    def choose(self):
+        index, value = self.best()
+        return index if value > 0 else 0
 
 
 class BBandMomoscStrategy(MyStrategy):
@@ -254,12 +358,16 @@ class BBandMomoscStrategy(MyStrategy):
         self.dataprice = [i.close for i in self.datas]
         self.order = None
         self.mom = [
-            bt.indicators.MomentumOscillator(i, period=self.params.period)
+            cached_indicator(bt.indicators.MomentumOscillator,
+                             i,
+                             period=self.params.period)
             for i in self.datas
         ]
 
         self.bbandPcts = [
-            bt.indicators.BollingerBandsPct(i, period=self.params.period)
+            cached_indicator(bt.indicators.BollingerBandsPct,
+                             i,
+                             period=self.params.period)
             for i in self.datas
         ]
 
@@ -288,7 +396,8 @@ class BBandMomoscStrategy(MyStrategy):
             self.order_target_percent(data=self.datas[buy_id], target=0.98)
 
     def stop(self):
-        return_all = self.broker.getvalue() / 200000.0
-        print('{0}, {1}%, {2}%'.format(
-            self.params.period, round((return_all - 1.0) * 100, 2),
-            round((pow(return_all, 1.0 / 8) - 1.0) * 100, 2)))
+        super(BBandMomoscStrategy, self).stop()
+        total_return, annual_return = strategy_returns(self)
+        print('{0}, {1}%, {2}%'.format(self.params.period,
+                                       round(total_return * 100, 2),
+                                       round(annual_return * 100, 2)))
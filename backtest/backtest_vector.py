@@ -0,0 +1,418 @@
+"""
+动量轮动策略的向量化参数网格回测。
+
+对 backtest_strategy 中的 MomStrategy、MomOscStrategy 和 BBandStrategy，一次算出所有
+周期的指标，得到 (周期, 交易日, 基金) 的数组，然后按“持有指标最高的一支，否则空仓”
+的规则，对所有周期同时模拟 BackBroker 的成交：
+
+- 订单以下单时的收盘价做资金检查，资金不足的买单被拒绝；
+- 市价单在该基金下一根 K 线的开盘价成交，开仓时资金不足则作废；
+- 手续费按成交金额的比例收取，买入数量为 int(0.98 * 总资产 // 收盘价)。
+
+结果和 Cerebro 逐根回测一致（只有浮点舍入误差），可以用 check_parity 对比，
+tests/test_vector.py 中对每个策略都做了对比。
+"""
+import datetime
+import math
+
+import numpy as np
+
+from backtest.backtest_feeds import ETFCsvData
+from backtest.backtest_panel import fund_sources
+from backtest.backtest_store import COLUMNS, load_store
+
+TARGET = 0.98
+SESSION_END = datetime.time(23, 59, 59, 999990)
+
+
+class GridResult(object):
+    """
+    网格回测结果，values 为每个周期每天收盘后的总资产 (周期, 交易日)
+    """
+
+    def __init__(self, periods, dates, values, cash):
+        self.periods = list(periods)
+        self.dates = dates
+        self.values = values
+        self.cash = cash
+
+    @property
+    def final(self):
+        return self.values[:, -1]
+
+    def total_return(self):
+        return self.final / self.cash - 1.0
+
+    def annual_return(self):
+        days = self.dates[-1] - self.dates[0]
+        years = max(days, 1) / 365.25
+        return np.power(self.final / self.cash, 1.0 / years) - 1.0
+
+    def best(self):
+        i = int(np.argmax(self.final))
+        return self.periods[i], float(self.final[i])
+
+    def table(self):
+        """
+        [(period, 总回报, 年化回报)]，和策略 stop() 中打印的格式对应
+        """
+        return list(
+            zip(self.periods, self.total_return().tolist(),
+                self.annual_return().tolist()))
+
+
+def in_window(dates, fromdate=None, todate=None):
+    """
+    和 DataBase 的 fromdate/todate 过滤一致：日线的时间是当天的 sessionend
+    """
+    keep = np.ones(len(dates), dtype=bool)
+    if fromdate is not None:
+        keep &= dates >= fromdate.toordinal()
+    if todate is not None:
+        last = todate.toordinal()
+        if todate.time() < SESSION_END:
+            last -= 1
+        keep &= dates <= last
+    return keep
+
+
+def load_group(funds, fromdate=None, todate=None, csvformat=ETFCsvData):
+    """
+    读取一组基金并按交易日并集对齐。
+
+    返回 dates (T,)、open/close (T, N)（没有 K 线的日子沿用上一个收盘价，open 为 NaN）、
+    hasbar (T, N)，以及每个基金自己的收盘价序列。
+    """
+    sources = fund_sources(('etfs', 'lofs'))
+    arrays = []
+    for fund in funds:
+        path = sources.get(fund, fund)
+        array = load_store(path, csvformat)
+        arrays.append(array[in_window(array[:, 0], fromdate, todate)])
+
+    dates = np.unique(np.concatenate([a[:, 0] for a in arrays]))
+    T, N = len(dates), len(arrays)
+
+    opens = np.full((T, N), np.nan)
+    closes = np.full((T, N), np.nan)
+    hasbar = np.zeros((T, N), dtype=bool)
+    own_closes = []
+    for i, array in enumerate(arrays):
+        rows = np.searchsorted(dates, array[:, 0])
+        opens[rows, i] = array[:, COLUMNS.index('open')]
+        closes[rows, i] = array[:, COLUMNS.index('close')]
+        hasbar[rows, i] = True
+        own_closes.append(np.array(array[:, COLUMNS.index('close')]))
+
+    return dates, opens, ffill(closes, hasbar), hasbar, own_closes
+
+
+def ffill(values, hasbar):
+    """
+    没有 K 线的日子沿用上一根 K 线的值
+    """
+    T = len(values)
+    idx = np.where(hasbar, np.arange(T)[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return values[idx, np.arange(values.shape[1])]
+
+
+def lagged(close, periods):
+    """
+    (周期, K 线) 的 close(-period)，前 period 根为 NaN
+    """
+    idx = np.arange(len(close))[None, :] - np.asarray(periods)[:, None]
+    result = close[np.maximum(idx, 0)]
+    result[idx < 0] = np.nan
+    return result
+
+
+def momentum(close, periods):
+    """
+    bt.indicators.Momentum: data - data(-period)
+    """
+    return close[None, :] - lagged(close, periods)
+
+
+def momentum_oscillator(close, periods):
+    """
+    bt.indicators.MomentumOscillator: 100 * (data / data(-period))
+    """
+    return 100.0 * (close[None, :] / lagged(close, periods))
+
+
+def bollinger_pct(close, periods, devfactor=2.0):
+    """
+    bt.indicators.BollingerBandsPct 的 pctb，均值和标准差都是简单移动平均
+    """
+    result = np.full((len(periods), len(close)), np.nan)
+    for k, period in enumerate(periods):
+        if period > len(close):
+            continue
+        window = np.lib.stride_tricks.sliding_window_view(close, period)
+        mid = window.sum(axis=1) / period
+        meansq = (window * window).sum(axis=1) / period
+        stddev = devfactor * np.sqrt(np.maximum(meansq - mid**2, 0.0))
+        top, bot = mid + stddev, mid - stddev
+        with np.errstate(all='ignore'):
+            result[k, period - 1:] = (close[period - 1:] - bot) / (top - bot)
+    return result
+
+
+# 策略名: (指标函数, 最小周期, 买入阈值, 没有信号时的默认买入)
+KINDS = {
+    'mom': (momentum, 1, 0.0, None),
+    'momosc': (momentum_oscillator, 1, 100.0, None),
+    'bband': (bollinger_pct, 0, 0.0, 0),
+}
+
+
+def kind_of(strategy):
+    """
+    策略类或名字对应的向量化实现
+    """
+    if isinstance(strategy, str):
+        return strategy
+    names = {
+        'MomStrategy': 'mom',
+        'MomOscStrategy': 'momosc',
+        'BBandStrategy': 'bband',
+    }
+    return names[strategy.__name__]
+
+
+def grid_signals(kind, own_closes, hasbar, periods):
+    """
+    每个基金在自己的 K 线上计算指标，再对齐到交易日并集上。
+
+    返回 (周期, 交易日, 基金) 的指标值和 (周期, 交易日) 的“所有基金都过了最小周期”。
+    """
+    func, extra, _, _ = KINDS[kind]
+    periods = np.asarray(periods)
+    T, N = hasbar.shape
+    P = len(periods)
+
+    signals = np.full((P, T, N), np.nan)
+    counts = np.cumsum(hasbar, axis=0)
+    for i, close in enumerate(own_closes):
+        if not len(close):
+            continue
+        values = func(close, periods)
+        own = np.maximum(counts[:, i] - 1, 0)
+        signals[:, :, i] = values[:, own]
+        signals[:, counts[:, i] == 0, i] = np.nan
+
+    minperiods = periods + extra
+    ready = (counts[None, :, :] >= minperiods[:, None, None]).all(axis=2)
+    return signals, ready
+
+
+def choose(kind, signal):
+    """
+    (周期, 基金) 的指标值 -> 每个周期要买入的基金（-1 为不买），
+    以及是否保持现状（MomOscStrategy 中所有基金都大于 100 时不操作）
+    """
+    _, _, threshold, default = KINDS[kind]
+    P = len(signal)
+
+    clean = np.where(np.isnan(signal), -np.inf, signal)
+    best = np.argmax(clean, axis=1)
+    value = clean[np.arange(P), best]
+
+    buy = np.where(value > threshold, best, -1 if default is None else default)
+    hold = np.zeros(P, dtype=bool)
+    if kind == 'momosc':
+        hold = (clean > threshold).all(axis=1)
+    return buy, hold
+
+
+def simulate(kind, opens, closes, hasbar, signals, ready, cash, commission):
+    """
+    对所有周期同时模拟 BackBroker，返回 (周期, 交易日) 的每日总资产
+    """
+    P, T, N = signals.shape
+    rows = np.arange(P)
+
+    cash = np.full(P, float(cash))
+    size = np.zeros((P, N))
+    values = np.empty((P, T))
+
+    # 已接受未成交的订单批次 [(下单的 K 线, 订单数量 (P, N))]，先下的先成交
+    pending = []
+    submitted = None
+
+    for t in range(T):
+        close = closes[t]
+        bar = hasbar[t]
+
+        # 上一根 K 线提交的订单按收盘价做资金检查，先卖后买
+        if submitted is not None:
+            created, orders = submitted
+            pclose = closes[created]
+            sells = np.minimum(orders, 0.0)
+            check = cash - (sells * pclose).sum(axis=1) \
+                - (np.abs(sells) * commission * pclose).sum(axis=1)
+            buys = np.maximum(orders, 0.0)
+            check = check - (buys * pclose).sum(axis=1) \
+                - (buys * commission * pclose).sum(axis=1)
+            orders[(check < 0.0)[:, None] & (orders > 0)] = 0.0
+            pending.append(orders)
+            submitted = None
+
+        # 有新 K 线的基金按开盘价成交
+        popen = np.where(bar, opens[t], 0.0)
+        for orders in pending:
+            live = (orders != 0) & bar[None, :]
+            if not live.any():
+                continue
+
+            # 卖出只会平掉已有的多头仓位，平仓返还的资金就是成交金额
+            sells = np.where(live & (orders < 0), -orders, 0.0)
+            if sells.any():
+                cash = cash + (sells * popen).sum(axis=1) \
+                    - (sells * commission * popen).sum(axis=1)
+                size = size - sells
+
+            # 开仓后资金为负时作废
+            buys = np.where(live & (orders > 0), orders, 0.0)
+            if buys.any():
+                after = cash - (buys * popen).sum(axis=1) \
+                    - (buys * commission * popen).sum(axis=1)
+                ok = (after >= 0.0)[:, None]
+                cash = np.where(ok[:, 0], after, cash)
+                size = size + np.where(ok, buys, 0.0)
+
+            orders[live] = 0.0
+
+        pending = [orders for orders in pending if orders.any()]
+
+        value = cash + (size * close).sum(axis=1)
+        values[:, t] = value
+
+        # 策略 next：平掉其他基金，买入信号最强的基金
+        active = ready[:, t]
+        if not active.any():
+            continue
+
+        buy, hold = choose(kind, signals[:, t])
+        orders = np.zeros((P, N))
+
+        sell = (size != 0) & active[:, None] & ~hold[:, None]
+        sell[rows, np.maximum(buy, 0)] &= buy < 0
+        orders[sell] = -size[sell]
+
+        dobuy = active & ~hold & (buy >= 0)
+        dobuy &= size[rows, np.maximum(buy, 0)] == 0
+        target = np.floor(TARGET * value / close[np.maximum(buy, 0)])
+        orders[rows[dobuy], buy[dobuy]] = target[dobuy]
+
+        # 和 RotationStrategy.rebalance 一样，买入金额超过现金加卖出所得时按比例减少
+        sells = np.maximum(-orders, 0.0) * close
+        buys = np.maximum(orders, 0.0) * close
+        available = cash + sells.sum(axis=1) - (sells * commission).sum(axis=1)
+        cost = buys.sum(axis=1) + (buys * commission).sum(axis=1)
+        over = cost > available
+        if over.any():
+            factor = np.where(over, np.maximum(available, 0.0) / cost, 1.0)
+            scaled = np.floor(orders * factor[:, None])
+            orders = np.where(over[:, None] & (orders > 0), scaled, orders)
+
+        if orders.any():
+            submitted = (t, orders)
+
+    return values
+
+
+def run_grid(strategy,
+             funds,
+             periods,
+             fromdate=None,
+             todate=None,
+             cash=200000.0,
+             commission=0.00015):
+    """
+    对 strategy 的所有 periods 做一次向量化回测
+    """
+    kind = kind_of(strategy)
+    dates, opens, closes, hasbar, own_closes = load_group(
+        funds, fromdate, todate)
+    signals, ready = grid_signals(kind, own_closes, hasbar, periods)
+    values = simulate(kind, opens, closes, hasbar, signals, ready, cash,
+                      commission)
+    return GridResult(periods, dates, values, cash)
+
+
+def run_cerebro(strategy,
+                funds,
+                period,
+                fromdate=None,
+                todate=None,
+                cash=200000.0,
+                commission=0.00015):
+    """
+    用 Cerebro 回测同一组参数，返回最终总资产
+    """
+    import contextlib
+    import io
+
+    import backtrader as bt
+
+    from backtest.backtest_feeds import ETFStoreData
+
+    sources = fund_sources(('etfs', 'lofs'))
+    cerebro = bt.Cerebro(stdstats=False)
+    kwargs = dict(period=period)
+    if 'printlog' in strategy.params._getkeys():
+        kwargs['printlog'] = False
+    cerebro.addstrategy(strategy, **kwargs)
+    for fund in funds:
+        cerebro.adddata(
+            ETFStoreData(dataname=sources.get(fund, fund),
+                         fromdate=fromdate,
+                         todate=todate))
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        cerebro.run()
+    return cerebro.broker.getvalue()
+
+
+def check_parity(strategy,
+                 funds,
+                 periods,
+                 fromdate=None,
+                 todate=None,
+                 cash=200000.0,
+                 commission=0.00015,
+                 tolerance=None):
+    """
+    对比向量化回测和 Cerebro 的最终资产，返回 [(period, 向量化, Cerebro)]。
+
+    两者之差超过 tolerance（默认为一笔满仓交易的手续费）时抛出 AssertionError。
+    """
+    tolerance = tolerance or cash * commission
+    grid = run_grid(strategy, funds, periods, fromdate, todate, cash,
+                    commission)
+
+    result = []
+    for period, value in zip(periods, grid.final.tolist()):
+        expected = run_cerebro(strategy, funds, period, fromdate, todate, cash,
+                               commission)
+        result.append((period, value, expected))
+        if not math.isclose(value, expected, abs_tol=tolerance):
+            raise AssertionError(
+                f'{strategy.__name__} period={period}: '
+                f'向量化 {value:.2f}，Cerebro {expected:.2f}')
+    return result
+
+
+if __name__ == '__main__':
+    from backtest.backtest_strategy import MomStrategy
+
+    grid = run_grid(MomStrategy, ['sz159915', 'sh510310', 'sh510500'],
+                    range(1, 60), datetime.datetime(2017, 5, 28),
+                    datetime.datetime(2021, 7, 1))
+    print('period, Total ROI, Annual ROI')
+    for period, total, annual in grid.table():
+        print(f'{period}, {total * 100:.2f}%, {annual * 100:.2f}%')
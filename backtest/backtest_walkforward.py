@@ -0,0 +1,258 @@
+"""
+滚动（walk-forward）优化。
+
+把回测区间切成若干个 训练 + 测试 窗口，在每个训练窗口上优化参数，用选出的参数
+回测紧接着的测试窗口，最后把所有测试窗口的收益拼成一条样本外的资金曲线：
+
+    |-- 训练 1 --|- 测试 1 -|
+          |-- 训练 2 --|- 测试 2 -|
+                |-- 训练 3 --|- 测试 3 -|
+
+anchored 为 True 时训练窗口都从 start_date 开始，只延长结束日期。
+
+基金数据放入共享内存（backtest_shared）只加载一次，所有窗口的所有参数都作为
+独立的任务交给同一个进程池。测试窗口的数据提前 warmup 开始，让指标在测试窗口的
+第一天就有值；测试窗口开始之前策略不下单（见 trading_from），收益和各项指标都只
+统计测试窗口内的部分。
+"""
+import contextlib
+import datetime
+import io
+import math
+import multiprocessing
+
+import backtrader as bt
+import pandas as pd
+
+from backtest.backtest_broker import FastBroker
+from backtest.backtest_cache import clamp_end_date
+from backtest.backtest_optimizer import add_metrics, record
+from backtest.backtest_shared import SharedFundGroup
+from backtest.backtest_stats import annualize
+
+# 子进程中的共享数据，由进程池的 initializer 设置
+_group = None
+
+
+def _day_end(ts):
+    # 和 clamp_end_date 一样，结束日期的 K 线时间在当天收盘之后，取当天最后的时间
+    return datetime.datetime.combine(ts.date(), datetime.time(23, 59, 59, 999990))
+
+
+def windows(start_date,
+            end_date,
+            train_months=24,
+            test_months=6,
+            anchored=False):
+    """
+    [(训练开始, 训练结束, 测试开始, 测试结束)]，结束日期当天包含在内，测试窗口首尾相接
+    """
+    result = []
+    start = pd.Timestamp(start_date)
+    end = pd.Timestamp(end_date)
+    test_start = start + pd.DateOffset(months=train_months)
+    while test_start <= end:
+        next_start = test_start + pd.DateOffset(months=test_months)
+        train_start = start if anchored else test_start - pd.DateOffset(
+            months=train_months)
+        result.append(
+            (train_start.to_pydatetime(),
+             _day_end(test_start - pd.Timedelta(days=1)),
+             test_start.to_pydatetime(),
+             _day_end(min(next_start - pd.Timedelta(days=1), end))))
+        test_start = next_start
+    return result
+
+
+def warmup_date(test_start, params):
+    """
+    测试窗口的数据开始日期，留出指标需要的 K 线（按每周 5 个交易日估算）
+    """
+    bars = max([v for v in params.values() if isinstance(v, int)] or [0])
+    return test_start - datetime.timedelta(days=bars * 7 // 5 + 14)
+
+
+def trading_from(strategy, start):
+    """
+    strategy 的子类，start 之前的 K 线只计算指标，不调用 next，不会下单
+    """
+
+    def next(self):
+        if self.datetime.datetime(0) >= start:
+            strategy.next(self)
+
+    return type(strategy.__name__, (strategy, ), {
+        '__module__': strategy.__module__,
+        'next': next
+    })
+
+
+def _init(group):
+    global _group
+    _group = group
+
+
+def _run(task):
+    """
+    回测一个窗口中的一组参数，测试窗口同时返回每天的收益率。
+
+    数据从 fromdate 开始，start 不为 None 时（测试窗口）之前的 K 线只用来计算指标，
+    从 start 开始下单和统计。
+    """
+    (kind, index, strategy, params, fromdate, start, todate, cash, commission,
+     fast) = task
+
+    cerebro = bt.Cerebro(stdstats=False)
+    if start is not None:
+        strategy = trading_from(strategy, start)
+    cerebro.addstrategy(strategy, **params)
+    for data in _group.feeds(fromdate=fromdate, todate=todate):
+        cerebro.adddata(data)
+    if fast:
+        cerebro.setbroker(FastBroker())
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    add_metrics(cerebro, fromdate=start)
+    if kind == 'test':
+        cerebro.addanalyzer(bt.analyzers.TimeReturn,
+                            timeframe=bt.TimeFrame.Days,
+                            _name='wf_returns')
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        strat = cerebro.run(maxcpus=1)[0]
+
+    rec = record(strat)
+    if kind == 'test':
+        rec['returns'] = list(strat.analyzers.wf_returns.get_analysis().items())
+    return kind, index, rec
+
+
+def _rank(rec, key):
+    # 指标相同时取周期小的，结果不受进程池完成顺序的影响
+    value = rec.get(key)
+    value = float('-inf') if value is None or math.isnan(value) else value
+    return value, -rec['params']['period']
+
+
+def stitch(returns, cash):
+    """
+    把各个测试窗口的每日收益率拼成资金曲线，返回 pd.Series
+    """
+    series = pd.Series(dict(returns), dtype='f8').sort_index()
+    return cash * (1.0 + series).cumprod()
+
+
+def summary(equity, cash):
+    """
+    样本外资金曲线的总收益、年化收益和最大回撤（百分比），年化收益和 RunStats 一样
+    按第一天到最后一天的实际天数计算
+    """
+    if len(equity) == 0:
+        return {'total_return': 0.0, 'annual_return': 0.0, 'max_drawdown': 0.0}
+    total_return = equity.iloc[-1] / cash - 1.0
+    days = (equity.index[-1] - equity.index[0]).total_seconds() / 86400.0
+    drawdown = 1.0 - equity / equity.cummax().clip(lower=cash)
+    return {
+        'total_return': total_return,
+        'annual_return': annualize(total_return, days),
+        'max_drawdown': max(drawdown.max(), 0.0) * 100.0,
+    }
+
+
+def walkforward(datapaths,
+                strategy,
+                periods,
+                start_date,
+                end_date,
+                cash,
+                commission,
+                train_months=24,
+                test_months=6,
+                anchored=False,
+                key='sharpe',
+                workers=None,
+                params=None,
+                fast=False):
+    """
+    滚动优化 strategy 的 period，datapaths 为 {基金代码: CSV 路径}。
+    key 为训练窗口中选择参数所用的指标（见 backtest_optimizer.record），
+    params 为其他固定的策略参数，fast 为 True 时使用 FastBroker。
+
+    返回 {'windows': [每个窗口的记录], 'equity': 样本外资金曲线, 以及 summary 中的各项}，
+    每个窗口的记录包含窗口日期、选出的周期、训练窗口的记录和测试窗口的记录，
+    测试窗口的记录只统计测试窗口内的 K 线。
+    """
+    params = dict({'printlog': False}, **(params or {}))
+    end_date = clamp_end_date(datapaths.values(), end_date)
+    spans = windows(start_date, end_date, train_months, test_months, anchored)
+
+    group = SharedFundGroup(datapaths)
+    if workers == 1:
+        _init(group)
+        pool = None
+        imap = lambda tasks: map(_run, tasks)
+    else:
+        pool = multiprocessing.Pool(workers,
+                                    initializer=_init,
+                                    initargs=(group, ))
+        imap = lambda tasks: pool.imap_unordered(_run, tasks)
+
+    try:
+        # 所有训练窗口的所有周期一起交给进程池
+        tasks = [('train', i, strategy, dict(params, period=period),
+                  span[0], None, span[1], cash, commission, fast)
+                 for i, span in enumerate(spans) for period in periods]
+        trained = [None] * len(spans)
+        for _, i, rec in imap(tasks):
+            if trained[i] is None or _rank(rec, key) > _rank(
+                    trained[i], key):
+                trained[i] = rec
+
+        tasks = [('test', i, strategy, trained[i]['params'],
+                  warmup_date(span[2], trained[i]['params']), span[2],
+                  span[3], cash, commission, fast)
+                 for i, span in enumerate(spans)]
+        tested = [None] * len(spans)
+        for _, i, rec in imap(tasks):
+            tested[i] = rec
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        group.close()
+
+    result = []
+    returns = []
+    for span, train, test in zip(spans, trained, tested):
+        # 只统计测试窗口内的收益
+        test_returns = [(dt, r) for dt, r in test.pop('returns')
+                        if span[2] <= dt <= span[3]]
+        returns.extend(test_returns)
+        growth = math.prod(1.0 + r for _, r in test_returns)
+        result.append({
+            'train_start': span[0],
+            'train_end': span[1],
+            'test_start': span[2],
+            'test_end': span[3],
+            'period': train['params']['period'],
+            'train': train,
+            'test': test,
+            'test_return': growth - 1.0,
+        })
+
+    equity = stitch(returns, cash)
+    return dict(summary(equity, cash), windows=result, equity=equity)
+
+
+def print_report(report):
+    print('train, test, period, train ROI, train Sharpe, test ROI')
+    for w in report['windows']:
+        sharpe = w['train']['sharpe']
+        print(f"{w['train_start']:%Y-%m-%d}~{w['train_end']:%Y-%m-%d}, "
+              f"{w['test_start']:%Y-%m-%d}~{w['test_end']:%Y-%m-%d}, "
+              f"{w['period']}, {w['train']['total_return'] * 100:.2f}%, "
+              f"{'-' if sharpe is None else f'{sharpe:.2f}'}, "
+              f"{w['test_return'] * 100:.2f}%")
+    print(f"样本外 Total ROI: {report['total_return'] * 100:.2f}%, "
+          f"Annual ROI: {report['annual_return'] * 100:.2f}%, "
+          f"Max DrawDown: {report['max_drawdown']:.2f}%")
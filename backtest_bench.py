@@ -0,0 +1,275 @@
+"""
+backtest 中各模块的性能测试，使用随机生成的数据或 datas 中的基金，不需要联网。
+正确性由 tests/ 中的测试检查，这里只计时：
+
+    python backtest_bench.py             # 全部
+    python backtest_bench.py intraday    # 只运行指定的几项
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+mainpath = os.path.dirname(os.path.abspath(__file__))
+
+# datas 中常用的基金都有数据的一段时间
+FROMDATE = datetime.datetime(2017, 5, 28)
+TODATE = datetime.datetime(2021, 7, 1)
+
+
+def synthetic_minutes(days, seed=0):
+    """
+    days 个交易日的随机 1 分钟线，上午 9:31 到 11:30，下午 13:01 到 15:00
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-05', periods=days)
+    times = pd.date_range('09:31', '11:30', freq='1min').append(
+        pd.date_range('13:01', '15:00', freq='1min'))
+    index = pd.DatetimeIndex([
+        pd.Timestamp.combine(d.date(), t.time()) for d in dates for t in times
+    ])
+    close = 10.0 * np.exp(np.cumsum(rng.normal(0.0, 0.0005, len(index))))
+    return pd.DataFrame(
+        {
+            'open': close,
+            'high': close * 1.001,
+            'low': close * 0.999,
+            'close': close,
+            'volume': rng.integers(100, 10000, len(index)).astype('f8'),
+        },
+        index=index)
+
+
+def bench_intraday(days=1000):
+    """
+    分钟线追加一部分之后增量重新采样的时间，以及读取缓存的时间
+    """
+    from backtest.backtest_intraday import derived_path, load_bars, save_bars
+
+    df = synthetic_minutes(days)
+    with tempfile.TemporaryDirectory() as path:
+        split = len(df) * 3 // 4
+        save_bars('demo', '1m', df.iloc[:split], path)
+        for freq in ('5m', '30m', '1d'):
+            load_bars('demo', freq, path)
+        save_bars('demo', '1m', df.iloc[split - 100:], path)
+
+        for freq in ('5m', '30m', '1d'):
+            begin = time.perf_counter()
+            bars = load_bars('demo', freq, path)
+            incremental = time.perf_counter() - begin
+
+            os.remove(derived_path('demo', freq, path))
+            begin = time.perf_counter()
+            load_bars('demo', freq, path)
+            full = time.perf_counter() - begin
+            print(f'{freq}: {len(bars)} 根 K 线，增量采样 {incremental * 1000:.1f}ms，'
+                  f'全量采样 {full * 1000:.1f}ms')
+
+        begin = time.perf_counter()
+        load_bars('demo', '30m', path)
+        print(f'读取缓存: {(time.perf_counter() - begin) * 1000:.2f}ms')
+
+
+def bench_broker(periods=range(1, 30)):
+    """
+    FastBroker 和 BackBroker 回测同样的参数所用的时间
+    """
+    from backtest.backtest_broker import run_cerebro
+    from backtest.backtest_strategy import MomStrategy
+
+    funds = ['sz159915', 'sh510310', 'sh510500']
+    for fast in [False, True]:
+        begin = time.perf_counter()
+        for period in periods:
+            run_cerebro(MomStrategy, funds, period, FROMDATE, TODATE, fast=fast)
+        print(f"{'FastBroker' if fast else 'BackBroker'}: "
+              f'{time.perf_counter() - begin:.2f}s')
+
+
+def bench_log(n=200000):
+    """
+    策略日志每条记录的开销：内存中的环形缓冲区和后台线程写文件
+    """
+    import backtrader as bt
+
+    from backtest.backtest_log import open_log
+
+    dt = bt.date2num(datetime.datetime(2021, 3, 1))
+    record = (dt, '执行买入，%s，价格：%.2f', ('sz159915', 1.23))
+
+    ring = open_log(1000)
+    begin = time.perf_counter()
+    for i in range(n):
+        ring.append(record)
+    print(f'环形缓冲区: {(time.perf_counter() - begin) / n * 1e9:.0f}ns/条')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = open_log(os.path.join(tmp, '{pid}.log'))
+        begin = time.perf_counter()
+        for i in range(n):
+            log.append(record)
+        queued = time.perf_counter() - begin
+        log.close()
+        print(f'文件: 记录 {queued / n * 1e9:.0f}ns/条，'
+              f'写完 {time.perf_counter() - begin:.2f}s')
+
+
+def bench_journal():
+    """
+    在 datas/etfs 的所有基金上轮动时，记录 Journal 日志增加的回测时间
+    """
+    import contextlib
+    import glob
+    import io
+
+    import backtrader as bt
+
+    from backtest.backtest_feeds import ETFStoreData
+    from backtest.backtest_journal import Journal, read_journal
+    from backtest.backtest_strategy import MomStrategy
+
+    # 上市时间太短的基金没有足够的 K 线算指标
+    paths = [
+        path for path in sorted(
+            glob.glob(os.path.join(mainpath, 'datas/etfs/*.csv')))
+        if os.path.getsize(path) > 20000
+    ]
+
+    def run(journal=None):
+        cerebro = bt.Cerebro(stdstats=False)
+        cerebro.addstrategy(MomStrategy, period=13, printlog=False)
+        for path in paths:
+            cerebro.adddata(
+                ETFStoreData(dataname=path, fromdate=FROMDATE, todate=TODATE))
+        cerebro.broker.setcash(200000.0)
+        cerebro.broker.setcommission(commission=0.00015)
+        if journal is not None:
+            cerebro.addanalyzer(Journal, path=journal)
+        begin = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            cerebro.run()
+        return time.perf_counter() - begin
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 第一次运行生成指标缓存，不计时
+        run()
+        plain = run()
+        journaled = run(tmp)
+        journal = read_journal(tmp)
+        print(f'{len(paths)} 个基金，{len(journal["signals"]["dt"])} 根 K 线，'
+              f'{len(journal["fills"]["ref"])} 条成交')
+        print(f'回测 {plain:.2f}s，记录日志 {journaled:.2f}s '
+              f'({(journaled / plain - 1.0) * 100:+.1f}%)')
+
+
+def bench_results(n=1000000):
+    """
+    结果库写入 n 条记录，以及按组合取最好的参数、按数据版本和 sharpe 查询、
+    导出和热力图的时间
+    """
+    from backtest.backtest_results import ResultStore, heatmap
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        datapath = os.path.join(tmp, 'sz159915.csv')
+        with open(datapath, 'w') as f:
+            f.write('v1')
+
+        store = ResultStore(os.path.join(tmp, 'results.sqlite'), batch=50000)
+        groups = [f'funds_{i}' for i in range(1, 51)]
+        begin = time.perf_counter()
+        for i in range(n):
+            if i == n // 2:
+                # 数据更新，之后的结果属于新的数据版本
+                store.flush()
+                with open(datapath, 'w') as f:
+                    f.write('v2')
+            sharpe = rng.normal(0.3, 0.5)
+            store.add(
+                {
+                    'strategy': 'MomStrategy',
+                    'params': {
+                        'period': int(i % 59 + 1),
+                        'printlog': False
+                    },
+                    'final_value': 200000.0 * (1.0 + sharpe),
+                    'total_return': sharpe,
+                    'annual_return': sharpe / 4,
+                    'sharpe': sharpe,
+                    'sqn': sharpe,
+                    'max_drawdown': 20.0,
+                    'exposure': 0.5,
+                    'trades': 100,
+                }, groups[i // 59 % len(groups)], ['sz159915'], [datapath])
+        store.flush()
+        print(f'写入 {len(store)} 条：{time.perf_counter() - begin:.1f}s')
+
+        begin = time.perf_counter()
+        best = store.best()
+        print(f'每个组合最好的周期：{(time.perf_counter() - begin) * 1000:.1f}ms，'
+              f'{len(best)} 行')
+
+        version = store.versions()[-1][0]
+        begin = time.perf_counter()
+        good = store.runs(since=version, min_sharpe=1.0)
+        print(f'数据版本 {version} 之后 sharpe > 1：'
+              f'{(time.perf_counter() - begin) * 1000:.1f}ms，{len(good)} 行')
+        for kwargs in [dict(columns=('group', 'period', 'sharpe')),
+                       dict(limit=100)]:
+            begin = time.perf_counter()
+            good = store.runs(since=version, min_sharpe=1.0, **kwargs)
+            print(f'  {kwargs}：{(time.perf_counter() - begin) * 1000:.1f}ms，'
+                  f'{len(good)} 行')
+
+        begin = time.perf_counter()
+        rows = store.export(os.path.join(tmp, 'export'), since=version)
+        table = heatmap(os.path.join(tmp, 'export'))
+        print(f'导出 {rows} 行并生成热力图：{time.perf_counter() - begin:.1f}s，'
+              f'{table.shape}')
+        store.close()
+
+
+def bench_plot(n=5000000, points=2000):
+    """
+    n 个点的曲线抽样到 points 个点的时间，以及放大到其中一段后重新抽样的时间
+    """
+    from backtest.backtest_plot import Series, decimate, lttb
+
+    rng = np.random.default_rng(0)
+    x = np.arange(n, dtype='f8')
+    y = np.cumsum(rng.normal(size=n))
+
+    for name, func in (('LTTB', lttb), ('MinMaxLTTB', decimate)):
+        begin = time.perf_counter()
+        keep = func(x, y, points)
+        print(f'{name}: {n} 个点抽样到 {len(keep)} 个 '
+              f'{(time.perf_counter() - begin) * 1000:.1f}ms，'
+              f'保留最大值 {y.max() == y[keep].max()}，'
+              f'最小值 {y.min() == y[keep].min()}')
+
+    series = Series(x, y)
+    begin = time.perf_counter()
+    xs, ys = series.window(n * 0.2, n * 0.22)
+    keep = decimate(xs, ys, points)
+    print(f'放大到 {len(xs)} 个点：{(time.perf_counter() - begin) * 1000:.1f}ms，'
+          f'画 {len(keep)} 个点')
+
+
+BENCHES = {
+    'intraday': bench_intraday,
+    'broker': bench_broker,
+    'log': bench_log,
+    'journal': bench_journal,
+    'results': bench_results,
+    'plot': bench_plot,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or list(BENCHES):
+        print(f'== {name}')
+        BENCHES[name]()
@@ -1,6 +1,10 @@
 import datetime
+import os
 
-from backtest.backtest_cerebro import backtestopt, backtestrun
+from backtest.backtest_cache import ResultCache
+from backtest.backtest_cerebro import (backtestmatrix, backtestopt,
+                                       backtestrun, backtestwalkforward)
+from backtest.backtest_results import ResultStore
 from backtest.backtest_strategy import (BBandMomoscStrategy, BBandStrategy,
                                         MomOscStrategy, MomStrategy)
 
@@ -58,7 +62,10 @@ def setup_data():
     return res
 
 
-def test_momoscstrategy(optflag=False, fund_name='funds_1', period=18):
+def test_momoscstrategy(optflag=False,
+                        fund_name='funds_1',
+                        period=18,
+                        journal=None):
     datas = setup_data()
     cash = 200000.00
     periods = range(1, 60)
@@ -69,19 +76,26 @@ def test_momoscstrategy(optflag=False, fund_name='funds_1', period=18):
     end_date = datetime.datetime.now()
 
     if optflag:
-        backtestopt(cash=cash,
-                    funds=datas[fund_name],
-                    periods=periods,
-                    start_date=opt_start_date,
-                    end_date=end_date,
-                    strategy=MomOscStrategy)
+        # 结果缓存在基金数据和策略代码不变时直接读取，结果库用 store.best()、
+        # store.runs() 查询
+        with ResultStore() as store:
+            backtestopt(cash=cash,
+                        funds=datas[fund_name],
+                        periods=periods,
+                        start_date=opt_start_date,
+                        end_date=end_date,
+                        strategy=MomOscStrategy,
+                        cache=ResultCache(),
+                        store=store,
+                        group=fund_name)
     else:
         backtestrun(cash=cash,
                     funds=datas[fund_name],
                     period=period,
                     start_date=opt_start_date,
                     end_date=end_date,
-                    strategy=MomOscStrategy)
+                    strategy=MomOscStrategy,
+                    journal=journal)
 
 
 def test_momstrategy(optflag=False, funds_name='funds_1', period=18):
@@ -96,12 +110,16 @@ def test_momstrategy(optflag=False, funds_name='funds_1', period=18):
     run_end_date = datetime.datetime.now()
 
     if optflag:
-        backtestopt(cash=cash,
-                    funds=datas[funds_name],
-                    periods=periods,
-                    start_date=opt_start_date,
-                    end_date=opt_end_date,
-                    strategy=MomStrategy)
+        with ResultStore() as store:
+            backtestopt(cash=cash,
+                        funds=datas[funds_name],
+                        periods=periods,
+                        start_date=opt_start_date,
+                        end_date=opt_end_date,
+                        strategy=MomStrategy,
+                        cache=ResultCache(),
+                        store=store,
+                        group=funds_name)
     else:
         backtestrun(cash=cash,
                     funds=datas[funds_name],
@@ -121,12 +139,16 @@ def test_bbandstrategy(optflag=False, fund_name='funds_1', period=18):
     end_date = datetime.datetime.now()
 
     if optflag:
-        backtestopt(cash=cash,
-                    funds=datas[fund_name],
-                    periods=periods,
-                    start_date=opt_start_date,
-                    end_date=end_date,
-                    strategy=BBandStrategy)
+        with ResultStore() as store:
+            backtestopt(cash=cash,
+                        funds=datas[fund_name],
+                        periods=periods,
+                        start_date=opt_start_date,
+                        end_date=end_date,
+                        strategy=BBandStrategy,
+                        cache=ResultCache(),
+                        store=store,
+                        group=fund_name)
     else:
         backtestrun(cash=cash,
                     funds=datas[fund_name],
@@ -146,12 +168,16 @@ def test_oscbbandstrategy(optflag=False, fund_name='funds_1', period=18):
     end_date = datetime.datetime.now()
 
     if optflag:
-        backtestopt(cash=cash,
-                    funds=datas[fund_name],
-                    periods=periods,
-                    start_date=opt_start_date,
-                    end_date=end_date,
-                    strategy=BBandMomoscStrategy)
+        with ResultStore() as store:
+            backtestopt(cash=cash,
+                        funds=datas[fund_name],
+                        periods=periods,
+                        start_date=opt_start_date,
+                        end_date=end_date,
+                        strategy=BBandMomoscStrategy,
+                        cache=ResultCache(),
+                        store=store,
+                        group=fund_name)
     else:
         backtestrun(cash=cash,
                     funds=datas[fund_name],
@@ -161,6 +187,61 @@ def test_oscbbandstrategy(optflag=False, fund_name='funds_1', period=18):
                     strategy=BBandMomoscStrategy)
 
 
+def test_matrix():
+    """
+    所有基金组合 × 动量类策略 × 周期一次回测完，结果合并成一张表
+    """
+    datas = setup_data()
+    cash = 200000.00
+    periods = range(1, 60)
+
+    opt_start_date = datetime.datetime(2017, 5, 28)
+    end_date = datetime.datetime.now()
+
+    strategies = {
+        MomStrategy: {
+            'period': periods
+        },
+        MomOscStrategy: {
+            'period': periods
+        },
+    }
+    windows = {'2017-': (opt_start_date, end_date)}
+
+    with ResultStore() as store:
+        return backtestmatrix(cash=cash,
+                              groups=datas,
+                              strategies=strategies,
+                              windows=windows,
+                              cache=ResultCache(),
+                              store=store)
+
+
+def test_walkforward(strategy=MomOscStrategy,
+                     fund_name='funds_5',
+                     anchored=False):
+    """
+    在 24 个月的训练窗口上选周期，用接下来 6 个月做样本外测试，滚动到最后，
+    得到不依赖事后选参数的收益
+    """
+    datas = setup_data()
+    cash = 200000.00
+    periods = range(1, 60)
+
+    opt_start_date = datetime.datetime(2017, 5, 28)
+    end_date = datetime.datetime.now()
+
+    return backtestwalkforward(cash=cash,
+                               funds=datas[fund_name],
+                               periods=periods,
+                               start_date=opt_start_date,
+                               end_date=end_date,
+                               strategy=strategy,
+                               train_months=24,
+                               test_months=6,
+                               anchored=anchored)
+
+
 if __name__ == '__main__':
     """
     momosc
@@ -172,6 +253,12 @@ if __name__ == '__main__':
     """
     # test_momoscstrategy(fund_name='funds_5', optflag=True)
     # test_momstrategy(funds_name='funds_1', optflag=True)
-
-    test_momoscstrategy(fund_name='funds_5', period=14)
+    # test_walkforward(MomOscStrategy, fund_name='funds_5')
+    # test_matrix()
+
+    # 每天的动量钟摆值和成交记录到 views/journal，用 chart.py 画图
+    modpath = os.path.dirname(os.path.abspath(__file__))
+    test_momoscstrategy(fund_name='funds_5',
+                        period=14,
+                        journal=os.path.join(modpath, 'views/journal'))
     # test_momstrategy(funds_name='funds_5', period=13)
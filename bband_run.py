@@ -1,14 +1,14 @@
 import datetime
 
 import backtrader as bt
-import backtrader.analyzers as btanalyzers
 from backtrader import dataseries
-from backtrader_plotting import Bokeh
-from backtrader_plotting.schemes import Tradimo
-from backtrader_plotting import Bokeh
-from backtrader_plotting.schemes import Tradimo
 
-class BBandStrategy(bt.Strategy):
+from backtest.backtest_log import LoggingStrategy
+from backtest.backtest_registry import registry_stats, shared_indicator
+from backtest.backtest_stats import RunStats, strategy_returns
+
+
+class BBandStrategy(LoggingStrategy):
     """
     如果跌破布林下线则买入，跌破中线买入一半，从中线上涨到上线则卖出二分之一，从下线上涨到布林中线卖出二分之一。
     """
@@ -18,28 +18,21 @@ class BBandStrategy(bt.Strategy):
         ("printlog", True),
     )
 
-    def log(self, txt, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        print("%s, %s" % (dt.isoformat(), txt))
-
     def __init__(self):
         self.dataprice = self.datas[0].close
         self.order = None
-        self.mid = bt.indicators.BollingerBands(
-            self.datas[0], period=self.params.period
-        ).mid
-        self.bot = bt.indicators.BollingerBands(
-            self.datas[0], period=self.params.period
-        ).bot
-        self.top = bt.indicators.BollingerBands(
-            self.datas[0], period=self.params.period
-        ).top
+        bb = shared_indicator(
+            self, bt.indicators.BollingerBands, self.datas[0], period=self.params.period
+        )
+        self.mid = bb.mid
+        self.bot = bb.bot
+        self.top = bb.top
         self.buy_value = []
 
     def next(self):
 
         position_size = self.broker.getposition(data=self.datas[0]).size
-        self.log(f"{position_size}, {self.dataprice[0]}, {self.bot[0]}")
+        self.log("%s, %s, %s", position_size, self.dataprice[0], self.bot[0])
 
         if self.dataprice[0] <= self.bot[0] and position_size <= 0:
             self.order_target_percent(data=self.datas[0], target=0.3)
@@ -63,12 +56,13 @@ class BBandStrategy(bt.Strategy):
             self.buy_value.append(self.dataprice[0])
 
     def stop(self):
-        return_all = self.broker.getvalue() / 200000.0
+        super(BBandStrategy, self).stop()
+        total_return, annual_return = strategy_returns(self)
         print(
             "{0}, {1}%, {2}%".format(
                 self.params.period,
-                round((return_all - 1.0) * 100, 2),
-                round((pow(return_all, 1.0 / 8) - 1.0) * 100, 2),
+                round(total_return * 100, 2),
+                round(annual_return * 100, 2),
             )
         )
 
@@ -84,6 +78,7 @@ if __name__ == "__main__":
     import sys
 
     from backtest.backtest_feeds import ETFCsvData
+    from backtest.backtest_plot import PlotRecorder, plot_run
 
     cash = 200000.00
     periods = range(1, 60)
@@ -105,11 +100,9 @@ if __name__ == "__main__":
     cerebro.broker.setcash(cash)
     cerebro.broker.setcommission(commission=0.00015)
 
-    cerebro.addanalyzer(btanalyzers.SharpeRatio_A, _name="sharp")
-    cerebro.addanalyzer(btanalyzers.AnnualReturn, _name="annualreturn")
-    cerebro.addanalyzer(btanalyzers.Returns, _name="return")
-    cerebro.addanalyzer(btanalyzers.SQN, _name="SQN")
+    cerebro.addanalyzer(RunStats, _name="stats")
+    cerebro.addanalyzer(PlotRecorder, _name="plot")
 
-    cerebro.run()
-    b = Bokeh(style="bar", scheme=Tradimo())
-    cerebro.plot(b)
+    strat = cerebro.run()[0]
+    print(f"指标去重: {registry_stats(strat)}")
+    plot_run(strat)
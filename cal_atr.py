@@ -9,48 +9,103 @@ ATR AverageTrueRange
 
 或者利用 pandas 进行计算，取出每天数据中的最大值和最小值，计算其差值百分比。
 或者找出五个交易日中的最高价和最低差，计算差值百分比。
+
+每个基金只从二进制存储中读取最后 window + 1 行，所有基金拼成一个数组后一次算完。
 """
 
-import os
+import warnings
 
-import pandas as pd
+import numpy as np
 
-from backtest.backtest_get import all_etf_name_list
+from backtest.backtest_feeds import ETFCsvData
+from backtest.backtest_panel import fund_sources
+from backtest.backtest_store import COLUMNS, tail
 
+METRICS = ('range', 'atr', 'atr_pct')
 
-def cal_high_low(df):
-    max = df['high'].max()
-    min = df['low'].min()
-    change = round((max - min) / min, 2)
-    return change
 
+def load_tails(fund_paths, window):
+    """
+    读取每个基金最后 window + 1 行，返回 (基金数, window + 1, 7) 的数组，
+    历史不足的基金前面用 NaN 补齐。多出的一行用于计算第一天的真实波幅。
+    """
+    rows = window + 1
+    tails = np.full((len(fund_paths), rows, len(COLUMNS)), np.nan)
+    for i, path in enumerate(fund_paths):
+        array = tail(path, rows, ETFCsvData)
+        if len(array):
+            tails[i, rows - len(array):] = array
+    return tails
 
-def atr_max_10():
-    datas = []
-    fund_name_list = all_etf_name_list()
 
-    mainpath = os.path.dirname(os.path.dirname(__file__))
-    error_file_list = []
-    changaes = dict()
-    for fund in fund_name_list:
-        try:
-            path = os.path.join(mainpath, f'datas/{fund}.csv')
-            data = pd.read_csv(path, encoding='utf-8')
-            changaes[fund] = cal_high_low(data.tail(5))
+def cal_metric(tails, metric='atr_pct'):
+    """
+    对所有基金同时计算最近 window 天的指标：
+
+    range    窗口内最高价和最低价的差值百分比
+    atr      真实波幅的平均值
+    atr_pct  真实波幅平均值占最新收盘价的比例，不同价格的基金之间可以比较
+    """
+    high = tails[:, 1:, COLUMNS.index('high')]
+    low = tails[:, 1:, COLUMNS.index('low')]
+    close = tails[:, 1:, COLUMNS.index('close')]
+
+    if metric == 'range':
+        lowest = np.nanmin(low, axis=1)
+        return (np.nanmax(high, axis=1) - lowest) / lowest
+
+    prev_close = tails[:, :-1, COLUMNS.index('close')]
+    true_range = np.fmax(
+        high - low,
+        np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    atr = np.nanmean(true_range, axis=1)
+
+    if metric == 'atr':
+        return atr
+    if metric == 'atr_pct':
+        return atr / close[:, -1]
+
+    raise ValueError(f'metric 只能是 {METRICS} 之一: {metric}')
 
-        except FileNotFoundError:
-            error_file_list.append(fund)
 
-    changaes_df = pd.DataFrame.from_dict(changaes,
-                                         orient='index',
-                                         columns=['change'])
+def top_k(names, values, k):
+    """
+    部分排序取出最大的 k 个，NaN 排在最后
+    """
+    values = np.where(np.isnan(values), -np.inf, values)
+    k = min(k, len(values))
+    if k <= 0:
+        return []
 
-    changaes_df.sort_values(by='change', inplace=True, ascending=False)
-    # print(changaes_df.head(10))
-    change_list = changaes_df.head(10).to_dict()
+    idx = np.argpartition(-values, k - 1)[:k]
+    idx = idx[np.argsort(-values[idx], kind='stable')]
+    return [(names[i], float(values[i])) for i in idx if values[i] > -np.inf]
 
-    return change_list['change'].keys()
+
+def screen(window=10, metric='atr_pct', k=10, down_paths=('etfs', 'lofs')):
+    """
+    在所有基金中找出最近 window 天波动最大的 k 个，返回 [(基金代码, 指标值)]
+    """
+    sources = fund_sources(down_paths)
+    names = list(sources)
+    tails = load_tails(list(sources.values()), window)
+
+    # 没有数据的基金结果为 NaN，不需要警告
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        values = cal_metric(tails, metric)
+
+    return top_k(names, values, k)
+
+
+def atr_max_10():
+    """
+    最近 5 个交易日最高价和最低价差值百分比最大的 10 个 ETF
+    """
+    changes = screen(window=5, metric='range', k=10, down_paths=('etfs', ))
+    return [fund for fund, _ in changes]
 
 
 if __name__ == '__main__':
     print(atr_max_10())
+    print(screen())
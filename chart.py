@@ -1,19 +1,19 @@
 import os
+import sys
 
 import matplotlib.pyplot as plt
-import pandas as pd
-from pandas.core.frame import DataFrame
 
-mainpath = os.path.dirname(os.path.dirname(__file__))
+from backtest.backtest_journal import fill_frame, read_journal, signal_frame
 
-csv = os.path.join(mainpath, f'views/ss.csv')
-data = pd.read_csv(
-    csv,
-    encoding='utf-8',
-)
-datas_1 = pd.pivot_table(data, index=['日期'], columns=['基金代码'], values=['动量值'])
+# backtest_run.py 中 backtestrun(..., journal='views/journal') 记录的日志
+modpath = os.path.dirname(os.path.abspath(__file__))
+path = (sys.argv[1]
+        if len(sys.argv) > 1 else os.path.join(modpath, 'views/journal'))
+journal = read_journal(path)
+datas_1 = signal_frame(journal)
 
 print(datas_1.head())
+print(fill_frame(journal).tail())
 
 datas_1.plot()
 plt.show()
@@ -1,9 +1,15 @@
+import array
 import backtrader as bt
 import datetime
+import numpy as np
 import akshare as ak
 import pandas as pd
 import backtrader.analyzers as btanalyzers
 
+from backtest.backtest_intraday import IntradayData, update
+from backtest.backtest_log import LoggingStrategy
+from backtest.backtest_registry import registry_stats, shared_indicator
+
 
 
 
@@ -20,21 +26,29 @@ class CMWilliamsVixFix(bt.Indicator):
 
     def __init__(self):
         # 计算 WVF
-        highest_close = bt.indicators.Highest(self.data.close, period=self.p.pd)
+        highest_close = shared_indicator(self, bt.indicators.Highest, self.data.close, period=self.p.pd)
         self.wvf = ((highest_close - self.data.low) / highest_close) * 100
 
-        # 计算布林带上轨
-        mid_line = bt.indicators.SMA(self.wvf, period=self.p.bbl)
-        std_dev = self.p.mult * bt.indicators.StdDev(self.wvf, period=self.p.bbl)
+        # 计算布林带上轨，StdDev 直接使用 mid_line 作为均值，不再重复计算一次 SMA
+        mid_line = shared_indicator(self, bt.indicators.SMA, self.wvf, period=self.p.bbl)
+        std_dev = self.p.mult * shared_indicator(self, bt.indicators.StdDev, self.wvf, mid_line, period=self.p.bbl)
         self.upper_band = mid_line + std_dev
 
         # 计算范围高
-        self.range_high = bt.indicators.Highest(self.wvf, period=self.p.lb) * self.p.ph
+        self.range_high = shared_indicator(self, bt.indicators.Highest, self.wvf, period=self.p.lb) * self.p.ph
 
     def next(self):
         # 在 next() 方法中动态计算布尔值
         self.lines.vixfix[0] = self.wvf[0] >= self.upper_band[0] or self.wvf[0] >= self.range_high[0]
 
+    def once(self, start, end):
+        # runonce 模式下一次算完整段，结果和 next() 相同
+        wvf = np.array(self.wvf.array[start:end])
+        upper_band = np.array(self.upper_band.array[start:end])
+        range_high = np.array(self.range_high.array[start:end])
+        vixfix = (wvf >= upper_band) | (wvf >= range_high)
+        self.lines.vixfix.array[start:end] = array.array("d", vixfix.astype("f8").tolist())
+
 
 
 class RSIGoldenCross(bt.Indicator):
@@ -42,13 +56,38 @@ class RSIGoldenCross(bt.Indicator):
 
     def __init__(self):
         # 定义两个RSI指标
-        self.rsi_short = bt.indicators.RSI(self.data.close, period=6)
-        self.rsi_long = bt.indicators.RSI(self.data.close, period=12)
+        self.rsi_short = shared_indicator(self, bt.indicators.RSI, self.data.close, period=6)
+        self.rsi_long = shared_indicator(self, bt.indicators.RSI, self.data.close, period=12)
         
-        # 检测金叉
-        self.lines.golden_cross = bt.ind.CrossUp(self.rsi_short, self.rsi_long)
+        # 检测金叉：和 bt.ind.CrossUp 相同，上一个不为 0 的差值小于 0，当前 RSI6 大于 RSI12，
+        # 需要上一根 K 线的差值，所以比两个 RSI 晚一根 K 线开始
+        self.addminperiod(max(self.rsi_short._minperiod, self.rsi_long._minperiod) + 1)
+        self._nzd = float("nan")
+
+    def _track(self):
+        diff = self.rsi_short[0] - self.rsi_long[0]
+        self._nzd = diff or self._nzd
 
-class MyStrategy(bt.Strategy):
+    def prenext(self):
+        self._track()
+
+    def next(self):
+        before = self._nzd
+        self._track()
+        self.lines.golden_cross[0] = float(before < 0.0 and self.rsi_short[0] > self.rsi_long[0])
+
+    def once(self, start, end):
+        # 从头计算不为 0 的差值（0 沿用前一个值），再整段比较
+        short = np.array(self.rsi_short.array[:end])
+        long = np.array(self.rsi_long.array[:end])
+        diff = short - long
+        idx = np.where(diff != 0.0, np.arange(end), 0)
+        nzd = diff[np.maximum.accumulate(idx)]
+        before = np.concatenate(([np.nan], nzd[:-1]))[start:end]
+        cross = (before < 0.0) & (short[start:end] > long[start:end])
+        self.lines.golden_cross.array[start:end] = array.array("d", cross.astype("f8").tolist())
+
+class MyStrategy(LoggingStrategy):
     """
     主策略程序 (修正版)
     """
@@ -63,7 +102,8 @@ class MyStrategy(bt.Strategy):
         ('hp', False),  # Show High Range
         ('sd', False),  # Show Standard Deviation Line
         ("stop_loss", 0.02),  # 新增止损比例参数 params.stop_loss
-        ("stop_win", 0.05)
+        ("stop_win", 0.05),
+        ("printlog", True),
     )
 
     def __init__(self):
@@ -75,20 +115,19 @@ class MyStrategy(bt.Strategy):
         self.buy_comm = None
         self.stop_loss_price = None  # 止损价格
         self.stop_win_price = None  # 止盈价格
+        # IntradayData 预先算好的下午时段标记，其他数据源没有时按时间判断
+        self.afternoon = getattr(self.datas[0].lines, "afternoon", None)
         
-        self.mid = bt.indicators.BollingerBands(
-            self.datas[0], period=20
-        ).mid
-        self.bot = bt.indicators.BollingerBands(
-            self.datas[0], period=20
-        ).bot
-        self.top = bt.indicators.BollingerBands(
-            self.datas[0], period=20
-        ).top
+        bb = shared_indicator(self, bt.indicators.BollingerBands, self.datas[0], period=20)
+        self.mid = bb.mid
+        self.bot = bb.bot
+        self.top = bb.top
 
         # 使用参数化RSI周期
         self.rsi_cross = RSIGoldenCross()
-        self.vix_indicator = CMWilliamsVixFix()
+        self.vix_indicator = CMWilliamsVixFix(
+            pd=self.p.pd, bbl=self.p.bbl, mult=self.p.mult, lb=self.p.lb, ph=self.p.ph, pl=self.p.pl
+        )
 
     def next(self):
 
@@ -96,10 +135,12 @@ class MyStrategy(bt.Strategy):
         
         if self.order:
             return
-        current_time = self.datas[0].datetime.time(0)
-
         # 判断是否是下午1点之后
-        if current_time >=datetime.time(13, 0, 0):
+        if self.afternoon is not None:
+            afternoon = self.afternoon[0]
+        else:
+            afternoon = self.datas[0].datetime.time(0) >= datetime.time(13, 0, 0)
+        if afternoon:
             self.log("当前时间是下午1点之后")
         else:
             return
@@ -139,18 +180,14 @@ class MyStrategy(bt.Strategy):
 
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log(f"买入, Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Comm: {order.executed.comm:.2f}")
+                self.log("买入, Price: %.2f, Cost: %.2f, Comm: %.2f", order.executed.price, order.executed.value, order.executed.comm)
             elif order.issell():
-                self.log(f"卖出, Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Comm: {order.executed.comm:.2f}")
+                self.log("卖出, Price: %.2f, Cost: %.2f, Comm: %.2f", order.executed.price, order.executed.value, order.executed.comm)
             self.order = None  # 订单完成，重置订单状态
 
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
             self.log("Order Canceled/Margin/Rejected")
             self.order = None  # 订单失败，重置订单状态
-    def log(self, txt):
-        """ 统一的日志记录方法 """
-        dt = self.datas[0].datetime.date(0)
-        print(f'{dt.isoformat()}, {txt}')
 
 
 def getakdata():
@@ -236,18 +273,21 @@ if __name__ == "__main__":
     start_date = datetime.datetime(2024, 2, 18)  # 回测开始时间
     end_date = datetime.datetime(2025, 2, 18)  # 回测结束时间
 
-    # 假设 stock_hfq_df 是正确的 DataFrame
-
-
-    stock_hfq_df = get30k()  # 获取样本数据
+    # 30 分钟线保存在本地，今天已经下载过时不再联网
+    symbol = "sz001227"
+    update(symbol, "30m")
 
-    data = bt.feeds.PandasData(
-        dataname=stock_hfq_df, fromdate=start_date, todate=end_date
+    data = IntradayData(
+        dataname=symbol, freq="30m", fromdate=start_date, todate=end_date
     )
     cerebro.adddata(data)  # 将数据传入回测系统
     cerebro.addstrategy(MyStrategy)  # 将交易策略加载到回测系统中
     cerebro.addanalyzer(bt.analyzers.PyFolio, _name="pyfolio")  # 添加分析器
 
+    from backtest.backtest_plot import PlotRecorder, plot_run
+
+    cerebro.addanalyzer(PlotRecorder, _name="plot")  # 记录画图用的总资产和成交
+
     start_cash = 1000000  # 设置初始资金
     cerebro.broker.setcash(start_cash)  # 设置初始资金
     cerebro.broker.setcommission(commission=0.0009)  # 设置手续费
@@ -261,11 +301,13 @@ if __name__ == "__main__":
     cerebro.addanalyzer(btanalyzers.SQN, _name="SQN")
     print("初始账户价值: %.2f" % cerebro.broker.getvalue())
 
-    cerebro.run()
+    strat = cerebro.run()[0]
     print("最终账户价值: %.2f" % cerebro.broker.getvalue())
+    print("指标去重: %s" % registry_stats(strat))
     
 
-    cerebro.plot(style='candle', bar=True)
+    # 30 分钟线按窗口宽度抽样画图，放大时从分钟线存储中读取细节
+    plot_run(strat)
 
 #     import matplotlib.dates as mdates
 # # 如果需要自定义时间格式，可以使用以下代码
@@ -0,0 +1,91 @@
+"""
+比较 CMWilliamsVixFix 和 RSIGoldenCross 逐根 K 线计算（runonce=False）和整段计算
+（runonce=True）的速度，并检查两种模式的结果完全相同。
+
+使用随机生成的 30 分钟 K 线，不需要联网：
+
+    python -m mystudy.study_bench
+"""
+import datetime
+import time
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from mystudy.study import CMWilliamsVixFix, RSIGoldenCross
+
+# A 股 30 分钟 K 线的收盘时间
+SESSION = ["10:00", "10:30", "11:00", "11:30", "13:30", "14:00", "14:30", "15:00"]
+
+
+def synthetic_30k(days=2000, seed=0):
+    """
+    生成 days 个交易日的随机 30 分钟 K 线
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2015-01-05", periods=days)
+    index = pd.DatetimeIndex(
+        [pd.Timestamp(f"{d.date()} {t}") for d in dates for t in SESSION]
+    )
+
+    close = 10.0 * np.exp(np.cumsum(rng.normal(0.0, 0.004, len(index))))
+    open_ = np.concatenate(([10.0], close[:-1]))
+    spread = np.abs(rng.normal(0.0, 0.003, len(index))) * close
+    df = pd.DataFrame(
+        {
+            "open": open_,
+            "high": np.maximum(open_, close) + spread,
+            "low": np.minimum(open_, close) - spread,
+            "close": close,
+            "volume": rng.integers(1000, 100000, len(index)).astype("f8"),
+        },
+        index=index,
+    )
+    return df
+
+
+class RecordStrategy(bt.Strategy):
+    """
+    只计算指标，结束时保存两个指标的输出
+    """
+
+    def __init__(self):
+        self.vix = CMWilliamsVixFix(pd=12)
+        self.cross = RSIGoldenCross()
+
+    def stop(self):
+        self.result = {
+            "vixfix": np.array(self.vix.lines.vixfix.array),
+            "golden_cross": np.array(self.cross.lines.golden_cross.array),
+        }
+
+
+def run(df, runonce):
+    cerebro = bt.Cerebro(stdstats=False, runonce=runonce)
+    cerebro.adddata(bt.feeds.PandasData(dataname=df))
+    cerebro.addstrategy(RecordStrategy)
+
+    start = time.perf_counter()
+    strat = cerebro.run()[0]
+    return strat.result, time.perf_counter() - start
+
+
+def same(a, b):
+    return len(a) == len(b) and bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+
+
+if __name__ == "__main__":
+    df = synthetic_30k()
+    print(f"随机 30 分钟 K 线: {len(df)} 根")
+
+    bars, bar_time = run(df, runonce=False)
+    batch, batch_time = run(df, runonce=True)
+
+    for name in bars:
+        assert same(bars[name], batch[name]), f"{name} 两种模式结果不同"
+        print(f"{name}: 信号 {int(np.nansum(batch[name]))} 个，两种模式结果相同")
+
+    print(f"逐根 K 线: {bar_time:.2f}s")
+    print(f"整段计算: {batch_time:.2f}s")
+    print(f"加速: {bar_time / batch_time:.1f}x")
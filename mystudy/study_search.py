@@ -0,0 +1,156 @@
+"""
+在固定的回测次数内搜索 study.py 中 MyStrategy 的参数。
+
+六个参数的网格组合数太多，先用 successive halving 在短区间上快速淘汰大部分参数，
+再用 TPE 在完整区间上细化：
+
+    python -m mystudy.study_search
+"""
+import datetime
+import functools
+
+import backtrader as bt
+
+from backtest.backtest_intraday import INTRADAY_DIR, IntradayData, update
+from backtest.backtest_search import (StrategyObjective, successive_halving,
+                                      tpe_search)
+from mystudy.study import MyStrategy
+
+SPACE = {
+    "pd": (6, 30),
+    "bbl": (10, 40),
+    "mult": (1.5, 3.0),
+    "lb": (20, 100),
+    "ph": (0.7, 0.95),
+    "stop_loss": (0.01, 0.05),
+    # stop_win 的止盈在 MyStrategy.next() 中没有启用，不参与搜索
+}
+
+
+def intraday_feeds(fromdate, todate, symbol, freq="30m", path=INTRADAY_DIR):
+    return [
+        IntradayData(
+            dataname=symbol, freq=freq, path=path, fromdate=fromdate, todate=todate
+        )
+    ]
+
+
+def percent_sizer(cerebro):
+    cerebro.addsizer(bt.sizers.PercentSizer, percents=90)
+
+
+def make_objective(symbol, freq="30m", path=INTRADAY_DIR):
+    return StrategyObjective(
+        MyStrategy,
+        functools.partial(intraday_feeds, symbol=symbol, freq=freq, path=path),
+        cash=1000000.0,
+        commission=0.0009,
+        setup=percent_sizer,
+        fixed={"printlog": False},
+    )
+
+
+def search(symbol, start_date, end_date, path=INTRADAY_DIR, workers=None, budget=60):
+    objective = make_objective(symbol, path=path)
+
+    halving = successive_halving(
+        objective, SPACE, start_date, end_date, n=27, eta=3, workers=workers
+    )
+    print_trial("successive halving", halving["best"], len(halving["trials"]))
+
+    tpe = tpe_search(
+        objective,
+        SPACE,
+        start_date,
+        end_date,
+        budget=budget,
+        startup=15,
+        patience=6,
+        workers=workers,
+        seed=1,
+    )
+    print_trial("TPE", tpe["best"], len(tpe["trials"]))
+    return halving, tpe
+
+
+def print_trial(name, trial, count):
+    rec = trial["record"]
+    params = ", ".join(
+        f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+        for k, v in trial["params"].items()
+    )
+    print(
+        f"{name}: 回测 {count} 次，最好 Sharpe {trial['score']:.3f}，"
+        f"收益 {rec['total_return'] * 100:.2f}%，回撤 {rec['max_drawdown']:.2f}%"
+    )
+    print(f"    {params}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] != ["check"]:
+        symbol = "sz001227"
+        update(symbol, "30m")
+        search(symbol, datetime.datetime(2024, 2, 18), datetime.datetime(2025, 2, 18))
+        sys.exit()
+
+    # python -m mystudy.study_search check
+    # 用随机生成的 1 分钟线检查 SPACE 中的每个参数都会影响回测结果
+    import tempfile
+
+    import numpy as np
+    import pandas as pd
+
+    from backtest.backtest_intraday import save_bars
+
+    rng = np.random.default_rng(0)
+    days = pd.bdate_range("2024-01-02", periods=240)
+    times = pd.date_range("09:31", "11:30", freq="1min").append(
+        pd.date_range("13:01", "15:00", freq="1min")
+    )
+    index = pd.DatetimeIndex(
+        [pd.Timestamp.combine(d.date(), t.time()) for d in days for t in times]
+    )
+    close = 10.0 * np.exp(np.cumsum(rng.normal(0.0, 0.002, len(index))))
+    open_ = np.concatenate(([10.0], close[:-1]))
+    spread = np.abs(rng.normal(0.0, 0.001, len(index)))
+    df = pd.DataFrame(
+        {
+            "open": open_,
+            "high": np.maximum(open_, close) * (1 + spread),
+            "low": np.minimum(open_, close) * (1 - spread),
+            "close": close,
+            "volume": rng.integers(100, 10000, len(index)).astype("f8"),
+        },
+        index=index,
+    )
+    start_date, end_date = days[0].to_pydatetime(), days[-1].to_pydatetime()
+
+    with tempfile.TemporaryDirectory() as path:
+        save_bars("demo", "1m", df, path)
+        objective = make_objective("demo", path=path)
+
+        base = {
+            "pd": 12,
+            "bbl": 20,
+            "mult": 2.0,
+            "lb": 50,
+            "ph": 0.85,
+            "stop_loss": 0.02,
+        }
+        assert set(base) == set(SPACE)
+        fields = ("final_value", "trades")
+        expected = objective(base, start_date, end_date)
+        print(
+            f"基准: 收益 {expected['total_return'] * 100:.2f}%，"
+            f"交易 {expected['trades']} 次"
+        )
+        for name, (low, high) in SPACE.items():
+            value = low if isinstance(low, int) else low + (high - low) * 0.1
+            rec = objective(dict(base, **{name: value}), start_date, end_date)
+            assert any(rec[f] != expected[f] for f in fields), f"{name} 不影响回测结果"
+            print(
+                f"{name}={value:.4g}: 收益 {rec['total_return'] * 100:.2f}%，"
+                f"交易 {rec['trades']} 次"
+            )
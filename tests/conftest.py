@@ -0,0 +1,95 @@
+"""
+测试共用的 fixture。
+
+基金数据使用仓库中 datas/etfs 下的 CSV，随机数据使用固定的种子，测试不需要联网。
+"""
+import collections.abc
+import datetime
+import os
+import shutil
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.backtest_feeds import ETFStoreData
+from backtest.backtest_optimizer import add_metrics
+
+# backtrader 1.9.76 的 optstrategy 用到了 Python 3.10 中移除的 collections.Iterable
+if not hasattr(collections, 'Iterable'):
+    collections.Iterable = collections.abc.Iterable
+
+MAINPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ETF_DIR = os.path.join(MAINPATH, 'datas/etfs')
+
+# 测试用的一小组基金，上市时间不同，能覆盖面板中缺失的日期
+FUNDS = ('sz159915', 'sh510310', 'sh510500')
+# FUNDS 都有数据的一段时间，用于和 Cerebro 对比的回测
+FROMDATE = datetime.datetime(2017, 5, 28)
+TODATE = datetime.datetime(2021, 7, 1)
+CASH = 200000.0
+COMMISSION = 0.00015
+
+
+def make_cerebro(broker=None, fromdate=FROMDATE, todate=TODATE):
+    """
+    加载 FUNDS 并添加记录所需分析器的 Cerebro，策略由调用方添加
+    """
+    cerebro = bt.Cerebro(stdstats=False)
+    for fund in FUNDS:
+        cerebro.adddata(
+            ETFStoreData(dataname=os.path.join(ETF_DIR, f'{fund}.csv'),
+                         fromdate=fromdate,
+                         todate=todate))
+    if broker is not None:
+        cerebro.setbroker(broker)
+    cerebro.broker.setcash(CASH)
+    cerebro.broker.setcommission(commission=COMMISSION)
+    add_metrics(cerebro)
+    return cerebro
+
+
+def synthetic_minutes(days, seed=0):
+    """
+    days 个交易日的随机 1 分钟线，上午 9:31 到 11:30，下午 13:01 到 15:00
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2024-01-02', periods=days)
+    times = pd.date_range('09:31', '11:30', freq='1min').append(
+        pd.date_range('13:01', '15:00', freq='1min'))
+    index = pd.DatetimeIndex([
+        pd.Timestamp.combine(d.date(), t.time()) for d in dates for t in times
+    ])
+    close = 10.0 * np.exp(np.cumsum(rng.normal(0.0, 0.0005, len(index))))
+    return pd.DataFrame(
+        {
+            'open': close,
+            'high': close * 1.001,
+            'low': close * 0.999,
+            'close': close,
+            'volume': rng.integers(100, 10000, len(index)).astype('f8'),
+        },
+        index=index)
+
+
+@pytest.fixture(scope='session')
+def minute_bars():
+    return synthetic_minutes(20)
+
+
+@pytest.fixture(scope='session')
+def etf_dir():
+    return ETF_DIR
+
+
+@pytest.fixture
+def fund_dir(tmp_path):
+    """
+    只包含 FUNDS 的 datas 目录副本，转换出的存储文件也写在临时目录中
+    """
+    etfs = tmp_path / 'datas/etfs'
+    etfs.mkdir(parents=True)
+    for fund in FUNDS:
+        shutil.copy2(os.path.join(ETF_DIR, f'{fund}.csv'), etfs)
+    return tmp_path
@@ -0,0 +1,53 @@
+import backtrader as bt
+import pytest
+
+from backtest.backtest_broker import (FastBroker, _avgprice, _split,
+                                     check_parity)
+from backtest.backtest_optimizer import RECORD_FIELDS, record
+from backtest.backtest_strategy import (BBandMomoscStrategy, BBandStrategy,
+                                        MomOscStrategy, MomStrategy)
+
+from tests.conftest import FROMDATE, FUNDS, TODATE, make_cerebro
+
+STRATEGIES = [MomStrategy, MomOscStrategy, BBandStrategy, BBandMomoscStrategy]
+PERIODS = range(10, 60, 14)
+
+
+@pytest.mark.parametrize('funds',
+                         [FUNDS, ('sz159915', 'sz159992', 'sh512690')],
+                         ids=['broad', 'sector'])
+@pytest.mark.parametrize('strategy', STRATEGIES)
+def test_parity_with_backbroker(strategy, funds):
+    result = check_parity(strategy, funds, PERIODS, FROMDATE, TODATE)
+    assert [period for period, _, _ in result] == list(PERIODS)
+
+
+def run_record(strategy, broker):
+    cerebro = make_cerebro(broker)
+    cerebro.addstrategy(strategy, period=24, printlog=False)
+    return record(cerebro.run()[0])
+
+
+@pytest.mark.parametrize('strategy', STRATEGIES)
+def test_same_record(strategy):
+    fast = run_record(strategy, FastBroker())
+    back = run_record(strategy, None)
+    for field in RECORD_FIELDS:
+        assert fast[field] == pytest.approx(back[field], rel=1e-9,
+                                            nan_ok=True), field
+
+
+@pytest.mark.parametrize('oldsize, oldprice, size, price', [
+    (0, 0.0, 100, 1.0),
+    (100, 1.0, 50, 2.0),
+    (100, 1.0, -40, 2.0),
+    (100, 1.0, -100, 2.0),
+    (100, 1.0, -150, 2.0),
+    (-100, 1.0, 30, 2.0),
+    (-100, 1.0, -30, 2.0),
+])
+def test_same_as_position_update(oldsize, oldprice, size, price):
+    position = bt.Position(oldsize, oldprice)
+    _, _, opened, closed = position.update(size, price)
+    assert _split(oldsize, size) == (opened, closed)
+    assert _avgprice(oldsize, oldprice, size, price) == position.price
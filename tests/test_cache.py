@@ -0,0 +1,52 @@
+import importlib
+import os
+
+from backtest import backtest_cache
+from backtest.backtest_cache import CODE_FILES, ResultCache, code_hash, run_key
+from backtest.backtest_strategy import MomStrategy
+
+from tests.conftest import ETF_DIR, FROMDATE, FUNDS, TODATE
+
+# 回测时会用到的模块，源码变化都要让缓存失效
+RUN_PATH = ('backtest_broker', 'backtest_cerebro', 'backtest_feeds',
+            'backtest_indicators', 'backtest_log', 'backtest_optimizer',
+            'backtest_registry', 'backtest_shared', 'backtest_stats',
+            'backtest_store', 'backtest_strategy')
+
+
+def test_code_files_cover_run_path():
+    names = {os.path.splitext(os.path.basename(p))[0] for p in CODE_FILES}
+    assert set(RUN_PATH) <= names
+    for path in CODE_FILES:
+        assert os.path.exists(path)
+        importlib.import_module(f'backtest.{os.path.basename(path)[:-3]}')
+
+
+def key(**kwargs):
+    datapaths = [os.path.join(ETF_DIR, f'{fund}.csv') for fund in FUNDS]
+    return run_key(MomStrategy, dict({'period': 10}, **kwargs), datapaths,
+                   FROMDATE, TODATE, {'cash': 200000.0})
+
+
+def test_code_change_invalidates(tmp_path, monkeypatch):
+    path = tmp_path / 'module.py'
+    path.write_text('x = 1\n')
+    monkeypatch.setattr(backtest_cache, 'CODE_FILES', [str(path)])
+    before, before_hash = key(), code_hash()
+    assert key() == before
+
+    path.write_text('x = 2\n')
+    assert code_hash() != before_hash
+    assert key() != before
+    assert key(period=11) != key()
+
+
+def test_put_get(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=4096)
+    for i in range(50):
+        cache.put(f'{i:040x}', {'i': i, 'data': 'x' * 100})
+    assert cache.get(f'{49:040x}') == {'i': 49, 'data': 'x' * 100}
+    assert cache.get('0' * 40 + 'missing') is None
+    total = sum(
+        os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+    assert total <= 4096
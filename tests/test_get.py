@@ -0,0 +1,258 @@
+import collections
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from backtest import backtest_get
+from backtest.backtest_get import (HIST_COLUMNS, CsvSource, RateLimiter,
+                                   download_all_fund, download_fund, fund_path,
+                                   get_fund_detail, journal_path,
+                                   read_journal)
+
+from tests.conftest import MAINPATH
+
+FUND = 'sz159915'
+
+
+class OverlapSource(CsvSource):
+    """
+    忽略 start_date 总是返回全部数据，和本地文件末尾重叠
+    """
+
+    def fund_hist(self, symbol, start_date=None):
+        return CsvSource.fund_hist(self, symbol)
+
+
+@pytest.fixture
+def datas(tmp_path, monkeypatch):
+    """
+    fund_path 等函数按 mainpath 定位文件，改为临时目录
+    """
+    monkeypatch.setattr(backtest_get, 'mainpath', str(tmp_path))
+    os.makedirs(tmp_path / 'datas/etfs')
+    return tmp_path / 'datas'
+
+
+@pytest.fixture
+def source(etf_dir):
+    return CsvSource(etf_dir)
+
+
+@pytest.fixture
+def full(datas, source):
+    """
+    全量下载的文件内容
+    """
+    get_fund_detail(FUND, 'etfs', source=source)
+    with open(fund_path(FUND, 'etfs'), 'rb') as f:
+        return f.read()
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def truncate_to(lines, n, newline=b'\n', trailing=True):
+    """
+    只保留表头和前 n - 1 行，模拟上次下载之后的本地文件
+    """
+    data = newline.join(lines[:n])
+    with open(fund_path(FUND, 'etfs'), 'wb') as f:
+        f.write(data + newline if trailing else data)
+    return data
+
+
+@pytest.mark.parametrize('n', [1, 2, 1000])
+@pytest.mark.parametrize('newline, trailing, overlap', [
+    (b'\n', True, False),
+    (b'\r\n', True, False),
+    (b'\n', False, False),
+    (b'\n', True, True),
+],
+                         ids=['append', 'crlf', 'no-trailing-newline',
+                              'overlap'])
+def test_append_matches_full_download(full, source, n, newline, trailing,
+                                      overlap):
+    lines = full.splitlines()
+    truncate_to(lines, n, newline, trailing)
+    src = OverlapSource(source.root) if overlap else source
+
+    added = get_fund_detail(FUND, 'etfs', source=src, incremental=True)
+
+    result = read_bytes(fund_path(FUND, 'etfs'))
+    if n == 1:
+        # 只有表头时退回全量下载
+        assert added == len(lines) - 1
+    else:
+        assert added == len(lines) - n
+        # 追加的部分和原文件使用相同的换行符
+        assert result.count(newline) == len(lines)
+        result = result.replace(newline, b'\n')
+    assert result == full
+
+
+@pytest.mark.parametrize('newline, trailing', [(b'\n', True),
+                                               (b'\r\n', True),
+                                               (b'\n', False)])
+def test_up_to_date_file_unchanged(full, source, newline, trailing):
+    lines = full.splitlines()
+    data = truncate_to(lines, len(lines), newline, trailing)
+
+    assert get_fund_detail(FUND, 'etfs', source=source, incremental=True) == 0
+    assert read_bytes(fund_path(FUND, 'etfs')).rstrip(newline) == data
+
+
+def test_failed_write_is_truncated(full, source, monkeypatch):
+    before = truncate_to(full.splitlines(), 1000) + b'\n'
+
+    def failed_fsync(fd):
+        raise OSError('磁盘已满')
+
+    monkeypatch.setattr(os, 'fsync', failed_fsync)
+    with pytest.raises(OSError):
+        get_fund_detail(FUND, 'etfs', source=source, incremental=True)
+    assert read_bytes(fund_path(FUND, 'etfs')) == before
+
+
+def test_offline_without_akshare():
+    # akshare 和 progress 不能导入时，CsvSource、增量追加仍然可以使用
+    code = ('import sys\n'
+            'sys.modules["akshare"] = sys.modules["progress"] = None\n'
+            'from backtest.backtest_get import CsvSource, append_rows\n')
+    subprocess.run([sys.executable, '-c', code], cwd=MAINPATH, check=True)
+
+
+class FlakySource(CsvSource):
+    """
+    按 errors 中的设置依次抛出异常，并记录每个基金的调用次数
+    """
+
+    def __init__(self, root, errors=None):
+        CsvSource.__init__(self, root)
+        self.errors = errors or dict()
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def fund_hist(self, symbol, start_date=None):
+        with self._lock:
+            self.calls[symbol] += 1
+            errors = self.errors.get(symbol, [])
+            error = errors.pop(0) if errors else None
+        if error is not None:
+            raise error
+        return CsvSource.fund_hist(self, symbol, start_date)
+
+
+class Interrupted(BaseException):
+    pass
+
+
+MISSING = 'sz000000'
+OPTIONS = dict(workers=4, rate=0, retries=3, backoff=0)
+
+
+@pytest.fixture
+def funds(datas, etf_dir):
+    """
+    清单中的前 12 个基金和一个数据源中没有的基金
+    """
+    funds = sorted(
+        os.path.splitext(name)[0]
+        for name in os.listdir(etf_dir) if name.endswith('.csv'))[:12]
+    pd.DataFrame({
+        'symbol': funds + [MISSING],
+        'name': funds + [MISSING],
+    }).to_csv(datas / 'check_list.csv')
+    return funds
+
+
+def download(src, **kwargs):
+    progress = []
+    results = download_all_fund('check_list.csv',
+                                'etfs',
+                                source=src,
+                                progress=lambda done, total: progress.append(
+                                    (done, total)),
+                                **dict(OPTIONS, **kwargs))
+    assert progress == [(i + 1, len(progress)) for i in range(len(progress))]
+    return results
+
+
+def test_retry_then_succeed(funds, etf_dir):
+    flaky = funds[0]
+    src = FlakySource(etf_dir, {
+        flaky: [ConnectionError('reset'),
+                TimeoutError('timeout')],
+    })
+    results = download(src)
+    assert results[flaky] == 'done' and src.calls[flaky] == 3
+    assert results[MISSING] == 'new'
+    assert set(results.values()) == {'done', 'new'}
+    assert not os.path.exists(journal_path('check_list.csv', 'etfs'))
+
+    for fund in funds:
+        expected = CsvSource(etf_dir).fund_hist(fund)
+        downloaded = pd.read_csv(fund_path(fund, 'etfs'), index_col=0)
+        assert expected.equals(downloaded[HIST_COLUMNS]), fund
+
+
+def test_retries_exhausted(funds, etf_dir):
+    broken, bad = funds[:2]
+    src = FlakySource(etf_dir, {
+        broken: [ConnectionError('reset')] * 10,
+        bad: [ValueError('bad response')] * 10,
+    })
+    results = download(src)
+    # 网络错误重试 retries 次后放弃，其他错误不重试
+    assert results[broken] == 'failed' and src.calls[broken] == 4
+    assert results[bad] == 'failed' and src.calls[bad] == 1
+    journal_file = journal_path('check_list.csv', 'etfs')
+    assert read_journal(journal_file) == results
+
+    # 再次运行只下载失败的基金，全部成功后删除日志
+    src = FlakySource(etf_dir)
+    results = download(src)
+    assert set(src.calls) == {broken, bad}
+    assert set(results.values()) == {'done'}
+    assert not os.path.exists(journal_file)
+
+
+def test_resume_after_partial_journal(funds, etf_dir):
+    src = FlakySource(etf_dir, {funds[6]: [Interrupted()]})
+    with pytest.raises(Interrupted):
+        download(src, workers=1)
+    journal = read_journal(journal_path('check_list.csv', 'etfs'))
+    assert 0 < len(journal) < len(funds) + 1
+    assert set(journal.values()) <= {'done', 'new'}
+
+    src = FlakySource(etf_dir)
+    results = download(src)
+    assert set(src.calls) == set(funds + [MISSING]) - set(journal)
+    assert set(results) == set(src.calls)
+    assert not os.path.exists(journal_path('check_list.csv', 'etfs'))
+
+
+def test_backoff_doubles(datas, etf_dir, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    src = FlakySource(etf_dir, {FUND: [ConnectionError('reset')] * 10})
+    status, error = download_fund(FUND, 'etfs', src, RateLimiter(0), False,
+                                  retries=3, backoff=0.5)
+    assert status == 'failed' and 'reset' in error
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_rate_limiter():
+    # n 次请求至少需要 (n - 1) / rate 秒
+    limiter = RateLimiter(200)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda i: limiter.wait(), range(41)))
+    assert time.monotonic() - start >= 40 / 200 * 0.99
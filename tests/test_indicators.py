@@ -0,0 +1,74 @@
+import collections
+import os
+
+import backtrader as bt
+import numpy as np
+import pytest
+
+from backtest import backtest_indicators
+from backtest.backtest_feeds import ETFCsvData, ETFStoreData
+from backtest.backtest_indicators import (CACHED, cached_indicator,
+                                          load_indicator, momentum)
+
+from tests.conftest import FROMDATE, FUNDS, TODATE
+
+
+@pytest.fixture
+def csv_path(fund_dir):
+    return str(fund_dir / f'datas/etfs/{FUNDS[0]}.csv')
+
+
+def test_loaded_is_bounded(csv_path, monkeypatch):
+    monkeypatch.setattr(backtest_indicators, 'MAX_LOADED', 3)
+    loaded = collections.OrderedDict()
+    monkeypatch.setattr(backtest_indicators, '_loaded', loaded)
+
+    first = load_indicator(csv_path, ETFCsvData, 'momentum', momentum,
+                           (('period', 1), ))
+    for period in range(2, 6):
+        load_indicator(csv_path, ETFCsvData, 'momentum', momentum,
+                       (('period', period), ))
+        # 最近用过的留在缓存中
+        assert load_indicator(csv_path, ETFCsvData, 'momentum', momentum,
+                              (('period', 2), ))[1].shape[1] == 1
+    assert len(loaded) == 3
+
+    # 被淘汰的指标重新从磁盘读取，结果不变
+    again = load_indicator(csv_path, ETFCsvData, 'momentum', momentum,
+                           (('period', 1), ))
+    assert again is not first
+    assert np.array_equal(again[1], first[1], equal_nan=True)
+    for dates, values in loaded.values():
+        assert isinstance(dates, np.memmap) and isinstance(values, np.memmap)
+
+
+class Lines(bt.Strategy):
+    params = (('indicator', None), ('cached', False))
+
+    def __init__(self):
+        make = cached_indicator if self.p.cached else (
+            lambda cls, data, **kwargs: cls(data, **kwargs))
+        self.ind = make(self.p.indicator, self.data, period=15)
+        self.rows = []
+
+    def next(self):
+        self.rows.append([line[0] for line in self.ind.lines])
+
+
+def indicator_rows(csv_path, cls, cached):
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(
+        ETFStoreData(dataname=csv_path, fromdate=FROMDATE, todate=TODATE))
+    cerebro.addstrategy(Lines, indicator=cls, cached=cached)
+    return cerebro.run()[0].rows
+
+
+@pytest.mark.parametrize('cls', list(CACHED))
+def test_same_as_backtrader(csv_path, cls):
+    rows = indicator_rows(csv_path, cls, cached=True)
+    assert len(rows) > 100
+    assert np.allclose(rows,
+                       indicator_rows(csv_path, cls, cached=False),
+                       equal_nan=True)
+    assert os.listdir(os.path.join(os.path.dirname(csv_path),
+                                   '.store/indicators'))
@@ -0,0 +1,111 @@
+import os
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.backtest_intraday import (COLUMNS, SESSIONS, IntradayData,
+                                        derived_path, last_bar, load_bars,
+                                        save_bars, update)
+
+FREQS = ('5m', '30m', '1d')
+# 每天的 K 线数
+BARS_PER_DAY = {'1m': 240, '5m': 48, '30m': 8, '1d': 1}
+
+
+def test_incremental_same_as_full(tmp_path, minute_bars):
+    path = str(tmp_path)
+    split = len(minute_bars) * 3 // 4
+    assert save_bars('demo', '1m', minute_bars.iloc[:split], path) == split
+    for freq in FREQS:
+        load_bars('demo', freq, path)
+
+    # 追加剩余部分并修改已有的一根 K 线，缓存只重新计算变化之后的部分
+    changed = minute_bars.iloc[split - 100:].copy()
+    changed.iloc[0, changed.columns.get_loc('close')] *= 1.01
+    assert save_bars('demo', '1m', changed, path) == len(changed)
+    assert save_bars('demo', '1m', changed, path) == 0
+
+    for freq in FREQS:
+        incremental = np.array(load_bars('demo', freq, path))
+        os.remove(derived_path('demo', freq, path))
+        full = np.array(load_bars('demo', freq, path))
+        assert np.array_equal(incremental, full), freq
+
+
+@pytest.mark.parametrize('freq', ['1m'] + list(FREQS))
+def test_bars_and_sessions(tmp_path, minute_bars, freq):
+    path = str(tmp_path)
+    save_bars('demo', '1m', minute_bars, path)
+    bars = load_bars('demo', freq, path)
+    days = len(minute_bars) // BARS_PER_DAY['1m']
+    assert bars.shape == (days * BARS_PER_DAY[freq],
+                          len(COLUMNS) + len(SESSIONS))
+
+    sessions = bars[:, len(COLUMNS):]
+    per_day = sessions.reshape(days, BARS_PER_DAY[freq], len(SESSIONS))
+    if freq != '1d':
+        # 午休不产生 K 线，上午和下午的 K 线数相同
+        assert (per_day[:, :, 0].sum(axis=1) == BARS_PER_DAY[freq] // 2).all()
+        assert (per_day[:, :, 1].sum(axis=1) == BARS_PER_DAY[freq] // 2).all()
+    assert (per_day[:, 0, 2] == 1).all() and per_day[:, :, 2].sum() == days
+    assert (per_day[:, -1, 3] == 1).all() and per_day[:, :, 3].sum() == days
+    assert np.isclose(bars[:, COLUMNS.index('volume')].sum(),
+                      minute_bars['volume'].sum())
+
+
+def test_resample_labels(tmp_path, minute_bars):
+    save_bars('demo', '1m', minute_bars, str(tmp_path))
+    bars = load_bars('demo', '30m', str(tmp_path))
+    times = pd.to_datetime(bars[:8, 0].astype('i8'), unit='s').strftime('%H:%M')
+    assert list(times) == [
+        '10:00', '10:30', '11:00', '11:30', '13:30', '14:00', '14:30', '15:00'
+    ]
+
+
+class MinuteSource(object):
+    """
+    update 使用的数据源，返回给定的分钟线
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.calls = 0
+
+    def minute_hist(self, symbol, period, adjust):
+        self.calls += 1
+        return self.df
+
+
+def test_update(tmp_path, minute_bars):
+    path = str(tmp_path)
+    assert last_bar('demo', '1m', path) is None
+    source = MinuteSource(minute_bars)
+    assert update('demo', '1m', source=source, path=path) == len(minute_bars)
+    assert last_bar('demo', '1m', path) == minute_bars.index[-1]
+    assert update('demo', '1m', source=source, path=path) == 0
+
+
+class Afternoon(bt.Strategy):
+
+    def __init__(self):
+        self.afternoon = 0
+
+    def next(self):
+        self.afternoon += int(self.data.afternoon[0])
+
+
+@pytest.mark.parametrize('runonce', [True, False])
+def test_intraday_data(tmp_path, minute_bars, runonce):
+    save_bars('demo', '1m', minute_bars, str(tmp_path))
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(IntradayData(dataname='demo', freq='30m',
+                                 path=str(tmp_path)))
+    cerebro.addstrategy(Afternoon)
+    strat = cerebro.run(runonce=runonce)[0]
+
+    days = len(minute_bars) // BARS_PER_DAY['1m']
+    assert len(strat.data) == days * 8
+    assert strat.afternoon == days * 4
+    assert strat.data.datetime.datetime(0) == minute_bars.index[-1]
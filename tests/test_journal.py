@@ -0,0 +1,99 @@
+import backtrader as bt
+import numpy as np
+import pytest
+
+from backtest.backtest_broker import FastBroker
+from backtest.backtest_journal import (Journal, JournalWriter, fill_frame,
+                                       read_journal, signal_frame)
+from backtest.backtest_strategy import MomStrategy
+
+from tests.conftest import COMMISSION, FUNDS, make_cerebro
+
+
+class Recorded(MomStrategy):
+    """
+    同时自己记录每根 K 线的指标值和每个订单，用来和日志对比
+    """
+
+    def __init__(self):
+        super(Recorded, self).__init__()
+        self.rows = []
+        self.submitted = []
+        self.completed = []
+
+    def next(self):
+        super(Recorded, self).next()
+        self.rows.append(np.array(self.values))
+
+    def notify_order(self, order):
+        if order.status == order.Submitted:
+            self.submitted.append(order.ref)
+        elif order.status == order.Completed:
+            self.completed.append((order.ref, order.executed.size))
+        super(Recorded, self).notify_order(order)
+
+
+def run(path=None, broker=None, batch=64):
+    cerebro = make_cerebro(broker)
+    cerebro.addstrategy(Recorded, period=13, printlog=False)
+    if path is not None:
+        cerebro.addanalyzer(Journal, path=path, batch=batch)
+    strat = cerebro.run()[0]
+    return strat, cerebro.broker.getvalue()
+
+
+@pytest.fixture(scope='module')
+def journaled(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('journal'))
+    strat, value = run(path)
+    return strat, value, read_journal(path)
+
+
+def test_journal_does_not_change_result(journaled):
+    _, value, _ = journaled
+    assert run()[1] == value
+
+
+def test_signals(journaled):
+    strat, _, journal = journaled
+    signals = signal_frame(journal)
+    assert list(signals.columns) == list(FUNDS)
+    assert len(signals) == len(strat.rows) > 64
+    assert np.array_equal(signals.values, np.array(strat.rows),
+                          equal_nan=True)
+    assert signals.index[-1].date() == strat.datetime.date(0)
+
+
+def test_orders_and_fills(journaled):
+    strat, _, journal = journaled
+    orders = journal['orders']
+    assert list(orders['ref']) == strat.submitted
+
+    fills = fill_frame(journal)
+    completed = fills[fills['status'] == 'Completed']
+    assert list(zip(completed['ref'], completed['size'])) == strat.completed
+    assert set(fills['fund']) <= set(FUNDS)
+    assert np.allclose(completed['comm'],
+                       completed['size'].abs() * completed['price'] *
+                       COMMISSION)
+
+
+def test_fast_broker_has_no_orders(tmp_path):
+    run(str(tmp_path), FastBroker())
+    journal = read_journal(str(tmp_path))
+    assert len(journal['signals']['dt']) > 0
+    assert journal['orders']['ref'].shape == (0, )
+    assert len(fill_frame(journal)) == 0
+
+
+def test_schema_follows_flushes(tmp_path):
+    writer = JournalWriter(str(tmp_path), ['a', 'b'], width=2, batch=4)
+    for i in range(5):
+        writer.append('signals', float(i), [i, -i])
+    # 写出的部分在 close 之前就可以读取
+    assert len(read_journal(str(tmp_path))['signals']['dt']) == 4
+    writer.close()
+    journal = read_journal(str(tmp_path))
+    assert list(journal['signals']['dt']) == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert journal['signals']['value'][4].tolist() == [4.0, -4.0]
+    assert journal['funds'] == ['a', 'b']
@@ -0,0 +1,73 @@
+import datetime
+import os
+
+import backtrader as bt
+import pytest
+
+from backtest.backtest_log import (BufferedLog, LoggingStrategy, RingLog,
+                                   format_record, open_log)
+
+from tests.conftest import make_cerebro
+
+DT = bt.date2num(datetime.datetime(2021, 3, 1, 23, 59, 59))
+
+
+def test_format_record():
+    assert format_record((DT, '买入，%s，价格：%.2f',
+                          ('sz159915', 1.234))) == \
+        '2021-03-01, 买入，sz159915，价格：1.23\n'
+    # 没有参数时不做 % 格式化
+    assert format_record((datetime.date(2021, 3, 1), '100%', ())) == \
+        '2021-03-01, 100%\n'
+
+
+def test_ring_log_keeps_last():
+    log = open_log(3)
+    assert isinstance(log, RingLog)
+    for i in range(10):
+        log.append((DT, '%d', (i, )))
+    assert log.lines() == ['2021-03-01, 7', '2021-03-01, 8', '2021-03-01, 9']
+
+
+def test_buffered_log_to_file(tmp_path):
+    log = BufferedLog(path=str(tmp_path / 'a.log'), batch=4)
+    for i in range(10):
+        log.append((DT, '%d', (i, )))
+    # 不足 batch 条的部分在 close 时写出
+    assert len(log.records) == 2
+    log.close()
+    with open(tmp_path / 'a.log', encoding='utf-8') as f:
+        assert f.read() == ''.join(f'2021-03-01, {i}\n' for i in range(10))
+
+
+def test_buffered_log_to_stdout(capsys):
+    log = open_log(None)
+    log.append((DT, 'hello', ()))
+    log.flush()
+    assert capsys.readouterr().out == '2021-03-01, hello\n'
+
+
+class Logged(LoggingStrategy):
+    params = (('period', 5), )
+
+    def next(self):
+        self.log('close %.3f', self.data.close[0])
+
+
+@pytest.mark.parametrize('printlog', [True, False])
+def test_strategy_log_per_run(tmp_path, printlog):
+    logto = str(tmp_path / '{strategy}.{period}.log')
+    cerebro = make_cerebro()
+    cerebro.addstrategy(Logged, printlog=printlog, logto=logto, period=7)
+    strat = cerebro.run()[0]
+
+    path = tmp_path / 'Logged.7.log'
+    if not printlog:
+        # 没有启用日志时不打开日志
+        assert strat.logger is None and not os.path.exists(path)
+        return
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert len(lines) == len(strat)
+    assert lines[-1] == (f'{strat.data.datetime.date(0).isoformat()}, '
+                         f'close {strat.data.close[0]:.3f}')
@@ -0,0 +1,78 @@
+import pytest
+
+from backtest.backtest_feeds import StoreData
+from backtest.backtest_optimizer import RECORD_FIELDS, best, optimize, record
+from backtest.backtest_strategy import (BBandStrategy, MomOscStrategy,
+                                        MomStrategy)
+
+from tests.conftest import FUNDS, make_cerebro
+
+PERIODS = [5, 12, 30]
+
+
+def single_run(strategy, period):
+    """
+    不经过 optimize，单独回测一组参数
+    """
+    cerebro = make_cerebro()
+    cerebro.addstrategy(strategy, period=period, printlog=False)
+    return record(cerebro.run()[0])
+
+
+def optimized(strategy, workers, optdatas=True):
+    cerebro = make_cerebro()
+    cerebro.p.optdatas = optdatas
+    cerebro.optstrategy(strategy, period=PERIODS, printlog=False)
+    strats = cerebro.strats
+    records = sorted(optimize(cerebro, workers=workers),
+                     key=lambda rec: rec['index'])
+    assert cerebro.strats is strats
+    return records
+
+
+@pytest.mark.parametrize('strategy',
+                         [MomStrategy, MomOscStrategy, BBandStrategy])
+def test_same_as_single_runs(strategy):
+    expected = [single_run(strategy, period) for period in PERIODS]
+    for workers, optdatas in [(1, True), (1, False), (2, True)]:
+        records = optimized(strategy, workers, optdatas)
+        assert [rec['index'] for rec in records] == list(range(len(PERIODS)))
+        for rec, exp in zip(records, expected):
+            assert rec['params'] == exp['params']
+            for field in RECORD_FIELDS:
+                assert rec[field] == pytest.approx(exp[field], nan_ok=True), (
+                    workers, optdatas, field)
+
+
+@pytest.mark.parametrize('optdatas, loads', [(True, 1), (False, len(PERIODS))])
+def test_data_loaded_once(monkeypatch, optdatas, loads):
+    calls = []
+    preload = StoreData.preload
+
+    def counted(self):
+        calls.append(self._name)
+        preload(self)
+
+    monkeypatch.setattr(StoreData, 'preload', counted)
+    optimized(MomStrategy, 1, optdatas)
+    assert sorted(calls) == sorted(FUNDS * loads)
+
+
+def test_stop_early():
+    cerebro = make_cerebro()
+    cerebro.optstrategy(MomStrategy, period=PERIODS, printlog=False)
+    progress = []
+    records = list(
+        optimize(cerebro,
+                 workers=1,
+                 progress=lambda done, total: progress.append((done, total)),
+                 good=lambda rec: True,
+                 target=2))
+    assert len(records) == 2
+    assert progress == [(1, 3), (2, 3)]
+
+
+def test_best():
+    records = [{'sharpe': 1.0}, {'sharpe': None}, {'sharpe': 2.0}]
+    assert best(records, n=1) == [{'sharpe': 2.0}]
+    assert best(records) == [{'sharpe': 2.0}, {'sharpe': 1.0}]
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from backtest import backtest_panel
+from backtest.backtest_feeds import ETFCsvData
+from backtest.backtest_panel import FIELDS, load_panel, update_panel
+from backtest.backtest_store import load_store
+
+from tests.conftest import FUNDS
+
+
+@pytest.fixture
+def panel_dir(fund_dir, monkeypatch):
+    monkeypatch.setattr(backtest_panel, 'mainpath', str(fund_dir))
+    return str(fund_dir / 'datas/.panel')
+
+
+def test_fields_are_contiguous(panel_dir):
+    panel = update_panel(('etfs', ), panel_dir)
+    assert panel.values.shape == (len(FIELDS), len(panel), len(FUNDS))
+    for name in FIELDS:
+        assert panel.field(name).flags.c_contiguous
+    _, values, _ = panel.slice()
+    assert all(values[i].flags.c_contiguous for i in range(len(FIELDS)))
+
+
+def test_matches_store(panel_dir, fund_dir):
+    panel = update_panel(('etfs', ), panel_dir)
+    assert panel.funds == sorted(FUNDS)
+    for j, fund in enumerate(panel.funds):
+        array = load_store(str(fund_dir / f'datas/etfs/{fund}.csv'),
+                           ETFCsvData)
+        rows = np.searchsorted(panel.dates, array[:, 0])
+        assert panel.mask[:, j].sum() == len(array)
+        assert panel.mask[rows, j].all()
+        for i, name in enumerate(FIELDS):
+            assert np.array_equal(panel.field(name)[rows, j],
+                                  array[:, 1 + i])
+        assert np.isnan(panel.field('close')[~panel.mask[:, j], j]).all()
+
+
+def test_incremental_update(panel_dir, fund_dir):
+    first = update_panel(('etfs', ), panel_dir)
+    expected = np.array(first.values)
+    first = None
+    assert update_panel(('etfs', ), panel_dir).values.shape == expected.shape
+
+    # 只改动一个基金的 CSV，其余基金从旧面板搬过来，结果和全部重新生成相同
+    csv_path = fund_dir / f'datas/etfs/{FUNDS[0]}.csv'
+    stat = os.stat(csv_path)
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    panel = update_panel(('etfs', ), panel_dir)
+    assert np.array_equal(np.asarray(panel.values), expected, equal_nan=True)
+
+
+def test_old_layout_is_rebuilt(panel_dir):
+    update_panel(('etfs', ), panel_dir)
+    meta = os.path.join(panel_dir, 'meta.json')
+    with open(meta, 'r', encoding='utf-8') as f:
+        text = f.read()
+    with open(meta, 'w', encoding='utf-8') as f:
+        f.write(text.replace('"layout": 2, ', ''))
+    assert load_panel(panel_dir) is None
+    panel = update_panel(('etfs', ), panel_dir)
+    assert panel.values.shape[0] == len(FIELDS)
@@ -0,0 +1,202 @@
+import subprocess
+import sys
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import backtrader as bt
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.backtest_intraday import (COLUMNS, IntradayData, load_bars,
+                                        save_bars)
+from backtest.backtest_plot import (_EPOCH_ORDINAL, PlotRecorder, Series,
+                                    data_series, decimate, lttb, minmax,
+                                    plot_run)
+from backtest.backtest_strategy import MomStrategy
+
+from tests.conftest import MAINPATH, make_cerebro
+
+
+def reference_lttb(x, y, n):
+    """
+    逐点计算的 LTTB，桶的划分和 lttb 相同
+    """
+    size = len(x)
+    edges = [int(e) for e in np.linspace(1, size - 1, n - 1)]
+    result = [0]
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt = range(edges[i + 1], edges[i + 2])
+            cx = sum(x[j] for j in nxt) / len(nxt)
+            cy = sum(y[j] for j in nxt) / len(nxt)
+        else:
+            cx, cy = x[size - 1], y[size - 1]
+        ax, ay = x[result[-1]], y[result[-1]]
+        areas = [
+            abs((ax - cx) * (y[j] - ay) - (ax - x[j]) * (cy - ay))
+            for j in range(lo, hi)
+        ]
+        result.append(lo + int(np.argmax(areas)))
+    result.append(size - 1)
+    return result
+
+
+@pytest.fixture(scope='module')
+def walk():
+    rng = np.random.default_rng(0)
+    y = np.cumsum(rng.normal(size=20000))
+    return np.arange(len(y), dtype='f8'), y
+
+
+@pytest.mark.parametrize('n', [3, 10, 97, 500])
+def test_lttb_matches_reference(walk, n):
+    x, y = walk[0][:3000], walk[1][:3000]
+    keep = lttb(x, y, n)
+    assert len(keep) == n
+    assert list(keep) == reference_lttb(x, y, n)
+
+
+def test_lttb_small(walk):
+    x, y = walk
+    assert list(lttb(x[:5], y[:5], 10)) == [0, 1, 2, 3, 4]
+    assert list(lttb(x, y, 2)) == [0, len(x) - 1]
+    assert list(lttb(x, y, 0)) == []
+
+
+def test_minmax(walk):
+    x, y = walk
+    picked = minmax(y, 101)
+    assert picked[0] == 0 and picked[-1] == len(y) - 1
+    assert np.all(np.diff(picked) > 0)
+    assert len(picked) <= 102
+    assert y[picked].max() == y.max()
+    assert y[picked].min() == y.min()
+
+
+@pytest.mark.parametrize('n', [50, 400, 2000])
+def test_decimate(walk, n):
+    x, y = walk
+    keep = decimate(x, y, n)
+    assert len(keep) == n
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert np.all(np.diff(keep) > 0)
+    # 预选保留了每段的峰谷，抽样后仍在整个区间的范围内
+    assert y[keep].max() <= y.max() and y[keep].min() >= y.min()
+    assert list(decimate(x[:n], y[:n], n)) == list(range(n))
+
+
+def test_series_window():
+    x = np.arange(100, dtype='f8') + 1000.0
+    y = np.arange(100, dtype='f8')
+    y[50] = np.nan
+    series = Series(x, y, offset=1000.0, scale=2.0, begin=1010.0, end=1089.0)
+    assert len(series) == 80
+    assert series.limits() == (5.0, 44.5)
+
+    xs, ys = series.window(20.0, 30.0)
+    # 两边各多取一个点，去掉 NaN
+    assert xs[0] == 19.5 and xs[-1] == 30.5
+    assert 25.0 not in xs
+    assert list(ys) == [v for v in range(39, 62) if v != 50]
+    assert len(Series(x, y, begin=2000.0)) == 0
+    assert Series(x, y, begin=2000.0).limits() is None
+
+
+@pytest.fixture(scope='module')
+def plotted():
+    cerebro = make_cerebro()
+    cerebro.addstrategy(MomStrategy, period=13, printlog=False)
+    cerebro.addanalyzer(PlotRecorder, _name='plot')
+    strat = cerebro.run()[0]
+    return strat, cerebro.broker.getvalue()
+
+
+def test_recorder(plotted):
+    strat, value = plotted
+    analysis = strat.analyzers.plot.get_analysis()
+    assert len(analysis['dt']) == len(strat)
+    assert analysis['value'][-1] == pytest.approx(value)
+    assert analysis['signals'].shape == (len(analysis['signal_dt']),
+                                         len(strat.datas))
+    assert len(analysis['fills']) > 0
+    assert {fill[1] for fill in analysis['fills']} <= set(
+        range(len(strat.datas)))
+
+
+def test_store_data_series(plotted):
+    strat, _ = plotted
+    for data in strat.datas:
+        series = data_series(data)
+        x, y = series.window(-np.inf, np.inf)
+        assert list(y) == list(data.close.array)
+        assert list(np.floor(x)) == [
+            np.floor(dt) - _EPOCH_ORDINAL for dt in data.datetime.array
+        ]
+
+
+def test_plot_run(plotted, tmp_path):
+    strat, _ = plotted
+    path = tmp_path / 'run.png'
+    lazy = plot_run(strat, path=str(path), points=300)
+    assert path.stat().st_size > 0
+    assert len(lazy.lines) == 1 + 2 * len(strat.datas)
+    for line in lazy.lines:
+        assert len(line.line.get_xdata()) == 300
+
+    # 成交全部画出来
+    fills = strat.analyzers.plot.get_analysis()['fills']
+    axes = lazy.fig.axes
+    scattered = sum(
+        len(c.get_offsets()) for ax in axes for c in ax.collections)
+    assert scattered == len(fills)
+
+    # 放大后按新的区间重新抽样，点数不变，纵坐标按可见部分调整
+    lo, hi = axes[0].get_xlim()
+    mid = (lo + hi) / 2
+    axes[0].set_xlim(lo, mid)
+    for line in lazy.lines:
+        x = line.line.get_xdata()
+        assert len(x) == 300
+        assert x[-2] <= mid
+    y = lazy.lines[0].line.get_ydata()
+    bottom, top = axes[0].get_ylim()
+    assert bottom < y.min() and y.max() < top
+    plt.close(lazy.fig)
+
+
+def test_points_follow_width(plotted, tmp_path):
+    strat, _ = plotted
+    lazy = plot_run(strat, path=str(tmp_path / 'run.png'))
+    for line in lazy.lines:
+        width = line.ax.bbox.width
+        assert len(line.line.get_xdata()) <= int(width * 2)
+    plt.close(lazy.fig)
+
+
+def test_intraday_data_series(tmp_path, minute_bars):
+    save_bars('demo', '1m', minute_bars, str(tmp_path))
+    fromdate = minute_bars.index[len(minute_bars) // 2].to_pydatetime()
+    cerebro = bt.Cerebro(stdstats=False)
+    data = IntradayData(dataname='demo',
+                        freq='5m',
+                        path=str(tmp_path),
+                        fromdate=fromdate)
+    cerebro.adddata(data)
+    cerebro.run()
+
+    bars = load_bars('demo', '5m', str(tmp_path))
+    bars = bars[bars[:, 0] >= pd.Timestamp(fromdate).value // 10**9]
+    x, y = data_series(data).window(-np.inf, np.inf)
+    assert list(y) == list(bars[:, COLUMNS.index('close')])
+    assert list(x) == list(bars[:, 0] / 86400.0)
+
+
+def test_no_plot_no_matplotlib():
+    code = ('import sys, backtest.backtest_cerebro; '
+            'assert "matplotlib" not in sys.modules')
+    subprocess.run([sys.executable, '-c', code], cwd=MAINPATH, check=True)
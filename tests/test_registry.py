@@ -0,0 +1,83 @@
+import backtrader as bt
+import pytest
+
+from backtest.backtest_registry import (ReusedLines, registry_stats,
+                                        shared_indicator)
+
+from tests.conftest import make_cerebro
+
+PERIOD = 30
+
+
+class Wrapper(bt.Indicator):
+    """
+    内部创建 BollingerBands，自己的线只用到收盘价
+    """
+    lines = ('close', )
+
+    def __init__(self):
+        self.bb = shared_indicator(self,
+                                   bt.indicators.BollingerBands,
+                                   self.data,
+                                   period=PERIOD)
+        self.lines.close = self.data.close * 1.0
+
+
+class Reuse(bt.Strategy):
+    """
+    复用 Wrapper 中创建的 BollingerBands，和直接创建的指标逐根对比
+    """
+
+    def __init__(self):
+        self.wrapper = Wrapper(self.data)
+        self.bb = shared_indicator(self,
+                                   bt.indicators.BollingerBands,
+                                   self.data,
+                                   period=PERIOD)
+        self.again = shared_indicator(self,
+                                      bt.indicators.BollingerBands,
+                                      self.data,
+                                      period=PERIOD)
+        self.direct = bt.indicators.BollingerBands(self.data, period=PERIOD)
+        self.rows = []
+
+    def next(self):
+        self.rows.append((len(self), [line[0] for line in self.bb.lines],
+                          [line[0] for line in self.direct.lines]))
+
+
+@pytest.mark.parametrize('runonce', [True, False])
+def test_strategy_reuses_indicator_from_indicator(runonce):
+    cerebro = make_cerebro()
+    cerebro.addstrategy(Reuse)
+    strat = cerebro.run(runonce=runonce)[0]
+
+    assert isinstance(strat.bb, ReusedLines) and strat.again is strat.bb
+    assert strat.bb._minperiod == strat.wrapper.bb._minperiod == PERIOD
+    assert registry_stats(strat) == {'created': 1, 'reused': 2}
+
+    assert strat.rows[0][0] == PERIOD
+    for _, reused, direct in strat.rows:
+        assert reused == direct
+    assert strat.bb.mid[0] == strat.wrapper.bb.mid[0]
+
+
+class Indicators(bt.Strategy):
+
+    def __init__(self):
+        self.mid = shared_indicator(self,
+                                    bt.indicators.BollingerBands,
+                                    self.data,
+                                    period=PERIOD).mid
+        self.top = shared_indicator(self,
+                                    bt.indicators.BollingerBands,
+                                    self.data,
+                                    period=PERIOD).top
+
+
+def test_same_owner_returns_same_object():
+    cerebro = make_cerebro()
+    cerebro.addstrategy(Indicators)
+    strat = cerebro.run()[0]
+    assert registry_stats(strat) == {'created': 1, 'reused': 1}
+    assert strat.mid._owner is strat.top._owner
@@ -0,0 +1,194 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+from backtest.backtest_journal import read_journal
+from backtest.backtest_optimizer import RECORD_FIELDS
+from backtest.backtest_results import COLUMNS, ResultStore, heatmap, run_frame
+
+GROUPS = ['funds_1', 'funds_2', 'funds_3']
+
+
+def record(sharpe, period, strategy='MomStrategy'):
+    return {
+        'strategy': strategy,
+        'params': {
+            'period': period,
+            'printlog': False
+        },
+        'final_value': 200000.0 * (1.0 + sharpe),
+        'total_return': sharpe,
+        'annual_return': sharpe / 4,
+        'sharpe': sharpe,
+        'sqn': sharpe,
+        'max_drawdown': 20.0,
+        'exposure': 0.5,
+        'trades': 100,
+    }
+
+
+@pytest.fixture
+def datapath(tmp_path):
+    path = str(tmp_path / 'sz159915.csv')
+    with open(path, 'w') as f:
+        f.write('v1')
+    return path
+
+
+@pytest.fixture
+def filled(tmp_path, datapath):
+    """
+    两个数据版本、三个组合、两个策略的 600 条结果，batch 小于记录数，跨多次写入
+    """
+    rng = np.random.default_rng(0)
+    store = ResultStore(str(tmp_path / 'results.sqlite'), batch=64)
+    added = []
+    for i in range(600):
+        if i == 300:
+            # 数据版本在写入时确定，更新数据之前先写入缓冲的结果
+            store.flush()
+            with open(datapath, 'w') as f:
+                f.write('v2')
+        sharpe = round(float(rng.normal(0.3, 0.5)), 2)
+        strategy = 'MomStrategy' if i % 4 else 'MomOscStrategy'
+        group = GROUPS[i % len(GROUPS)]
+        store.add(record(sharpe, i % 17 + 1, strategy), group, ['sz159915'],
+                  [datapath],
+                  start_date=datetime.datetime(2018, 1, 1))
+        added.append((i + 1, group, strategy, i % 17 + 1, 1 if i < 300 else 2,
+                      sharpe))
+    yield store, added
+    store.close()
+
+
+def test_add_and_versions(filled):
+    store, added = filled
+    assert len(store) == len(added)
+    assert [(i, name) for i, name, _ in store.versions()
+            ] == [(1, 'sz159915.csv'), (2, 'sz159915.csv')]
+
+    runs = store.runs().sort_values('id')
+    assert list(runs.columns) == list(COLUMNS)
+    assert list(runs['id']) == [row[0] for row in added]
+    assert list(runs['group']) == [row[1] for row in added]
+    assert list(runs['strategy']) == [row[2] for row in added]
+    assert list(runs['period']) == [row[3] for row in added]
+    assert list(runs['version']) == [row[4] for row in added]
+    assert list(runs['sharpe']) == [row[5] for row in added]
+    assert set(runs['start_date']) == {'2018-01-01 00:00:00'}
+    assert set(runs['funds']) == {'sz159915'}
+
+
+def test_ids_resolved_once(filled):
+    store, added = filled
+    store.flush()
+    # 组合和参数每种只插入一次，之后的批次使用缓存的编号
+    assert store.conn.execute('SELECT count(*) FROM groups').fetchone(
+    )[0] == len(GROUPS)
+    assert store.conn.execute('SELECT count(*) FROM params').fetchone(
+    )[0] == len({(row[2], row[3]) for row in added})
+
+    # 新的 ResultStore 没有缓存，也取得已有的编号
+    other = ResultStore(store.path)
+    other.add(record(9.0, 1), GROUPS[0], ['sz159915'],
+              [os.path.join(os.path.dirname(store.path), 'sz159915.csv')])
+    other.flush()
+    assert other.conn.execute('SELECT count(*) FROM groups').fetchone(
+    )[0] == len(GROUPS)
+    assert other.runs(columns=['id', 'version']).max().tolist() == [601, 2]
+    other.close()
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(since=2),
+    dict(min_sharpe=0.5),
+    dict(since=2, min_sharpe=0.5),
+    dict(strategy='MomOscStrategy', group='funds_2'),
+])
+def test_runs_filters(filled, kwargs):
+    store, added = filled
+    expected = [
+        row[0] for row in added
+        if row[4] >= kwargs.get('since', 0) and row[5] > kwargs.get(
+            'min_sharpe', -np.inf) and row[2] == kwargs.get(
+                'strategy', row[2]) and row[1] == kwargs.get('group', row[1])
+    ]
+    assert sorted(store.runs(**kwargs)['id']) == expected
+
+
+def test_runs_columns_and_limit(filled):
+    store, _ = filled
+    full = store.runs(since=2, min_sharpe=0.5).set_index('id')
+    columns = ['id', 'group', 'period', 'sharpe']
+    part = store.runs(since=2, min_sharpe=0.5, columns=columns)
+    assert list(part.columns) == columns
+    assert part.set_index('id').sort_index().equals(
+        full[columns[1:]].sort_index())
+
+    limited = store.runs(since=2, columns=['id'], limit=10)
+    assert len(limited) == 10
+    assert set(limited['id']) <= set(store.runs(since=2)['id'])
+    with pytest.raises(KeyError):
+        store.runs(columns=['id', 'unknown'])
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(key='total_return', since=2),
+    dict(strategy='MomOscStrategy'),
+])
+def test_best(filled, kwargs):
+    store, _ = filled
+    key = kwargs.pop('key', 'sharpe')
+    best = store.best(key, **kwargs)
+
+    runs = store.runs(**kwargs)
+    expected = []
+    for group in GROUPS:
+        rows = runs[runs['group'] == group]
+        # 相同时取最新的一行
+        top = rows[rows[key] == rows[key].max()]['id'].max()
+        expected.append(top)
+    assert list(best['group']) == GROUPS
+    assert list(best['id']) == expected
+    assert list(best.columns) == list(COLUMNS)
+
+
+def test_best_unknown_key(filled):
+    store, _ = filled
+    with pytest.raises(ValueError):
+        store.best('unknown')
+
+
+def test_export_and_heatmap(filled, tmp_path):
+    store, added = filled
+    path = str(tmp_path / 'export')
+    assert store.export(path, since=2, batch=50) == 300
+
+    frame = run_frame(read_journal(path))
+    assert list(frame['id']) == [row[0] for row in added[300:]]
+    assert list(frame['group']) == [row[1] for row in added[300:]]
+    assert list(frame['strategy']) == [row[2] for row in added[300:]]
+    assert list(frame['sharpe']) == [row[5] for row in added[300:]]
+    assert set(frame['version']) == {2}
+    assert list(frame.columns) == ['id', 'group', 'strategy', 'version',
+                                   'period'] + list(RECORD_FIELDS)
+
+    table = heatmap(path, strategy='MomStrategy')
+    moms = frame[frame['strategy'] == 'MomStrategy']
+    assert table.shape == (len(GROUPS), moms['period'].nunique())
+    for (group, period), sharpe in moms.groupby(['group',
+                                                 'period'])['sharpe'].max(
+                                                 ).items():
+        assert table.loc[group, period] == sharpe
+
+
+def test_context_manager_flushes(tmp_path, datapath):
+    path = str(tmp_path / 'results.sqlite')
+    with ResultStore(path) as store:
+        store.add(record(1.0, 5), GROUPS[0], ['sz159915'], [datapath])
+    with ResultStore(path) as store:
+        assert len(store) == 1
@@ -0,0 +1,76 @@
+import datetime
+import os
+
+import backtrader as bt
+import numpy as np
+import pytest
+
+from backtest import backtest_store
+from backtest.backtest_feeds import ETFCsvData, ETFStoreData
+from backtest.backtest_store import (COLUMNS, convert_all, is_stale,
+                                     load_store, store_path, tail)
+
+from tests.conftest import FUNDS
+
+
+class Bars(bt.Strategy):
+
+    def __init__(self):
+        self.bars = []
+
+    def next(self):
+        self.bars.append((self.data.datetime[0], ) +
+                         tuple(getattr(self.data, name)[0]
+                               for name in COLUMNS[1:]))
+
+
+def run(feed, path, **kwargs):
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(feed(dataname=path, **kwargs))
+    cerebro.addstrategy(Bars)
+    return cerebro.run()[0].bars
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(fromdate=datetime.datetime(2019, 3, 1),
+         todate=datetime.datetime(2020, 6, 30)),
+])
+def test_store_data_matches_csv(fund_dir, kwargs):
+    path = str(fund_dir / f'datas/etfs/{FUNDS[0]}.csv')
+    assert run(ETFStoreData, path, **kwargs) == run(ETFCsvData, path,
+                                                    **kwargs)
+
+
+def test_convert_and_reload(fund_dir):
+    path = str(fund_dir / f'datas/etfs/{FUNDS[0]}.csv')
+    assert is_stale(path)
+    array = load_store(path, ETFCsvData)
+    assert os.path.exists(store_path(path))
+    assert not is_stale(path)
+    assert isinstance(array, np.memmap)
+    assert array.flags.f_contiguous
+    assert array.shape[1] == len(COLUMNS)
+    assert np.all(np.diff(array[:, 0]) > 0)
+    assert list(tail(path, 5, ETFCsvData)[:, 4]) == list(array[-5:, 4])
+    assert len(tail(path, 10**9, ETFCsvData)) == len(array)
+
+    # CSV 更新之后重新转换
+    with open(path, 'a') as f:
+        f.write(f'{len(array)},2099-01-02,1.0,2.0,0.5,1.5,100,{FUNDS[0]}\n')
+    stamp = os.path.getmtime(store_path(path)) + 1
+    os.utime(path, (stamp, stamp))
+    assert is_stale(path)
+    updated = load_store(path, ETFCsvData)
+    assert len(updated) == len(array) + 1
+    assert list(updated[-1]) == [
+        datetime.date(2099, 1, 2).toordinal(), 1.0, 2.0, 0.5, 1.5, 100.0, 0.0
+    ]
+
+
+def test_convert_all(fund_dir, monkeypatch):
+    monkeypatch.setattr(backtest_store, 'mainpath', str(fund_dir))
+    assert convert_all('etfs', ETFCsvData) == [f'{fund}.csv'
+                                               for fund in sorted(FUNDS)]
+    assert convert_all('etfs', ETFCsvData) == []
+    assert len(convert_all('etfs', ETFCsvData, force=True)) == len(FUNDS)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from backtest.backtest_strategy import (BBandStrategy, MomOscStrategy,
+                                        MomStrategy)
+from backtest.backtest_vector import check_parity, run_grid
+
+from tests.conftest import FROMDATE, FUNDS, TODATE
+
+# 周期太短时 BollingerBands 的标准差可能为 0，Cerebro 中会除零
+PERIODS = range(10, 60, 7)
+
+
+@pytest.mark.parametrize('strategy',
+                         [MomStrategy, MomOscStrategy, BBandStrategy])
+def test_parity_with_cerebro(strategy):
+    result = check_parity(strategy, FUNDS, PERIODS, FROMDATE, TODATE)
+    assert [period for period, _, _ in result] == list(PERIODS)
+
+
+def test_grid_table():
+    grid = run_grid(MomStrategy, FUNDS, range(1, 60), FROMDATE, TODATE)
+    assert grid.values.shape == (59, len(grid.dates))
+    table = grid.table()
+    assert [row[0] for row in table] == list(range(1, 60))
+    assert np.allclose([row[1] for row in table], grid.total_return())
+    assert grid.best()[1] == grid.final.max()
@@ -0,0 +1,81 @@
+import datetime
+import os
+
+import backtrader as bt
+import pytest
+
+from backtest.backtest_stats import annualize
+from backtest.backtest_strategy import MomStrategy
+from backtest.backtest_walkforward import (trading_from, walkforward,
+                                           warmup_date, windows)
+
+from tests.conftest import (CASH, COMMISSION, ETF_DIR, FROMDATE, FUNDS,
+                            TODATE, make_cerebro)
+
+
+def test_windows():
+    spans = windows(datetime.datetime(2018, 1, 1),
+                    datetime.datetime(2019, 12, 31),
+                    train_months=12,
+                    test_months=6)
+    assert [span[2].date() for span in spans] == [
+        datetime.date(2019, 1, 1), datetime.date(2019, 7, 1)
+    ]
+    for train_start, train_end, test_start, test_end in spans:
+        assert train_end < test_start <= test_end
+        assert (test_start - train_start).days in (365, 366)
+
+
+def test_no_orders_before_start():
+    start = datetime.datetime(2019, 1, 2)
+    cerebro = make_cerebro(fromdate=warmup_date(start, {'period': 30}))
+    cerebro.addstrategy(trading_from(MomStrategy, start),
+                        period=30,
+                        printlog=False)
+    cerebro.addanalyzer(bt.analyzers.TimeReturn,
+                        timeframe=bt.TimeFrame.Days,
+                        _name='returns')
+    strat = cerebro.run()[0]
+    assert type(strat).__name__ == 'MomStrategy'
+
+    returns = strat.analyzers.returns.get_analysis()
+    before = [r for dt, r in returns.items() if dt < start]
+    after = [r for dt, r in returns.items() if dt >= start]
+    assert before and all(r == 0.0 for r in before)
+    assert any(r != 0.0 for r in after)
+
+
+@pytest.fixture(scope='module')
+def report():
+    datapaths = {fund: os.path.join(ETF_DIR, f'{fund}.csv') for fund in FUNDS}
+    return walkforward(datapaths,
+                       MomStrategy, [5, 20],
+                       FROMDATE,
+                       TODATE,
+                       CASH,
+                       COMMISSION,
+                       train_months=12,
+                       test_months=12,
+                       workers=1)
+
+
+def test_test_metrics_cover_test_window(report):
+    assert len(report['windows']) == 4
+    equity = report['equity']
+    for w in report['windows']:
+        test = w['test']
+        # 测试窗口的记录和拼接的收益都只包含测试窗口内的 K 线
+        assert test['total_return'] == pytest.approx(w['test_return'])
+        assert test['final_value'] == pytest.approx(CASH *
+                                                     (1.0 + w['test_return']))
+        window = equity[(equity.index >= w['test_start'])
+                        & (equity.index <= w['test_end'])]
+        days = (window.index[-1] - window.index[0]).total_seconds() / 86400.0
+        assert test['annual_return'] == pytest.approx(
+            annualize(w['test_return'], days))
+
+    growth = 1.0
+    for w in report['windows']:
+        growth *= 1.0 + w['test_return']
+    assert report['total_return'] == pytest.approx(growth - 1.0)
+    assert equity.index[0] >= report['windows'][0]['test_start']